@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+ingests an irc log (--log, raw lines or plain text, or a synthetic chatter
+log) into a MarkovBrain, once writing every line as it arrives, the way
+add_line_to_index used to be called, and once in WRITE_BATCH sized batches
+as the plugin now does.  then reopens the database, as after a restart, and
+times the first reply.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iobot.event import IrcEvent
+from iobot.plugins.markov_brain import MarkovBrain
+
+
+def synthetic_log(lines, vocabulary=5000):
+    rnd = random.Random(1)
+    words = ['w%d' % i for i in range(vocabulary)]
+    for i in range(lines):
+        text = ' '.join(rnd.choice(words[:rnd.choice((50, 500, vocabulary))])
+                for _ in range(rnd.randint(3, 15)))
+        yield ':user%d!u@h PRIVMSG #chan :%s' % (i % 200, text)
+
+
+def load_log(path):
+    with open(path) as fp:
+        for line in fp:
+            line = line.rstrip('\r\n')
+            if line:
+                yield line if line.startswith(':') else (
+                        ':user!u@h PRIVMSG #chan :' + line)
+
+
+def tokens_from(lines):
+    for line in lines:
+        event = IrcEvent('iobot', line)
+        if event.type == 'PRIVMSG' and event.text:
+            yield event.text.split()
+
+
+def ingest(path, lines, batch):
+    brain = MarkovBrain(path)
+    start = time.time()
+    for i, tokens in enumerate(lines, 1):
+        brain.add_line_to_index(tokens)
+        if i % batch == 0:
+            brain.write()
+    brain.write()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--log')
+    parser.add_argument('--lines', type=int, default=100000,
+            help='synthetic lines, without --log')
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--unbatched-lines', type=int, default=5000,
+            help='lines to time for the per line run, it is slow')
+    args = parser.parse_args()
+
+    raw = load_log(args.log) if args.log else synthetic_log(args.lines)
+    lines = list(tokens_from(raw))
+    tmp = tempfile.mkdtemp()
+    try:
+        sample = lines[:args.unbatched_lines]
+        elapsed = ingest(os.path.join(tmp, 'single.db'), sample, 1)
+        print('per line  %7d lines %8.0f lines/s' % (len(sample),
+            len(sample) / elapsed))
+
+        path = os.path.join(tmp, 'batched.db')
+        elapsed = ingest(path, lines, args.batch)
+        print('batch %-3d %7d lines %8.0f lines/s  %.1f MiB' % (args.batch,
+            len(lines), len(lines) / elapsed,
+            os.path.getsize(path) / 1048576.0))
+
+        start = time.time()
+        brain = MarkovBrain(path)
+        reply = brain.generate(relevant_terms=random.choice(lines))
+        brain.score_for_line(reply)
+        print('restart   first reply after %.1fms' % (
+            (time.time() - start) * 1000))
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
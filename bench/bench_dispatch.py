@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+dispatches synthetic events across loaded plugins, once through the
+precompiled handler tables and once through the old getattr-per-event
+process_hooks/process_plugins
+"""
+import argparse
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iobot.bot import IOBot
+from iobot.event import IrcEvent
+from iobot.plugins.decorators import plugin_command, plugin_hook
+
+HOOKS = ('privmsg', 'join', 'part', 'quit', 'nick', 'mode', 'notice')
+
+
+class GetattrIOBot(IOBot):
+    """ IOBot with the dispatch it had before the handler tables """
+    def process_plugins(self, connection, event):
+        plugin = self._commands.get(event.command) if event.command else None
+        if plugin and hasattr(plugin, event.command):
+            plugin_method = getattr(plugin, event.command)
+            try:
+                plugin_method(connection, event)
+            except Exception as e:
+                connection.reply(event, str(e))
+
+    def process_hooks(self, connection, event):
+        plugins = self._hooks.get(event.type)
+        if plugins:
+            for plugin in plugins:
+                plugin_method = getattr(plugin, 'on_%s' %
+                        str(event.type).lower())
+                try:
+                    plugin_method(connection, event)
+                except Exception as e:
+                    connection.reply(event, str(e))
+
+
+class BenchConnection(object):
+    """ just enough of an IrcConnection for run_handler """
+    inflight = 0
+
+
+def make_handler(name):
+    def handler(self, conn, event):
+        pass
+    handler.__name__ = name
+    return handler
+
+
+def make_plugin(n, hooks):
+    attrs = {}
+    for hook in hooks:
+        name = 'on_%s' % hook
+        attrs[name] = plugin_hook(make_handler(name))
+    name = 'cmd%d' % n
+    attrs[name] = plugin_command(make_handler(name))
+    return type('Plugin%d' % n, (object,), attrs)
+
+
+def make_events(count, plugins):
+    rnd = random.Random(1)
+    lines = []
+    for i in range(count):
+        kind = rnd.choice(HOOKS + ('command', '353', 'PING'))
+        if kind == 'command':
+            lines.append(':u!u@h PRIVMSG #c :iobot: cmd%d arg'
+                    % rnd.randrange(plugins))
+        elif kind == 'PING':
+            lines.append('PING :irc.example.net')
+        elif kind == '353':
+            lines.append(':irc 353 iobot = #c :a b c')
+        else:
+            lines.append(':u!u@h %s #c :text' % kind.upper())
+    events = [IrcEvent('iobot', l) for l in lines]
+    # parse up front so only dispatch is timed
+    for e in events:
+        e.command
+    return events
+
+
+def run(bot_cls, events, plugins):
+    bot = bot_cls({}, ';', 'iobot', 'iobot', 'iobot')
+    rnd = random.Random(2)
+    for n in range(plugins):
+        hooks = rnd.sample(HOOKS, rnd.randint(1, len(HOOKS)))
+        bot.add_plugin('plugin%d' % n, make_plugin(n, hooks))
+    conn = BenchConnection()
+    start = time.time()
+    for event in events:
+        bot.process_hooks(conn, event)
+        bot.process_plugins(conn, event)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--plugins', type=int, default=20)
+    args = parser.parse_args()
+
+    events = make_events(args.events, args.plugins)
+    print('%d events across %d plugins' % (args.events, args.plugins))
+    for name, cls in (('getattr', GetattrIOBot), ('tables', IOBot)):
+        best = min(run(cls, events, args.plugins) for _ in range(3))
+        print('%-8s %7.3fs %10.0f events/s' % (name, best,
+            args.events / best))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+compares the lazy, slotted IrcEvent with the eager __dict__ based class it
+replaced: construction throughput when only the type is read (the common
+case of a line no hook or command cares about), when every field is read,
+and resident memory for a channel's worth of retained events.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iobot.event import IrcEvent, split_line, split_origin, split_params
+
+
+class EagerIrcEvent(object):
+    """ the IrcEvent that filled every field in __init__ """
+    COMMAND_REGEX = IrcEvent.COMMAND_REGEX
+
+    def __init__(self, my_nick, raw=None):
+        self.raw = raw
+        self.my_nick = my_nick
+        self.type = None
+        self.tags = {}
+        self.origin = None
+        self.nick = None
+        self.user = None
+        self.host = None
+        self.destination = None
+        self.text = None
+        self.parameters = []
+        self.parameters_raw = None
+        self.command = None
+        self.command_params = None
+        self.command_params_raw = None
+        if raw:
+            self._parse()
+
+    def _parse(self):
+        if self.raw[-2:] == '\r\n':
+            line = self.raw[:-2]
+        else:
+            line = self.raw
+        tags_raw, self.origin, command, rest = split_line(line)
+        self.type = command.upper()
+        self.nick, self.user, self.host = split_origin(self.origin)
+        (self.destination, self.parameters_raw, self.parameters,
+                self.text) = split_params(rest)
+        if self.type == 'PRIVMSG' and self.text is not None:
+            m = self.COMMAND_REGEX.match(self.text)
+            if m and m.group('target') in (self.my_nick, 'all'):
+                self.command = m.group('command')
+                params_raw = m.group('params')
+                self.command_params_raw = params_raw or ''
+                self.command_params = (params_raw.split() if params_raw
+                        else [])
+        if self.type in ['JOIN', 'PART'] and not self.destination:
+            self.destination = self.text
+
+CLASSES = {'eager': EagerIrcEvent, 'lazy': IrcEvent}
+FIELDS = ('nick', 'user', 'host', 'destination', 'text', 'parameters',
+        'command', 'command_params')
+
+
+def traffic(count):
+    lines = []
+    for i in range(count):
+        lines.append(':user%d!~u%d@host%d.example.com PRIVMSG #busy '
+                ':message number %d with a few more words in it\r\n'
+                % (i % 500, i % 500, i % 500, i))
+    return lines
+
+
+def throughput(cls, lines, number):
+    def type_only():
+        for l in lines:
+            cls('iobot', l).type
+    def all_fields():
+        for l in lines:
+            e = cls('iobot', l)
+            for f in FIELDS:
+                getattr(e, f)
+    result = {}
+    for name, fn in (('type only', type_only), ('all fields', all_fields)):
+        t = min(timeit.repeat(fn, number=number, repeat=3))
+        result[name] = len(lines) * number / t
+    return result
+
+
+def retained_rss(cls_name, count):
+    """ run in a child so each class starts from a clean heap """
+    lines = traffic(count)
+    cls = CLASSES[cls_name]
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    events = [cls('iobot', l) for l in lines]
+    for e in events:
+        e.type
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(after - before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--number', type=int, default=3)
+    parser.add_argument('--rss', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.rss:
+        return retained_rss(args.rss, args.lines)
+
+    lines = traffic(args.lines)
+    print('%d PRIVMSG lines' % len(lines))
+    for name, cls in sorted(CLASSES.items()):
+        rates = throughput(cls, lines, args.number)
+        rss = subprocess.check_output([sys.executable, __file__,
+            '--lines', str(args.lines), '--rss', name])
+        print('%-6s type only %9.0f ev/s  all fields %9.0f ev/s  '
+                'retained %6d KiB' % (name, rates['type only'],
+                    rates['all fields'], int(rss)))
+
+if __name__ == '__main__':
+    main()
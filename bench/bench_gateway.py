@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+load tests the http gateway.  starts a bot with no servers and the echo
+plugin in a child process, or targets a running one with --address and
+--port, then keeps --concurrency keep-alive connections busy sending GET
+/commands/echo, or with --batch N POST /batch requests of N echoes read as
+they stream in.  prints requests and commands a second and latency
+percentiles.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream
+
+from iobot.bot import IOBot
+
+
+def run_bot(port, ready):
+    IOLoop().make_current()
+    bot = IOBot({}, ';', 'iobot', 'iobot', 'iobot')
+    bot.load_plugin('echo')
+    bot.start_gateway(port)
+    ready.set()
+    bot.start()
+
+
+def request_for(args):
+    if args.batch:
+        body = json.dumps({'commands': [{'command': 'echo',
+            'args': 'hello %d' % i} for i in range(args.batch)]})
+        return ('POST /batch HTTP/1.1\r\nHost: bench\r\n'
+                'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+    return ('GET /commands/echo?args=hello HTTP/1.1\r\nHost: bench\r\n\r\n')
+
+
+@gen.coroutine
+def read_response(stream):
+    """ reads one response off a keep-alive stream, chunked or not """
+    head = yield stream.read_until('\r\n\r\n')
+    status = int(head.split(' ', 2)[1])
+    headers = dict((k.strip().lower(), v.strip()) for k, _, v in
+            (line.partition(':') for line in head.split('\r\n')[1:] if line))
+    if headers.get('transfer-encoding') == 'chunked':
+        body = []
+        while True:
+            size = int((yield stream.read_until('\r\n')).strip(), 16)
+            chunk = yield stream.read_bytes(size + 2)
+            if not size:
+                break
+            body.append(chunk[:-2])
+        body = ''.join(body)
+    else:
+        body = yield stream.read_bytes(int(headers['content-length']))
+    raise gen.Return((status, body))
+
+
+@gen.coroutine
+def client(address, port, request, count, latencies):
+    stream = IOStream(socket.socket())
+    yield stream.connect((address, port))
+    for _ in range(count):
+        start = time.time()
+        yield stream.write(request)
+        status, body = yield read_response(stream)
+        if status != 200:
+            raise Exception('%d %s' % (status, body))
+        latencies.append(time.time() - start)
+    stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=0,
+            help='echoes per POST /batch, 0 for single GETs')
+    args = parser.parse_args()
+
+    child = None
+    port = args.port
+    if port is None:
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        ready = multiprocessing.Event()
+        child = multiprocessing.Process(target=run_bot, args=(port, ready))
+        child.daemon = True
+        child.start()
+        ready.wait()
+
+    request = request_for(args)
+    latencies = []
+    per_client = args.requests // args.concurrency
+    ioloop = IOLoop.current()
+    start = time.time()
+    ioloop.run_sync(lambda: gen.multi([client(args.address, port, request,
+        per_client, latencies) for _ in range(args.concurrency)]))
+    elapsed = time.time() - start
+    if child is not None:
+        child.terminate()
+
+    latencies.sort()
+    def pct(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+    print('%d requests over %d connections in %.2fs' % (len(latencies),
+        args.concurrency, elapsed))
+    print('%8.0f requests/s  %8.0f commands/s' % (len(latencies) / elapsed,
+        len(latencies) * max(args.batch, 1) / elapsed))
+    print('latency p50 %.2fms  p99 %.2fms  max %.2fms' % (pct(0.5) * 1000,
+        pct(0.99) * 1000, latencies[-1] * 1000))
+
+if __name__ == '__main__':
+    main()
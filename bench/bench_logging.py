@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+pushes chat lines (--log, raw irc lines, or a synthetic channel) through
+IrcConnection.read_lines, replying to every --reply-every'th one, with debug
+logging off, with it on and written to /dev/null, and with debug off but
+raw traffic captured to a rotating file.  prints lines/sec for each.
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tornado.ioloop import IOLoop
+
+from iobot.capture import RawCapture
+from iobot.irc import IrcConnection
+from bench_read import load_burst
+
+
+class NullBot(object):
+    def process_hooks(self, connection, event):
+        pass
+
+    def process_plugins(self, connection, event):
+        pass
+
+
+def synthetic_lines(count):
+    rnd = random.Random(1)
+    words = ['w%d' % i for i in range(2000)]
+    lines = []
+    for i in range(count):
+        nick = 'user%d' % rnd.randrange(300)
+        kind = rnd.random()
+        if kind < 0.9:
+            lines.append(':%s!u@host PRIVMSG #chan :%s' % (nick,
+                ' '.join(rnd.choice(words) for _ in range(rnd.randint(3, 15)))))
+        elif kind < 0.95:
+            lines.append(':%s!u@host JOIN #chan' % nick)
+        else:
+            lines.append(':%s!u@host PART #chan :bye' % nick)
+    return lines
+
+
+def run(lines, reply_every, level, capture=None):
+    ioloop = IOLoop()
+    ioloop.make_current()
+    conn = IrcConnection(NullBot(), 'bench', 'localhost', 6667, 'iobot',
+            'iobot', 'iobot', [], capture=capture)
+    conn.logger.setLevel(level)
+    # the send queue would otherwise hold every reply
+    conn._sendq.push = lambda data: None
+    start = time.time()
+    for i in range(0, len(lines), reply_every):
+        conn.read_lines(lines[i:i + reply_every])
+        conn.private_message('#chan', 'a reply')
+    elapsed = time.time() - start
+    ioloop.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--log')
+    parser.add_argument('--lines', type=int, default=200000,
+            help='synthetic lines, without --log')
+    parser.add_argument('--reply-every', type=int, default=10)
+    args = parser.parse_args()
+
+    lines = load_burst(args.log) if args.log else synthetic_lines(args.lines)
+    devnull = open(os.devnull, 'w')
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter(
+        '%(asctime)s %(name)s %(levelname)s %(message)s'))
+    logging.getLogger('iobot').addHandler(handler)
+    logging.getLogger('iobot').propagate = False
+
+    elapsed = run(lines, args.reply_every, logging.WARNING)
+    print('debug off  %8.0f lines/s' % (len(lines) / elapsed))
+    elapsed = run(lines, args.reply_every, logging.DEBUG)
+    print('debug on   %8.0f lines/s' % (len(lines) / elapsed))
+
+    tmp = tempfile.mkdtemp()
+    try:
+        capture = RawCapture(os.path.join(tmp, 'raw.log'))
+        elapsed = run(lines, args.reply_every, logging.WARNING, capture)
+        print('capture    %8.0f lines/s  (%d dropped)' % (
+            len(lines) / elapsed, capture.dropped))
+        capture.close()
+    finally:
+        shutil.rmtree(tmp)
+    devnull.close()
+
+if __name__ == '__main__':
+    main()
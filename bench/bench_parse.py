@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+times the old EVENT_PATTERN regex parse against the hand written IrcEvent
+parser over the conformance corpus in test/irc_corpus.py
+"""
+import argparse
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'test'))
+
+from irc_corpus import AGREED, LEGACY_EVENT_PATTERN, corpus
+from iobot.event import IrcEvent
+
+
+class RegexIrcEvent(IrcEvent):
+    """ IrcEvent with the EVENT_PATTERN based _parse it used to have """
+    def _parse(self):
+        if self.raw[-2:] == '\r\n':
+            line = self.raw[:-2]
+        else:
+            line = self.raw
+        m = LEGACY_EVENT_PATTERN.match(line)
+        self.origin = m.group('prefix')
+        command = m.group('command')
+        self.type = command.upper() if command else m.group('numeric')
+        self.destination = m.group('destination')
+        self.nick = m.group('nick')
+        self.user = m.group('user')
+        self.host = m.group('host')
+        self.text = m.group('text')
+        self.parameters_raw = m.group('parameters')
+        self.parameters = (self.parameters_raw.split() if
+                self.parameters_raw else [])
+
+        if self.type == 'PRIVMSG':
+            self._parse_command()
+        if self.type in ['JOIN', 'PART'] and not self.destination:
+            self.destination = self.text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    # the regex can't parse tagged lines at all, so only time the lines it
+    # understands when comparing the two
+    suites = (('agreed', AGREED), ('full corpus', corpus()))
+    for name, lines in suites:
+        print('%s: %d lines x %d' % (name, len(lines), args.number))
+        if name == 'agreed':
+            t = min(timeit.repeat(
+                    lambda: [RegexIrcEvent('iobot', l) for l in lines],
+                    number=args.number, repeat=3))
+            print('  %-8s %8.2f us/line' % ('regex',
+                t * 1e6 / (args.number * len(lines))))
+        t = min(timeit.repeat(lambda: [IrcEvent('iobot', l) for l in lines],
+                number=args.number, repeat=3))
+        print('  %-8s %8.2f us/line' % ('split',
+            t * 1e6 / (args.number * len(lines))))
+
+if __name__ == '__main__':
+    main()
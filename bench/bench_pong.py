@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+measures PING -> PONG turnaround while a plugin is busy generating replies.
+a server thread sends a PING every few milliseconds alongside a stream of
+queries that each cost --work ms of cpu, and times the PONGs.  the work is
+either done inline on the IOLoop (the old markov do_reply) or submitted to
+the bot's thread or process executor.
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.iostream import IOStream
+
+from iobot.bot import IOBot
+from iobot.irc import IrcConnection
+from iobot.plugins.decorators import plugin_hook
+
+
+def burn(ms):
+    """ stands in for load_reply_from_markov """
+    end = time.time() + ms / 1000.0
+    n = 0
+    while time.time() < end:
+        n += 1
+    return n
+
+
+def make_plugin(mode, work):
+    class BusyPlugin(object):
+        @plugin_hook
+        def on_privmsg(self, conn, event):
+            if mode == 'inline':
+                burn(work)
+            else:
+                return conn.bot.submit(burn, work)
+    return BusyPlugin
+
+
+def server(sock, pings, queries_per_ping, interval, results):
+    fp = sock.makefile('rb')
+    sent = {}
+
+    def reader():
+        for line in iter(fp.readline, ''):
+            if line.startswith('PONG'):
+                token = line.split()[1].lstrip(':')
+                results.append(time.time() - sent.pop(token))
+                if len(results) == pings:
+                    return
+
+    t = threading.Thread(target=reader)
+    t.start()
+    for i in range(pings):
+        for q in range(queries_per_ping):
+            sock.sendall(':u!u@h PRIVMSG #c :iobot: say something\r\n')
+        token = str(i)
+        sent[token] = time.time()
+        sock.sendall('PING :%s\r\n' % token)
+        time.sleep(interval)
+    t.join()
+
+
+def run(mode, args):
+    ioloop = IOLoop()
+    ioloop.make_current()
+    bot = IOBot({}, ';', 'iobot', 'iobot', 'iobot',
+            executor=mode if mode != 'inline' else 'thread',
+            workers=args.workers)
+    bot.add_plugin('busy', make_plugin(mode, args.work))
+
+    bot_sock, server_sock = socket.socketpair()
+    conn = IrcConnection(bot, 'bench', 'localhost', 6667, 'iobot', 'iobot',
+            'iobot', [], flood_rate=0)
+    conn._stream = IOStream(bot_sock)
+    conn._next()
+
+    results = []
+    t = threading.Thread(target=server, args=(server_sock, args.pings,
+        args.queries, args.interval / 1000.0, results))
+    t.start()
+
+    def check():
+        if not t.is_alive():
+            ioloop.stop()
+    PeriodicCallback(check, 50, io_loop=ioloop).start()
+    ioloop.start()
+
+    bot.executor.shutdown()
+    conn._stream.close()
+    server_sock.close()
+    ioloop.close(all_fds=True)
+    results.sort()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pings', type=int, default=100)
+    parser.add_argument('--queries', type=int, default=2,
+            help='queries sent before each ping')
+    parser.add_argument('--interval', type=float, default=20,
+            help='ms between pings')
+    parser.add_argument('--work', type=float, default=15,
+            help='ms of cpu per reply')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    print('%d pings, %d replies of %.0fms cpu each per ping' % (
+        args.pings, args.queries, args.work))
+    for mode in ('inline', 'thread', 'process'):
+        rtt = run(mode, args)
+        print('%-8s pong p50 %7.1fms  p99 %7.1fms  max %7.1fms' % (mode,
+            rtt[len(rtt) // 2] * 1000, rtt[int(len(rtt) * 0.99)] * 1000,
+            rtt[-1] * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+replays an inbound burst (a NAMES flood followed by a netsplit rejoin, or a
+recorded log passed with --log) through IrcConnection over a local socket,
+once with the per-line read_until path and once with batched reads.
+"""
+import argparse
+import logging
+import os
+import socket
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream
+
+from iobot.irc import IrcConnection, EOL
+
+
+class CountingBot(object):
+    def __init__(self, expected, done):
+        self.expected = expected
+        self.done = done
+        self.seen = 0
+
+    def process_hooks(self, connection, event):
+        pass
+
+    def process_plugins(self, connection, event):
+        self.seen += 1
+        if self.seen == self.expected:
+            self.done()
+
+
+def synthetic_burst(channels=50, users=400):
+    lines = []
+    for c in range(channels):
+        chan = '#chan%d' % c
+        lines.append(':iobot!iobot@bot.host JOIN :%s' % chan)
+        nicks = ['user%d' % u for u in range(users)]
+        for i in range(0, users, 40):
+            lines.append(':irc.server 353 iobot = %s :%s' % (
+                chan, ' '.join(nicks[i:i + 40])))
+        lines.append(':irc.server 366 iobot %s :End of /NAMES list.' % chan)
+    for c in range(channels):
+        for u in range(users):
+            lines.append(':user%d!u%d@host%d.example.com JOIN %s' % (
+                u, u, u, '#chan%d' % c))
+    return lines
+
+
+def load_burst(path):
+    with open(path) as fp:
+        return [l.rstrip('\r\n') for l in fp if l.strip()]
+
+
+def run(lines, batch_reads):
+    ioloop = IOLoop()
+    ioloop.make_current()
+    reader_sock, writer_sock = socket.socketpair()
+    payload = ''.join(l + EOL for l in lines)
+
+    bot = CountingBot(len(lines), ioloop.stop)
+    conn = IrcConnection(bot, 'bench', 'localhost', 6667, 'iobot', 'iobot',
+            'iobot', [], batch_reads=batch_reads)
+    conn.logger.setLevel(logging.WARNING)
+    conn._stream = IOStream(reader_sock)
+    writer = IOStream(writer_sock)
+
+    start = time.time()
+    conn._next()
+    writer.write(payload)
+    ioloop.start()
+    elapsed = time.time() - start
+
+    conn._stream.close()
+    writer.close()
+    ioloop.close(all_fds=True)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--log', help='recorded raw irc lines to replay')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    lines = load_burst(args.log) if args.log else synthetic_burst()
+    print('%d lines per round, best of %d' % (len(lines), args.rounds))
+    for name, batch_reads in (('read_until', False), ('batched', True)):
+        best = min(run(lines, batch_reads) for _ in range(args.rounds))
+        print('%-12s %8.3fs %10.0f lines/s' % (name, best, len(lines) / best))
+
+if __name__ == '__main__':
+    main()
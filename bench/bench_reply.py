@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+reply latency against brain size.  for each --sizes brain (lines learned
+from a synthetic chatter log) times --replies replies to random queries,
+once the old way, 100 separate generate and score_for_line passes with
+every lookup going to the database, and once with MarkovBrain.reply,
+which shares a lookup cache between candidates, scores them in batches
+and stops early at REPLY_THRESHOLD.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from operator import itemgetter
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iobot.plugins import markov_brain
+from iobot.plugins.markov_brain import MarkovBrain
+from bench_brain import synthetic_log, tokens_from
+
+
+def sequential_reply(markov, tokens):
+    """ load_reply_from_markov before batching """
+    replies = dict()
+    for i in range(100):
+        num_rel_terms = random.randint(0, len(tokens))
+        if num_rel_terms != 0:
+            rel_terms = random.sample(tokens, num_rel_terms)
+            possible_reply = markov.generate(relevant_terms=rel_terms)
+        else:
+            possible_reply = markov.generate()
+        score = markov.score_for_line(possible_reply)
+        replies[tuple(possible_reply)] = score
+    return max(replies.iteritems(), key=itemgetter(1))[0]
+
+
+def percentiles(times):
+    times.sort()
+    return (times[len(times) // 2] * 1000,
+            times[min(len(times) - 1, int(len(times) * 0.99))] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--replies', type=int, default=50)
+    args = parser.parse_args()
+
+    print('numpy %s' % ('yes' if markov_brain.numpy is not None else 'no'))
+    tmp = tempfile.mkdtemp()
+    try:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            lines = list(tokens_from(synthetic_log(size)))
+            brain = MarkovBrain(os.path.join(tmp, '%d.db' % size))
+            for tokens in lines:
+                brain.add_line_to_index(tokens)
+            brain.write()
+            queries = [random.choice(lines)[:5] + ['iobot']
+                    for _ in range(args.replies)]
+            for name, fn in (('sequential', sequential_reply),
+                    ('batched', lambda b, q: b.reply(q))):
+                times = []
+                for query in queries:
+                    start = time.time()
+                    fn(brain, query)
+                    times.append(time.time() - start)
+                print('%7d lines %-10s p50 %7.1fms  p99 %7.1fms' % ((size,
+                    name) + percentiles(times)))
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+tokenizes a corpus of chat lines (--log, raw irc or plain text, or a
+synthetic one) with the old nltk.word_tokenize plus per token regex glue,
+the nltk high fidelity mode, and the default single pass tokenizer.  the
+old path is timed over the lines it doesn't crash on.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iobot.plugins import markov_bot
+from iobot.plugins.markov_bot import tokenize_line
+from bench_brain import load_log, tokens_from
+
+WORDS = ("i you it we they the a an is was don't can't won't cannot gonna "
+        "what why how ok lol hmm yes no really? wait... (maybe) [sic] "
+        "http://example.com/ foo@example.com 3:45 100% , - +1 iobot: "
+        "that's it's we'll they're \"quoted\"").split()
+
+
+def synthetic_lines(count):
+    rnd = random.Random(1)
+    return [' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 20)))
+            for _ in range(count)]
+
+
+word_pattern = re.compile(r'\w+')
+def old_tokenize_line(line):
+    """ tokenize_line and untokenize_special_characters as they were """
+    tokens = markov_bot.nltk.word_tokenize(line, preserve_line=True)
+    repaired_tokens = []
+    pos = 0
+    while pos < len(tokens):
+        token = tokens[pos]
+        if (not word_pattern.match(token) and
+                not re.search(r'\s%s\s' % token, line)):
+            if re.search(r'\s%s' % token, line):
+                token = token + tokens[pos + 1]
+                repaired_tokens.append(token)
+                pos += 2
+            elif re.search(r'%s\s' % token, line):
+                prev_token = repaired_tokens[-1]
+                repaired_tokens[-1] = prev_token + token
+                pos += 1
+            else:
+                prev_token = repaired_tokens[-1]
+                repaired_tokens[-1] = prev_token + token
+                if len(tokens) > pos + 1:
+                    required_tokens[-1] += tokens[pos + 1]
+                pos += 2
+        else:
+            repaired_tokens.append(token)
+            pos += 1
+    return repaired_tokens
+
+
+def run(name, fn, lines):
+    crashed = 0
+    start = time.time()
+    for line in lines:
+        try:
+            fn(line)
+        except Exception:
+            crashed += 1
+    elapsed = time.time() - start
+    print('%-14s %9.0f lines/s  %d crashed' % (name, len(lines) / elapsed,
+        crashed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--log')
+    parser.add_argument('--lines', type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.log:
+        lines = [' '.join(t) for t in tokens_from(load_log(args.log))]
+    else:
+        lines = synthetic_lines(args.lines)
+    print('%d lines' % len(lines))
+    if markov_bot.load_nltk():
+        run('old nltk+regex', old_tokenize_line, lines)
+        run('nltk', lambda l: tokenize_line(l, high_fidelity=True), lines)
+    else:
+        print('nltk is not installed, skipping the nltk tokenizers')
+    run('single pass', tokenize_line, lines)
+
+if __name__ == '__main__':
+    main()
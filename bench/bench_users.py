@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+resident memory for a simulated network of --users people spread over
+--channels channels, seen by --connections connections to that network.
+'lists' is the old model: a fresh __dict__ IrcUser per NAMES entry in a
+per-channel list.  'indexed' is IrcState with a shared, interned
+UserRegistry, with user@host filled in as WHO would.
+"""
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from iobot.state import IrcState, UserRegistry
+
+
+class DictIrcUser(object):
+    """ IrcUser before it was slotted """
+    def __init__(self, nick, user=None, host=None):
+        self.nick = nick
+        self.user = user
+        self.host = host
+
+
+def memberships(args):
+    """
+    yields (channel, nick, user, host) as freshly built strings, the way
+    each parsed line hands them to us
+    """
+    rnd = random.Random(1)
+    for u in range(args.users):
+        for c in rnd.sample(range(args.channels), rnd.randint(1, 5)):
+            yield ('#channel%d' % c, 'user%05d' % u, '~u%05d' % u,
+                    'host-%05d.users.example.net' % u)
+
+
+def build_lists(args):
+    connections = []
+    for _ in range(args.connections):
+        channels = dict(('#channel%d' % c, []) for c in range(args.channels))
+        users = {}
+        for channel, nick, user, host in memberships(args):
+            ircuser = DictIrcUser(nick)
+            channels[channel].append(ircuser)
+            users[nick] = ircuser
+        connections.append((channels, users))
+    return connections
+
+
+def build_indexed(args):
+    registry = UserRegistry()
+    states = []
+    for _ in range(args.connections):
+        state = IrcState(registry=registry)
+        for c in range(args.channels):
+            state.add_channel('#channel%d' % c)
+        for channel, nick, user, host in memberships(args):
+            state.join(channel, nick, user, host)
+        states.append(state)
+    return states
+
+
+def measure(name, args):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    model = {'lists': build_lists, 'indexed': build_indexed}[name](args)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(after - before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--channels', type=int, default=500)
+    parser.add_argument('--connections', type=int, default=2)
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        return measure(args.measure, args)
+
+    print('%d users, %d channels, %d connections' % (args.users,
+        args.channels, args.connections))
+    for name in ('lists', 'indexed'):
+        rss = subprocess.check_output([sys.executable, __file__,
+            '--users', str(args.users), '--channels', str(args.channels),
+            '--connections', str(args.connections), '--measure', name])
+        print('%-8s %8d KiB' % (name, int(rss)))
+
+if __name__ == '__main__':
+    main()
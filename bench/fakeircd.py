@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+"""
+a single threaded fake ircd on a tornado IOLoop, for load testing.  a bot
+that connects is registered, has every channel it joins filled with
+simulated users, and is then sent synthetic PRIVMSG/JOIN/PART/NICK/QUIT
+traffic at the configured rates or a recorded log replayed at --speed
+times its original pace.
+
+some messages address the bot as "<nick>: echo lat <n>" so the time to
+the echo plugin's reply can be measured, and a PING every PING_INTERVAL
+measures how far behind the traffic the bot is running.  run on its own it
+serves --port and prints what it sees every few seconds, bench/loadgen.py
+drives a bot against it and reports.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from collections import deque
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.iostream import StreamClosedError
+from tornado.tcpserver import TCPServer
+
+from iobot.metrics import Histogram
+
+SERVER_NAME = 'fake.ircd'
+EOL = '\r\n'
+# seconds between traffic ticks, and between our PINGs to the bot
+TICK = 0.01
+PING_INTERVAL = 0.5
+NAMES_PER_LINE = 40
+WORDS = ('the a and to of i you it is that in was for on are with as be at '
+        'this have but not what all were when we there can an your which '
+        'their if do will each about how up out them then she many some so '
+        'lol ok yeah hmm really nice thanks wait why because maybe').split()
+
+# events per second
+DEFAULT_RATES = {
+    'PRIVMSG': 2000,
+    'JOIN': 20,
+    'PART': 20,
+    'NICK': 5,
+    'QUIT': 5,
+    # messages asking the bot to echo, timed to its reply
+    'PROMPT': 10,
+    }
+
+
+class Traffic(object):
+    """
+    synthetic users in channels.  event(kind) gives the line for one
+    PRIVMSG, JOIN, PART, NICK or QUIT, keeping who is where consistent.
+    """
+    def __init__(self, channels, users=5000, channels_per_user=3, seed=1):
+        self.rnd = random.Random(seed)
+        self.channels = list(channels)
+        self.nicks = ['user%d' % i for i in range(users)]
+        self.members = dict((c, set()) for c in self.channels)
+        self.joined = [set() for _ in self.nicks]
+        self.parted = deque()
+        for i in range(users):
+            for channel in self.rnd.sample(self.channels,
+                    min(channels_per_user, len(self.channels))):
+                self.joined[i].add(channel)
+                self.members[channel].add(self.nicks[i])
+
+    def prefix(self, i):
+        return '%s!u%d@host%d.example.com' % (self.nicks[i], i, i)
+
+    def active_user(self):
+        while True:
+            i = self.rnd.randrange(len(self.nicks))
+            if self.joined[i]:
+                return i
+
+    def text(self):
+        return ' '.join(self.rnd.choice(WORDS)
+                for _ in range(self.rnd.randint(2, 15)))
+
+    def privmsg(self, text=None):
+        i = self.active_user()
+        channel = self.rnd.choice(tuple(self.joined[i]))
+        return ':%s PRIVMSG %s :%s' % (self.prefix(i), channel,
+                text or self.text())
+
+    def join(self):
+        # rejoin whoever quit or parted first, so the crowd stays the same
+        if self.parted:
+            i, channel = self.parted.popleft()
+        else:
+            i = self.rnd.randrange(len(self.nicks))
+            channel = self.rnd.choice(self.channels)
+            if channel in self.joined[i]:
+                return self.part()
+        self.joined[i].add(channel)
+        self.members[channel].add(self.nicks[i])
+        return ':%s JOIN %s' % (self.prefix(i), channel)
+
+    def part(self):
+        i = self.active_user()
+        channel = self.rnd.choice(tuple(self.joined[i]))
+        self.joined[i].discard(channel)
+        self.members[channel].discard(self.nicks[i])
+        self.parted.append((i, channel))
+        return ':%s PART %s :bye' % (self.prefix(i), channel)
+
+    def nick(self):
+        i = self.active_user()
+        old = self.prefix(i)
+        old_nick, new_nick = self.nicks[i], self.nicks[i] + '_'
+        if len(new_nick) > 16:
+            new_nick = 'user%d' % i
+        self.nicks[i] = new_nick
+        for channel in self.joined[i]:
+            self.members[channel].discard(old_nick)
+            self.members[channel].add(new_nick)
+        return ':%s NICK :%s' % (old, new_nick)
+
+    def quit(self):
+        i = self.active_user()
+        for channel in self.joined[i]:
+            self.members[channel].discard(self.nicks[i])
+            self.parted.append((i, channel))
+        self.joined[i] = set()
+        return ':%s QUIT :Quit: leaving' % self.prefix(i)
+
+    def event(self, kind):
+        return getattr(self, kind.lower())()
+
+
+def load_replay(path):
+    """
+    (offset seconds, line) pairs from a RawCapture file, only the lines the
+    bot read, or from raw irc lines without times, spaced 1ms apart
+    """
+    capture = re.compile(r'^(\d+\.\d+) \S+ ([<>]) (.*)$')
+    events = []
+    first = None
+    with open(path) as fp:
+        for n, line in enumerate(fp):
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            m = capture.match(line)
+            if m is None:
+                events.append((n * 0.001, line))
+                continue
+            if m.group(2) != '<':
+                continue
+            at = float(m.group(1))
+            if first is None:
+                first = at
+            events.append((at - first, m.group(3)))
+    return events
+
+
+class BotClient(object):
+    """ one connected bot, registered, joined and then sent traffic """
+    def __init__(self, server, stream):
+        self.server = server
+        self.stream = stream
+        self.nick = None
+        self.channels = []
+        self.started = None
+        self.lines_sent = 0
+        self.lines_received = 0
+        # lines sent as of each PING, and the PINGs waiting for a PONG
+        self.pings = dict()
+        self.ping_seq = 0
+        self.lines_acked = 0
+        self.lag = Histogram()
+        self.prompts = dict()
+        self.prompt_seq = 0
+        self.reply_latency = Histogram()
+        self.carry = dict()
+        self.outbox = []
+        self.replay = None
+        self.callbacks = []
+        stream.set_close_callback(self.on_close)
+        self.read()
+
+    def read(self):
+        try:
+            self.stream.read_until(EOL, self.on_line)
+        except StreamClosedError:
+            pass
+
+    def send(self, line):
+        self.outbox.append(line + EOL)
+        self.lines_sent += 1
+
+    def flush(self):
+        if self.outbox and not self.stream.closed():
+            data = ''.join(self.outbox)
+            self.outbox = []
+            try:
+                self.stream.write(data)
+            except StreamClosedError:
+                pass
+
+    def on_close(self):
+        for callback in self.callbacks:
+            callback.stop()
+        self.server.clients.discard(self)
+
+    def on_line(self, data):
+        self.lines_received += 1
+        line = data.rstrip(EOL)
+        command, _, rest = line.partition(' ')
+        handler = getattr(self, 'on_%s' % command.lower(), None)
+        if handler is not None:
+            handler(rest)
+        self.flush()
+        self.read()
+
+    def numeric(self, code, text):
+        self.send(':%s %s %s %s' % (SERVER_NAME, code, self.nick, text))
+
+    def on_nick(self, rest):
+        registered = self.nick is not None
+        self.nick = rest.lstrip(':')
+        if not registered:
+            self.numeric('001', ':Welcome to the fake network %s' % self.nick)
+            self.numeric('005', 'CHANTYPES=# PREFIX=(ov)@+ CASEMAPPING=rfc1459'
+                    ' :are supported by this server')
+            self.numeric('376', ':End of /MOTD command.')
+
+    def on_ping(self, rest):
+        self.send(':%s PONG %s %s' % (SERVER_NAME, SERVER_NAME, rest))
+
+    def on_pong(self, rest):
+        token = rest.rpartition(':')[2].strip()
+        sent = self.pings.pop(token, None)
+        if sent is not None:
+            at, lines = sent
+            self.lag.observe(time.time() - at)
+            self.lines_acked = max(self.lines_acked, lines)
+
+    def on_join(self, rest):
+        traffic = self.server.traffic
+        for channel in rest.lstrip(':').split(','):
+            members = sorted(traffic.members.get(channel, ()))
+            self.send(':%s!%s@bot.host JOIN %s' % (self.nick, self.nick,
+                channel))
+            for i in range(0, len(members), NAMES_PER_LINE):
+                self.numeric('353', '= %s :%s' % (channel,
+                    ' '.join(members[i:i + NAMES_PER_LINE])))
+            self.numeric('366', '%s :End of /NAMES list.' % channel)
+            self.channels.append(channel)
+        if self.started is None and set(traffic.channels) <= set(
+                self.channels):
+            self.start()
+
+    def on_who(self, rest):
+        self.numeric('315', '%s :End of /WHO list.' % rest.split()[0])
+
+    def on_privmsg(self, rest):
+        m = re.search(r':lat (\d+)$', rest)
+        if m is not None:
+            sent = self.prompts.pop(int(m.group(1)), None)
+            if sent is not None:
+                self.reply_latency.observe(time.time() - sent)
+
+    def start(self):
+        self.started = self.replay_started = time.time()
+        self.last_tick = self.started
+        ioloop = IOLoop.current()
+        if self.server.replay is not None:
+            self.replay = deque(self.server.replay)
+        self.callbacks = [PeriodicCallback(self.tick, TICK * 1000, ioloop),
+                PeriodicCallback(self.ping, PING_INTERVAL * 1000, ioloop)]
+        for callback in self.callbacks:
+            callback.start()
+
+    def ping(self):
+        self.ping_seq += 1
+        token = 'load-%d' % self.ping_seq
+        self.pings[token] = (time.time(), self.lines_sent)
+        self.send('PING :%s' % token)
+        self.flush()
+
+    def tick(self):
+        now = time.time()
+        elapsed, self.last_tick = now - self.last_tick, now
+        if self.replay is not None:
+            self.tick_replay(now)
+        else:
+            self.tick_traffic(elapsed)
+        self.flush()
+
+    def tick_replay(self, now):
+        offset = (now - self.replay_started) * self.server.speed
+        replay = self.replay
+        while replay and replay[0][0] <= offset:
+            self.send(replay.popleft()[1])
+        if not replay:
+            # around again
+            self.replay = deque(self.server.replay)
+            self.replay_started = now
+
+    def tick_traffic(self, elapsed):
+        traffic = self.server.traffic
+        for kind, rate in self.server.rates.items():
+            due = rate * elapsed + self.carry.get(kind, 0.0)
+            count = int(due)
+            self.carry[kind] = due - count
+            for _ in range(count):
+                if kind == 'PROMPT':
+                    self.prompt_seq += 1
+                    self.prompts[self.prompt_seq] = time.time()
+                    self.send(traffic.privmsg('%s: echo lat %d' % (self.nick,
+                        self.prompt_seq)))
+                else:
+                    self.send(traffic.event(kind))
+
+    def stats(self):
+        elapsed = time.time() - self.started if self.started else 0
+        return {
+            'elapsed': elapsed,
+            'sent': self.lines_sent,
+            'acked': self.lines_acked,
+            'received': self.lines_received,
+            'lag': self.lag,
+            'reply_latency': self.reply_latency,
+            'unanswered': len(self.prompts),
+            }
+
+
+class FakeIrcd(TCPServer):
+    def __init__(self, channels, rates=None, users=5000, channels_per_user=3,
+            replay=None, speed=1.0):
+        super(FakeIrcd, self).__init__()
+        self.traffic = Traffic(channels, users, channels_per_user)
+        self.rates = dict(DEFAULT_RATES)
+        self.rates.update(rates or {})
+        self.replay = replay
+        self.speed = speed
+        self.clients = set()
+
+    def handle_stream(self, stream, address):
+        self.clients.add(BotClient(self, stream))
+
+
+def add_arguments(parser):
+    parser.add_argument('--channels', type=int, default=200)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--channels-per-user', type=int, default=3)
+    for kind, rate in sorted(DEFAULT_RATES.items()):
+        parser.add_argument('--%s-rate' % kind.lower(), type=float,
+                default=rate, help='per second, default %(default)s')
+    parser.add_argument('--replay', help='a RawCapture file or raw irc lines'
+            ' to send instead of synthetic traffic')
+    parser.add_argument('--speed', type=float, default=1.0,
+            help='replay this many times faster than recorded')
+
+
+def ircd_from_args(args):
+    rates = dict((kind, getattr(args, '%s_rate' % kind.lower()))
+            for kind in DEFAULT_RATES)
+    replay = load_replay(args.replay) if args.replay else None
+    return FakeIrcd(['#chan%d' % i for i in range(args.channels)], rates,
+            args.users, args.channels_per_user, replay, args.speed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=6667)
+    add_arguments(parser)
+    args = parser.parse_args()
+    ircd = ircd_from_args(args)
+    ircd.listen(args.port)
+
+    def report():
+        for client in ircd.clients:
+            stats = client.stats()
+            print('%s: sent %d acked %d lag %s' % (client.nick, stats['sent'],
+                stats['acked'], stats['lag'].summary()))
+    PeriodicCallback(report, 5000).start()
+    IOLoop.current().start()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+the standard iobot load benchmark.  starts bench/fakeircd.py's FakeIrcd,
+runs a bot from build_bot in a child process connected to it with flood
+control off, lets the traffic run for --duration seconds and reports:
+
+  throughput     lines the bot had read by its latest PONG, per second
+  lag            how long our PINGs took to come back, ie how far behind
+                 the traffic the bot is
+  reply latency  from a "<nick>: echo" line being sent to its reply
+  memory         the bot's resident set, sampled each second, and peak
+
+rates, channel and user counts and --replay are as for fakeircd.py.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from fakeircd import add_arguments, ircd_from_args
+
+
+def run_bot(port, args):
+    IOLoop().make_current()
+    from iobot import build_bot
+    config = {'core': {'prefix': ';', 'nick': 'iobot', 'user': 'iobot',
+        'realname': 'iobot', 'plugins': args.plugins.split(','),
+        'metrics': args.metrics}}
+    servers = {'fake': {'address': '127.0.0.1', 'port': port,
+        'owners': ['nobody'], 'flood_rate': 0,
+        'channels': ['#chan%d' % i for i in range(args.channels)]}}
+    bot = build_bot(config, servers, profile_startup=True)
+    bot.start()
+
+
+def memory(pid):
+    """ (resident, peak resident) kB of a process, from /proc """
+    try:
+        with open('/proc/%d/status' % pid) as fp:
+            fields = dict(line.split(':', 1) for line in fp)
+    except IOError:
+        return None, None
+    def kb(name):
+        return int(fields[name].split()[0]) if name in fields else None
+    return kb('VmRSS'), kb('VmHWM')
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def ms(value):
+    return '%.1fms' % (value * 1000) if value is not None else '-'
+
+
+def report(stats, rss_samples, peak):
+    elapsed = stats['elapsed']
+    lag = stats['lag']
+    latency = stats['reply_latency']
+    print('ran %.1fs' % elapsed)
+    print('offered     %8.0f lines/s  (%d lines)' % (stats['sent'] / elapsed,
+        stats['sent']))
+    print('throughput  %8.0f lines/s  (%d lines read by the last PONG)' % (
+        stats['acked'] / elapsed, stats['acked']))
+    print('lag         mean %s  p50 <=%s  p99 <=%s  (%d pings)' % (
+        ms(lag.mean()), ms(lag.quantile(0.5)), ms(lag.quantile(0.99)),
+        lag.count))
+    print('reply       mean %s  p50 <=%s  p99 <=%s  (%d replies, %d '
+            'unanswered)' % (ms(latency.mean()), ms(latency.quantile(0.5)),
+                ms(latency.quantile(0.99)), latency.count,
+                stats['unanswered']))
+    if rss_samples:
+        print('memory      rss %.1f MiB at the end, %.1f MiB peak' % (
+            rss_samples[-1] / 1024.0, (peak or max(rss_samples)) / 1024.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--plugins', default='echo',
+            help='comma separated, echo is needed for reply latency')
+    parser.add_argument('--metrics', action='store_true')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    port = free_port()
+    ircd = ircd_from_args(args)
+    ircd.listen(port, '127.0.0.1')
+    bot = multiprocessing.Process(target=run_bot, args=(port, args))
+    bot.daemon = True
+    bot.start()
+
+    ioloop = IOLoop.current()
+    rss_samples = []
+    peak = [None]
+    def sample():
+        rss, peak[0] = memory(bot.pid)
+        if rss is not None:
+            rss_samples.append(rss)
+    PeriodicCallback(sample, 1000).start()
+
+    @gen.coroutine
+    def run():
+        while not any(client.started for client in ircd.clients):
+            if not bot.is_alive():
+                raise Exception('the bot exited with %s' % bot.exitcode)
+            yield gen.sleep(0.1)
+        yield gen.sleep(args.duration)
+        sample()
+        # whoever joined first, there is only the one bot
+        client = min((c for c in ircd.clients if c.started),
+                key=lambda c: c.started)
+        raise gen.Return(client.stats())
+
+    try:
+        stats = ioloop.run_sync(run)
+    finally:
+        bot.terminate()
+    report(stats, rss_samples, peak[0])
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,11 @@ from iobot import run_bot
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Tornado driven IRC bot')
     parser.add_argument('--config', help='iobot config', default='iobot.conf')
+    parser.add_argument('--shards', type=int, default=None,
+            help='worker processes to spread the servers over')
+    parser.add_argument('--profile-startup', action='store_true',
+            help='import every plugin up front and report how long each took')
     args = parser.parse_args()
     config_path = os.path.join(os.getcwd(), args.config)
-    run_bot(config_path)
+    run_bot(config_path, shards=args.shards,
+            profile_startup=args.profile_startup)
@@ -1,22 +1,136 @@
-from iobot.bot import IOBot
-from iobot.config import read_config
+import logging
+import signal
+import sys
+from functools import partial
 
-def run_bot(config_path):
-    config = read_config(config_path)
-    servers = config['servers']
+from tornado.ioloop import IOLoop
+
+from iobot.bot import IOBot, HANDLER_TIMEOUT, MAX_INFLIGHT, MAX_PENDING
+from iobot.capture import RawCapture, CAPTURE_BYTES, CAPTURE_BACKUPS
+from iobot.config import read_config, ConfigParseError, ConfigParseWarning
+from iobot.gateway import GATEWAY_ADDRESS
+from iobot.metrics import serve_metrics, log_metrics
+from iobot.shard import Supervisor
+
+DEFAULT_PLUGINS = ['admin', 'markov_bot']
+METRICS_ADDRESS = '127.0.0.1'
+
+def build_bot(config, servers, profile_startup=False, shard_index=None):
+    """
+    plugins with a manifest are imported lazily unless profile_startup,
+    which imports them all up front and reports how long each took.
+
+    with metrics on they are served on metrics_port, plus the shard index
+    so every shard gets its own, and/or logged every metrics_log_interval
+    seconds.  raw_capture names a file raw traffic is copied to, again
+    suffixed with the shard index.  the http gateway is served on
+    gateway_port, also plus the shard index.
+    """
     prefix = config['core']['prefix']
     nick = config['core']['nick']
     user = config['core']['user']
     realname = config['core']['realname']
+    handler_timeout = config['core'].get('handler_timeout', HANDLER_TIMEOUT)
+    max_inflight = config['core'].get('max_inflight', MAX_INFLIGHT)
+    max_pending = config['core'].get('max_pending', MAX_PENDING)
+    executor = config['core'].get('executor', 'thread')
+    workers = config['core'].get('workers')
+    metrics = config['core'].get('metrics', False)
+    capture = build_capture(config['core'], shard_index)
     ib = IOBot(
         servers,
         prefix,
         nick,
         user,
         realname,
+        handler_timeout=handler_timeout,
+        max_inflight=max_inflight,
+        max_pending=max_pending,
+        executor=executor,
+        workers=workers,
+        metrics=metrics,
+        capture=capture,
         )
-    ib.load_plugin('admin')
-    ib.load_plugin('markov_bot')
+    if metrics:
+        start_metrics_sinks(ib.metrics, config['core'], shard_index)
+    gateway_port = config['core'].get('gateway_port')
+    if gateway_port is not None:
+        ib.start_gateway(gateway_port + (shard_index or 0),
+                config['core'].get('gateway_address', GATEWAY_ADDRESS),
+                config['core'].get('gateway_token'))
+    for plugin_name in config['core'].get('plugins', DEFAULT_PLUGINS):
+        ib.load_plugin(plugin_name, lazy=not profile_startup)
+    if profile_startup:
+        report_import_times(ib.import_times)
+    return ib
 
-    ib.start()
+def build_capture(core, shard_index=None):
+    path = core.get('raw_capture')
+    if not path:
+        return None
+    if shard_index is not None:
+        path = '%s.%d' % (path, shard_index)
+    return RawCapture(path, core.get('raw_capture_bytes', CAPTURE_BYTES),
+            core.get('raw_capture_backups', CAPTURE_BACKUPS))
 
+def start_metrics_sinks(registry, core, shard_index=None):
+    port = core.get('metrics_port')
+    if port is not None:
+        serve_metrics(registry, port + (shard_index or 0),
+                core.get('metrics_address', METRICS_ADDRESS))
+    interval = core.get('metrics_log_interval')
+    if interval:
+        log_metrics(registry, interval)
+
+def report_import_times(import_times, out=sys.stderr):
+    out.write('plugin import times:\n')
+    for plugin_name, seconds in sorted(import_times.items(),
+            key=lambda item: -item[1]):
+        out.write('  %-16s %8.1fms\n' % (plugin_name, seconds * 1000))
+    out.write('  %-16s %8.1fms\n' % ('total',
+        sum(import_times.values()) * 1000))
+
+def reload_config(target, config_path):
+    """
+    rereads the config and applies the servers diff to target, an IOBot or
+    a Supervisor.  a config that doesn't parse is logged and ignored.
+    """
+    logger = logging.getLogger(__name__)
+    try:
+        config = read_config(config_path)
+    except (IOError, ConfigParseError, ConfigParseWarning) as e:
+        logger.error('CONFIG NOT RELOADED {error: %s}' % e)
+        return
+    if isinstance(target, Supervisor):
+        target.reload(config['servers'])
+        logger.info('CONFIG RELOADED {shards: %d}' % len(target.groups))
+    else:
+        added, removed, changed = target.apply_config(config['servers'])
+        logger.info('CONFIG RELOADED {added: %s, removed: %s, unchanged '
+                'connections with new config: %s}' % (','.join(added),
+                    ','.join(removed), ','.join(changed)))
+
+def reload_on_sighup(target, config_path):
+    # the IOLoop is looked up when the signal arrives, a supervisor has to
+    # fork its workers before it has one
+    signal.signal(signal.SIGHUP, lambda signum, frame:
+            IOLoop.current().add_callback_from_signal(reload_config, target,
+                config_path))
+
+def run_bot(config_path, shards=None, profile_startup=False):
+    """
+    with more than one shard each group of servers gets its own process,
+    otherwise every server runs on this process's IOLoop.  SIGHUP reloads
+    the servers from config_path.
+    """
+    config = read_config(config_path)
+    servers = config['servers']
+    if shards is None:
+        shards = config['core'].get('shards', 1)
+    if shards > 1:
+        target = Supervisor(servers, shards, partial(build_bot, config,
+            profile_startup=profile_startup))
+    else:
+        target = build_bot(config, servers, profile_startup)
+    reload_on_sighup(target, config_path)
+    target.start()
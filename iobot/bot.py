@@ -1,38 +1,165 @@
-import imp
-import os
+import importlib
+import logging
+import sys
+import time
+from datetime import timedelta
 from warnings import warn
 
+try:
+    from importlib import reload
+except ImportError:
+    # a builtin on python 2
+    pass
+
+from tornado import gen
+from tornado.concurrent import is_future, chain_future
 from tornado.ioloop import IOLoop
-from iobot.irc import IrcConnection
+from iobot.event import FALLBACK_ENCODING
+from iobot.executor import BotExecutor
+from iobot.gateway import Gateway, GATEWAY_ADDRESS
+from iobot.irc import IrcConnection, PING_INTERVAL, PING_TIMEOUT
+from iobot.metrics import MetricsRegistry
+from iobot.plugins.decorators import plugin_command, plugin_hook
+from iobot.plugins.manifest import MANIFESTS
+from iobot.sendq import FLOOD_RATE, FLOOD_BURST
+from iobot.state import UserRegistry
+
+# seconds an asynchronous handler may run before it is abandoned
+HANDLER_TIMEOUT = 30
+# asynchronous handlers allowed in flight per connection
+MAX_INFLIGHT = 8
+# handlers waiting for a slot per connection, more are dropped
+MAX_PENDING = 1000
+PLUGIN_PACKAGE = 'iobot.plugins'
+# seconds after start that plugins loaded lazily are imported anyway
+LAZY_IMPORT_DELAY = 5
+
+class HandlerDropped(Exception):
+    pass
 
 class DuplicatePluginHookWarning(Warning):
     pass
 
-class CommandOverwirttenWarning(Warning):
+class CommandOverwrittenWarning(Warning):
     pass
 
+# kept for anything still importing the misspelt name
+CommandOverwirttenWarning = CommandOverwrittenWarning
+
+def lazy_plugin_class(plugin_name, manifest):
+    """
+    a stand in for a plugin with its commands and hooks taken from its
+    manifest.  the first event for any of them imports the real plugin,
+    which replaces the stand in, and hands it the event.
+    """
+    def stub(attr_name):
+        def method(self, conn, event):
+            plugin = conn.bot.import_plugin(plugin_name)
+            return getattr(plugin, attr_name)(conn, event)
+        method.__name__ = attr_name
+        return method
+
+    attrs = dict()
+    for cmd in manifest['commands']:
+        attrs[cmd] = plugin_command(stub(cmd))
+    for hook in manifest['hooks']:
+        attr_name = 'on_%s' % hook.lower()
+        attrs[attr_name] = plugin_hook(stub(attr_name))
+    return type('Lazy_%s' % plugin_name, (object,), attrs)
+
 class IOBot(object):
-    def __init__(self, servers, cmd_char, nick, user, realname):
+    def __init__(self, servers, cmd_char, nick, user, realname,
+            handler_timeout=HANDLER_TIMEOUT, max_inflight=MAX_INFLIGHT,
+            max_pending=MAX_PENDING, executor='thread', workers=None, metrics=False, capture=None):
         """
         create an irc bot instance.
         @params
         initial_chans: None or list of strings representing channels to join
+        handler_timeout: seconds before an asynchronous handler times out.
+            its slot is freed then, but the coroutine itself can't be
+            cancelled and runs on until it returns
+        max_inflight: asynchronous handlers allowed to run at once per
+            connection, while they are all taken further handlers wait for
+            a free slot
+        max_pending: handlers allowed to wait per connection, those past it
+            are dropped and counted in the connection's dropped_handlers
+        executor: 'thread' or 'process', the pool work passed to submit runs on
+        workers: size of that pool, defaults to the number of cpus
+        metrics: count lines, events and plugin handler latencies and errors
+            into self.metrics, left off the hot paths cost next to nothing
+        capture: a RawCapture every connection copies its traffic to
         """
         self.nick = nick
         self.user = user
         self.realname = realname
         self.cmd_char = cmd_char
+        self.handler_timeout = handler_timeout
+        self.max_inflight = max_inflight
+        self.max_pending = max_pending
         self._plugins = dict()
+        # plugin name -> the instance its commands and hooks are bound to
+        self._instances = dict()
+        # plugins registered from their manifest but not imported yet
+        self._lazy_plugins = set()
+        # plugin name -> seconds spent importing and creating it
+        self.import_times = dict()
         self._commands = dict()
         self._hooks = dict()
+        # bound methods ready to call, rebuilt whenever plugins change
+        self._command_handlers = dict()
+        self._hook_handlers = dict()
+        self.metrics = MetricsRegistry(enabled=metrics)
+        # plugin method -> (latency Histogram, error Counter) when enabled
+        self._handler_metrics = dict()
+        self.capture = capture
+        # server name -> IrcConnection
+        self.connections = dict()
+        # server name -> the config it was connected with
+        self.servers = dict()
+        # network name -> UserRegistry shared by its connections
+        self.user_registries = dict()
+        # ShardLink to the supervisor when running as one of several shards
+        self.shard = None
+        # the http Gateway to our commands, once started
+        self.gateway = None
         # build our user command list
         self.cmds = dict()
 
-        self.ioloop = IOLoop.instance()
+        self.logger = logging.getLogger(__name__)
+        self.ioloop = IOLoop.current()
+        self.executor = BotExecutor(self.ioloop, executor, workers)
 
         for server_name, config in servers.items():
-            conn = self.create_connection(server_name, config)
-            conn.connect()
+            self.add_server(server_name, config)
+
+    def add_server(self, server_name, config):
+        conn = self.create_connection(server_name, config)
+        self.connections[server_name] = conn
+        self.servers[server_name] = config
+        conn.connect()
+        return conn
+
+    def remove_server(self, server_name, message='Leaving'):
+        conn = self.connections.pop(server_name)
+        del self.servers[server_name]
+        conn.disconnect(message)
+
+    def apply_config(self, servers):
+        """
+        connects to servers that are new and disconnects from those no
+        longer listed.  connections whose config changed are left alone,
+        remove and re-add the server to pick that up.  returns the server
+        names (added, removed, changed).
+        """
+        added = sorted(set(servers) - set(self.servers))
+        removed = sorted(set(self.servers) - set(servers))
+        changed = sorted(name for name in set(servers) & set(self.servers)
+                if servers[name] != self.servers[name])
+        for server_name in removed:
+            self.remove_server(server_name, 'Removed from config')
+        for server_name in added:
+            self.add_server(server_name, servers[server_name])
+        return added, removed, changed
 
     def create_connection(self, server_name, config):
         address = config['address']
@@ -41,12 +168,82 @@ class IOBot(object):
         owners = config['owners']
         password = config.get('password')
         ssl = config.get('ssl')
+        batch_reads = config.get('batch_reads', True)
+        flood_rate = config.get('flood_rate', FLOOD_RATE)
+        flood_burst = config.get('flood_burst', FLOOD_BURST)
+        ping_interval = config.get('ping_interval', PING_INTERVAL)
+        ping_timeout = config.get('ping_timeout', PING_TIMEOUT)
+        sasl = config.get('sasl', False)
+        account = config.get('account')
+        encoding = config.get('encoding', FALLBACK_ENCODING)
+        network = config.get('network', server_name)
+        registry = self.user_registries.get(network)
+        if registry is None:
+            registry = UserRegistry()
+            self.user_registries[network] = registry
         return IrcConnection(self, server_name, address, port,
                 self.nick, self.user, self.realname, owners,
-                channels, password=password, ssl=ssl)
+                channels, password=password, ssl=ssl,
+                batch_reads=batch_reads, flood_rate=flood_rate,
+                flood_burst=flood_burst, registry=registry,
+                ping_interval=ping_interval, ping_timeout=ping_timeout,
+                metrics=self.metrics, capture=self.capture, sasl=sasl,
+                account=account, encoding=encoding)
 
     def start(self):
-        self.ioloop.start()
+        if self._lazy_plugins:
+            self.ioloop.call_later(LAZY_IMPORT_DELAY, self.import_lazy_plugins)
+        try:
+            self.ioloop.start()
+        finally:
+            for plugin_name in list(self._instances):
+                self.stop_plugin(plugin_name)
+
+    def stop_plugin(self, plugin_name):
+        """ lets a plugin instance with a stop method finish up """
+        stop = getattr(self._instances.get(plugin_name), 'stop', None)
+        if stop is not None:
+            try:
+                stop()
+            except Exception:
+                self.logger.exception('Error stopping %s', plugin_name)
+
+    def start_gateway(self, port, address=GATEWAY_ADDRESS, token=None):
+        """ serves the bot's commands over http on its IOLoop """
+        self.gateway = Gateway(self, token)
+        self.gateway.listen(port, address)
+        return self.gateway
+
+    def lag_histograms(self):
+        """ server name -> Histogram of keepalive PING round trips """
+        return dict((name, conn.lag)
+                for name, conn in self.connections.items())
+
+    def broadcast(self, method, *args):
+        """
+        runs bot.method(*args) on every other shard, it is up to the caller
+        to also run it here
+        """
+        if self.shard is not None:
+            self.shard.broadcast(method, args)
+
+    def write_to(self, server_name, line):
+        """ writes a raw line to a server, whichever shard is connected to it """
+        conn = self.connections.get(server_name)
+        if conn is not None:
+            conn.write_raw(line)
+        elif self.shard is not None:
+            self.shard.route(server_name, 'write_to', (server_name, line))
+        else:
+            raise KeyError(server_name)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        runs fn(*args, **kwargs) on the bot's executor, returning a Future
+        resolved on the IOLoop.  plugins return or yield it so slow work
+        doesn't hold up the read loop.
+        """
+        return self.executor.submit(fn, *args, **kwargs)
 
     def register_plugins(self, plugin_names):
         """
@@ -59,7 +256,11 @@ class IOBot(object):
         plugin_cls = self._plugins[plugin_name]
         self.unload_commands(plugin_cls)
         self.unload_hooks(plugin_cls)
+        self.stop_plugin(plugin_name)
         del self._plugins[plugin_name]
+        self._instances.pop(plugin_name, None)
+        self._lazy_plugins.discard(plugin_name)
+        self.build_dispatch()
 
     def unload_commands(self, plugin_cls):
         for cmd in self._commands.keys():
@@ -69,10 +270,12 @@ class IOBot(object):
 
     def unload_hooks(self, plugin_cls):
         for hook in self._hooks.keys():
-            plugins = self._hooks[hook]
-            for plugin in plugins:
-                if isinstance(plugin, plugin_cls):
-                    self._hooks[hook].remove(plugin)
+            plugins = [p for p in self._hooks[hook]
+                    if not isinstance(p, plugin_cls)]
+            if plugins:
+                self._hooks[hook] = plugins
+            else:
+                del self._hooks[hook]
 
     def reload_plugin(self, plugin_name):
         if plugin_name not in self._plugins:
@@ -80,15 +283,49 @@ class IOBot(object):
         self.unload_plugin(plugin_name)
         self.load_plugin(plugin_name)
 
-    def load_plugin(self, plugin_name):
-        # update to support custom paths?
+    def load_plugin(self, plugin_name, lazy=False):
+        """
+        imports a plugin from iobot.plugins and registers it.  with lazy, a
+        plugin that has a manifest is only registered, and imported on its
+        first event or LAZY_IMPORT_DELAY after start.
+        """
+        manifest = MANIFESTS.get(plugin_name)
+        if lazy and manifest is not None:
+            self.add_plugin(plugin_name,
+                    lazy_plugin_class(plugin_name, manifest))
+            self._lazy_plugins.add(plugin_name)
+            return
+        if plugin_name in self._lazy_plugins:
+            self.unload_plugin(plugin_name)
+        start = time.time()
         plugin_module = self.load_module(plugin_name)
         plugin_cls = plugin_module.Plugin
         self.add_plugin(plugin_name, plugin_cls)
+        self.import_times[plugin_name] = time.time() - start
+
+    def import_plugin(self, plugin_name):
+        """ makes sure a plugin is imported, returning its instance """
+        if plugin_name in self._lazy_plugins:
+            self.logger.info('IMPORTING PLUGIN {plugin: %s}', plugin_name)
+            self.load_plugin(plugin_name)
+        return self._instances[plugin_name]
+
+    def import_lazy_plugins(self):
+        # one plugin per IOLoop iteration so reads carry on in between
+        if self._lazy_plugins:
+            plugin_name = sorted(self._lazy_plugins)[0]
+            try:
+                self.import_plugin(plugin_name)
+            except Exception:
+                self.logger.exception('Error importing %s', plugin_name)
+                self._lazy_plugins.discard(plugin_name)
+            self.ioloop.add_callback(self.import_lazy_plugins)
 
     def add_plugin(self, plugin_name, plugin_cls):
-        self.add_plugin_methods(plugin_cls)
+        plugin = self.add_plugin_methods(plugin_cls)
         self._plugins[plugin_name] = plugin_cls
+        self._instances[plugin_name] = plugin
+        self.build_dispatch()
 
     def add_plugin_methods(self, plugin_cls):
         plugin = plugin_cls()
@@ -96,6 +333,7 @@ class IOBot(object):
             attr = getattr(plugin, attr_name)
             if callable(attr):
                 self.add_plugin_method(attr_name, attr, plugin, plugin_cls)
+        return plugin
 
     def add_plugin_method(self, attr_name, attr, plugin, plugin_cls):
         if hasattr(attr, 'cmd') and getattr(attr, 'cmd'):
@@ -117,42 +355,166 @@ class IOBot(object):
             raise DuplicatePluginHookWarning
         plugins.append(plugin)
 
+    def build_dispatch(self):
+        """
+        resolves the registered commands and hooks to bound methods so
+        dispatching an event is a dict lookup rather than a getattr per plugin
+        """
+        self._command_handlers = dict(
+                (cmd, getattr(plugin, cmd))
+                for cmd, plugin in self._commands.items()
+                if hasattr(plugin, cmd))
+        self._hook_handlers = dict(
+                (hook, tuple(getattr(p, 'on_%s' % hook.lower())
+                    for p in plugins))
+                for hook, plugins in self._hooks.items())
+        if self.metrics.enabled:
+            methods = list(self._command_handlers.values())
+            for plugin_methods in self._hook_handlers.values():
+                methods.extend(plugin_methods)
+            self._handler_metrics = dict(
+                    (method, self.handler_metrics(method)) for method in methods)
+
+    def handler_metrics(self, plugin_method):
+        """ the (latency, errors) metrics of a plugin method """
+        plugin = getattr(plugin_method, '__self__', None)
+        handler = '%s.%s' % (type(plugin).__name__, getattr(plugin_method,
+            '__name__', 'handler'))
+        return (self.metrics.histogram('iobot_handler_seconds',
+                    'plugin handler latency, to completion for coroutines',
+                    handler=handler),
+                self.metrics.counter('iobot_handler_errors_total',
+                    'plugin handlers that raised or timed out',
+                    handler=handler))
+
     def load_module(self, plugin_name):
         # this will also reload a loaded module
-        plugin_path = os.path.join(os.path.split(__file__)[0], 'plugins/')
-        module_info = imp.find_module(plugin_name, [plugin_path])
-        module = imp.load_module(plugin_name, *module_info)
-        return module
+        module_name = '%s.%s' % (PLUGIN_PACKAGE, plugin_name)
+        module = sys.modules.get(module_name)
+        if module is None:
+            return importlib.import_module(module_name)
+        return reload(module)
 
     def process_plugins(self, connection, event):
         """ parses a completed IrcEvent for module hooks """
-        try:
-            plugin = self._commands.get(event.command) if event.command else None
-        except KeyError:
-            # plugin does not exist
-            pass
+        command = event.command
+        if not command:
+            return
+        plugin_method = self._command_handlers.get(command)
+        if plugin_method:
+            self.run_handler(connection, event, plugin_method)
 
-        if plugin and hasattr(plugin, event.command):
-            plugin_method = getattr(plugin, event.command)
+    def process_hooks(self, connection, event):
+        plugin_methods = self._hook_handlers.get(event.type)
+        if not plugin_methods:
+            return
+        if self._handler_metrics:
+            for plugin_method in plugin_methods:
+                self.run_handler(connection, event, plugin_method)
+            return
+        # run_handler inlined for the usual hook, synchronous and returning
+        # None with slots to spare
+        max_inflight = self.max_inflight
+        for plugin_method in plugin_methods:
+            if connection.inflight >= max_inflight:
+                self.defer_handler(connection, event, plugin_method)
+                continue
             try:
-                plugin_method(connection, event)
+                result = plugin_method(connection, event)
             except Exception as e:
-                connection.reply(event, str(e))
-                connection.logger.error(e)
+                self.handler_error(connection, event, e)
+                continue
+            if result is not None and is_future(result):
+                self.track_handler(connection, event, result)
 
-    def process_hooks(self, connection, event):
+    def run_handler(self, connection, event, plugin_method, outcome=None):
+        """
+        calls a plugin method.  a coroutine or Future it returns is tracked
+        on the IOLoop instead of blocking the read loop.  whether a method
+        returns one is only known once it is called, so with every slot
+        taken any handler waits its turn.  outcome, a Future, is resolved
+        when the handler is done, or failed with its error.
+        """
+        if connection.inflight >= self.max_inflight:
+            self.defer_handler(connection, event, plugin_method, outcome)
+            return
+        metrics = (self._handler_metrics.get(plugin_method)
+                if self._handler_metrics else None)
+        if metrics is not None:
+            start = time.time()
         try:
-            plugins = self._hooks.get(event.type)
-        except KeyError:
-            # hook does not exist
-            pass
-
-        if plugins:
-            for plugin in plugins:
-                plugin_method = getattr(plugin, 'on_%s' %
-                        str(event.type).lower())
-                try:
-                    plugin_method(connection, event)
-                except Exception as e:
-                    connection.reply(event, str(e))
-                    connection.logger.error(e)
+            result = plugin_method(connection, event)
+        except Exception as e:
+            if metrics is not None:
+                metrics[1].inc()
+            self.handler_error(connection, event, e)
+            if outcome is not None:
+                outcome.set_exc_info(sys.exc_info())
+            return
+        if result is not None and is_future(result):
+            self.track_handler(connection, event, result, metrics and
+                    (metrics, start), outcome)
+            return
+        if metrics is not None:
+            metrics[0].observe(time.time() - start)
+        if outcome is not None:
+            outcome.set_result(result)
+
+    def track_handler(self, connection, event, future, measure=None,
+            outcome=None):
+        """
+        measure is ((latency, errors), start time) to record the outcome,
+        and outcome a Future to pass it on to
+        """
+        connection.inflight += 1
+        if self.handler_timeout:
+            future = gen.with_timeout(
+                    timedelta(seconds=self.handler_timeout), future)
+
+        def handler_done(future):
+            connection.inflight -= 1
+            failed = True
+            try:
+                future.result()
+                failed = False
+            except gen.TimeoutError:
+                self.handler_error(connection, event,
+                        'Timed out after %ss' % self.handler_timeout)
+            except Exception as e:
+                self.handler_error(connection, event, e)
+            if measure:
+                (latency, errors), start = measure
+                latency.observe(time.time() - start)
+                if failed:
+                    errors.inc()
+            if outcome is not None:
+                chain_future(future, outcome)
+            self.run_pending_handlers(connection)
+
+        self.ioloop.add_future(future, handler_done)
+
+    def defer_handler(self, connection, event, plugin_method, outcome=None):
+        if len(connection.pending_handlers) >= self.max_pending:
+            connection.dropped_handlers += 1
+            self.metrics.counter('iobot_handlers_dropped_total',
+                    'plugin handlers dropped with the queue full',
+                    server=connection.server_name).inc()
+            connection.logger.warning('HANDLER DROPPED {handler: %s, '
+                    'pending: %d}', plugin_method.__name__,
+                    len(connection.pending_handlers))
+            if outcome is not None:
+                outcome.set_exception(HandlerDropped('Too many handlers '
+                    'waiting'))
+            return
+        connection.pending_handlers.append((connection, event, plugin_method,
+            outcome))
+
+    def run_pending_handlers(self, connection):
+        # the connections queued with can differ, see GatewayConnection
+        pending = connection.pending_handlers
+        while pending and connection.inflight < self.max_inflight:
+            self.run_handler(*pending.popleft())
+
+    def handler_error(self, connection, event, e):
+        connection.reply(event, str(e))
+        connection.logger.error(e)
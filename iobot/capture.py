@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+# bytes a capture file grows to before it is rotated, and rotations kept
+CAPTURE_BYTES = 10 * 1024 * 1024
+CAPTURE_BACKUPS = 5
+# lines waiting for the writer thread, past this they are dropped rather
+# than let a slow disk hold up the IOLoop or grow without bound
+CAPTURE_QUEUE = 50000
+
+class RawCapture(object):
+    """
+    copies raw irc traffic to a rotating file, apart from the main log.
+    write only puts (time, server, direction, line) on a queue, formatting
+    and disk writes happen on a writer thread, which takes whatever has
+    queued up each time it wakes.  lines are written as
+
+        1286412345.123 server < :nick!user@host PRIVMSG #chan :hi
+
+    with < for lines read and > for lines written.
+    """
+    def __init__(self, path, max_bytes=CAPTURE_BYTES, backups=CAPTURE_BACKUPS,
+            queue_size=CAPTURE_QUEUE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self._queue = Queue(queue_size)
+        self._fp = open(path, 'a')
+        self._size = self._fp.tell()
+        self._thread = threading.Thread(target=self._run,
+                name='iobot-capture')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, server_name, direction, line):
+        try:
+            self._queue.put_nowait((time.time(), server_name, direction, line))
+        except Full:
+            self.dropped += 1
+
+    def _run(self):
+        queue = self._queue
+        running = True
+        while running:
+            items = [queue.get()]
+            while len(items) < queue.maxsize and not queue.empty():
+                items.append(queue.get_nowait())
+            if items[-1] is None:
+                items.pop()
+                running = False
+            for item in items:
+                self._write_line('%.3f %s %s %s\n' % item)
+            self._fp.flush()
+        self._fp.close()
+
+    def _write_line(self, text):
+        if self.max_bytes and self._size and (
+                self._size + len(text) > self.max_bytes):
+            self._rotate()
+        self._fp.write(text)
+        self._size += len(text)
+
+    def _rotate(self):
+        # raw.log.1 is the newest, raw.log.<backups> the oldest
+        self._fp.close()
+        for i in range(self.backups - 1, 0, -1):
+            older = '%s.%d' % (self.path, i)
+            if os.path.exists(older):
+                os.rename(older, '%s.%d' % (self.path, i + 1))
+        if self.backups:
+            os.rename(self.path, self.path + '.1')
+        self._fp = open(self.path, 'w')
+        self._size = 0
+
+    def close(self):
+        """ writes out whatever is queued and stops the writer thread """
+        self._queue.put(None)
+        self._thread.join()
@@ -1,81 +1,251 @@
+import hashlib
+import marshal
+import os
+import re
+
 class ConfigParseError(Exception):
     pass
 
 class ConfigParseWarning(Warning):
     pass
 
-def read_config(file_path):
+class ConfigSchemaError(ConfigParseError):
+    pass
+
+# value types for the schema, anything scalar can be read as a string
+STRING = 'string'
+INT = 'int'
+NUMBER = 'number'
+BOOL = 'bool'
+LIST = 'list'
+SECTION = 'section'
+# a value that is either a bool or a nested section, like ssl
+BOOL_OR_SECTION = 'bool or section'
+
+# key -> (type, required)
+CORE_SCHEMA = {
+    'prefix': (STRING, True),
+    'nick': (STRING, True),
+    'user': (STRING, True),
+    'realname': (STRING, True),
+    'handler_timeout': (NUMBER, False),
+    'max_inflight': (INT, False),
+    'max_pending': (INT, False),
+    'executor': (STRING, False),
+    'workers': (INT, False),
+    'shards': (INT, False),
+    'plugins': (LIST, False),
+    'metrics': (BOOL, False),
+    'metrics_port': (INT, False),
+    'metrics_address': (STRING, False),
+    'metrics_log_interval': (NUMBER, False),
+    'raw_capture': (STRING, False),
+    'raw_capture_bytes': (INT, False),
+    'raw_capture_backups': (INT, False),
+    'gateway_port': (INT, False),
+    'gateway_address': (STRING, False),
+    'gateway_token': (STRING, False),
+    }
+
+SERVER_SCHEMA = {
+    'address': (STRING, True),
+    'port': (INT, True),
+    'owners': (LIST, True),
+    'channels': (LIST, False),
+    'password': (STRING, False),
+    'ssl': (BOOL_OR_SECTION, False),
+    'network': (STRING, False),
+    'batch_reads': (BOOL, False),
+    'flood_rate': (NUMBER, False),
+    'flood_burst': (INT, False),
+    'ping_interval': (NUMBER, False),
+    'ping_timeout': (NUMBER, False),
+    'sasl': (BOOL, False),
+    'account': (STRING, False),
+    'encoding': (STRING, False),
+    }
+
+CACHE_VERSION = 1
+
+def read_config(file_path, cache=True):
+    """
+    parses and validates a config file.  with cache the result is kept in
+    a marshal file next to it, reused while the file's mtime and size or,
+    failing those, its sha1 still match.
+    """
+    cache_path = cache_path_for(file_path) if cache else None
+    st = os.stat(file_path)
+    cached = load_cache(cache_path) if cache_path else None
+    if cached and (cached['mtime'], cached['size']) == (st.st_mtime,
+            st.st_size):
+        return cached['config']
+
     with open(file_path) as fp:
-        parents = []
-        current = {}
-        for i, line in enumerate(fp, 1):
-            line = line.strip()
-            if not line:
-                continue
-            if line == '}':
-                if all(v is None for v in current.values()):
-                    current = list(current.keys())
-                try:
-                    current = parents.pop()
-                except IndexError:
-                    raise ConfigParseError('Line %d' % i)
-                continue
-
-            if '=' in line:
-                key, value = line.split('=', 1)
-                key = key.strip()
-                value = value.strip()
-            else:
-                key, value = line, None
-
-            if value == '{':
-                if key in current:
-                    raise Warning
-                else:
-                    current[key] = {}
-                parents.append(current)
-                current = current[key]
-                continue
-
-            if key in current:
-                raise ConfigParseWarning('Duplicate key %s line %d' % (key, i))
-
-            if value:
-                value = interp_value(value)
-
-            current[key] = value
-
-        return current
+        text = fp.read()
+    digest = hashlib.sha1(text).hexdigest()
+    if cached and cached['sha1'] == digest:
+        config = cached['config']
+    else:
+        config = parse_config(text.splitlines())
+        validate_config(config)
+    if cache_path:
+        write_cache(cache_path, {'version': CACHE_VERSION,
+            'mtime': st.st_mtime, 'size': st.st_size, 'sha1': digest,
+            'config': config})
+    return config
 
-def interp_value(value):
-    i = as_int(value)
-    if i is not None:
-        return i
-    f = as_float(value)
-    if f is not None:
-        return f
-    b = as_bool(value)
-    if b is not None:
-        return b
+def cache_path_for(file_path):
+    head, tail = os.path.split(file_path)
+    return os.path.join(head, '.%s.cache' % tail)
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, 'rb') as fp:
+            cached = marshal.load(fp)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(cached, dict) or cached.get('version') != CACHE_VERSION:
+        return None
+    return cached
+
+def write_cache(cache_path, cached):
+    # written aside and renamed, shard workers may be reading it
+    tmp_path = '%s.%d' % (cache_path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as fp:
+            marshal.dump(cached, fp)
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError):
+        # an unwritable directory only costs us the cache
+        pass
+
+def parse_config(lines):
+    # (section, key in its parent) for every block we are inside
+    parents = []
+    current = {}
+    for i, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line == '}':
+            try:
+                parent, key = parents.pop()
+            except IndexError:
+                raise ConfigParseError('Line %d' % i)
+            # a block of bare keys is a list
+            if all(v is None for v in current.values()):
+                parent[key] = list(current.keys())
+            current = parent
+            continue
+
+        if '=' in line:
+            key, value = line.split('=', 1)
+            key = key.strip()
+            value = value.strip()
+        else:
+            key, value = line, None
+
+        if key in current:
+            raise ConfigParseWarning('Duplicate key %s line %d' % (key, i))
+
+        if value == '{':
+            current[key] = {}
+            parents.append((current, key))
+            current = current[key]
+            continue
+
+        if value:
+            value = interp_value(value)
+
+        current[key] = value
+
+    return current
+
+def validate_config(config):
+    """ raises ConfigSchemaError naming the first key that is wrong """
+    for name in ('core', 'servers'):
+        if name not in config:
+            raise ConfigSchemaError('Missing section %s' % name)
+    validate_section(config['core'], CORE_SCHEMA, 'core')
+    servers = as_section(config['servers'], 'servers')
+    config['servers'] = servers
+    for server_name, server in servers.items():
+        validate_section(server, SERVER_SCHEMA, 'servers.%s' % server_name)
+    # plugin sections are free form, only their shape is checked
+    plugins = as_section(config.get('plugins', {}), 'plugins')
+    for plugin_name, section in plugins.items():
+        plugins[plugin_name] = as_section(section, 'plugins.%s' % plugin_name)
+    config['plugins'] = plugins
+    unknown = set(config) - set(['core', 'servers', 'plugins'])
+    if unknown:
+        raise ConfigSchemaError('Unknown section %s' % ', '.join(
+            sorted(unknown)))
+    return config
+
+def as_section(value, path):
+    # an empty or all bare key block parses as a list
+    if value == [] or value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ConfigSchemaError('%s: expected a section' % path)
     return value
 
+def validate_section(section, schema, path):
+    section = as_section(section, path)
+    for key, (kind, required) in schema.items():
+        if key not in section or section[key] is None:
+            if required:
+                raise ConfigSchemaError('%s.%s: required' % (path, key))
+            section.pop(key, None)
+            continue
+        section[key] = check_value(section[key], kind, '%s.%s' % (path, key))
+    unknown = set(section) - set(schema)
+    if unknown:
+        raise ConfigSchemaError('%s: unknown keys %s' % (path,
+            ', '.join(sorted(unknown))))
+
+def check_value(value, kind, path):
+    if kind == STRING and not isinstance(value, (dict, list)):
+        return value if isinstance(value, str) else str(value)
+    if kind == INT and type(value) is int:
+        return value
+    if kind == NUMBER and type(value) in (int, float):
+        return value
+    if kind == BOOL and type(value) is bool:
+        return value
+    if kind == LIST:
+        # owners = nod is as good as a block holding one bare key
+        return value if isinstance(value, list) else [check_value(value,
+            STRING, path)]
+    if kind == SECTION and isinstance(value, dict):
+        return value
+    if kind == BOOL_OR_SECTION and (type(value) is bool or
+            isinstance(value, dict)):
+        return value
+    raise ConfigSchemaError('%s: expected %s, got %r' % (path, kind, value))
+
+INT_PATTERN = re.compile(r'^[-+]?\d+$')
+FLOAT_PATTERN = re.compile(r'^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$')
+BOOLS = {'true': True, 'false': False}
+
+def interp_value(value):
+    if INT_PATTERN.match(value):
+        return int(value)
+    if FLOAT_PATTERN.match(value):
+        return float(value)
+    return BOOLS.get(value.lower(), value)
+
 def as_int(value):
     try:
         return int(value)
-    except:
+    except (TypeError, ValueError):
         return None
 
 def as_float(value):
     try:
         return float(value)
-    except:
+    except (TypeError, ValueError):
         return None
 
 def as_bool(value):
-    v = value.title()
-    if v == 'True':
-        return True
-    elif v == 'False':
-        return False
-    else:
-        return None
+    return BOOLS.get(value.lower())
@@ -1,63 +1,245 @@
 import re
+from calendar import timegm
+from operator import attrgetter
+
+# what a line that isn't UTF-8 is taken to be, unless the server says
+# otherwise.  latin-1 decodes any byte, so text is never lost outright.
+FALLBACK_ENCODING = 'latin-1'
+
+TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+def parse_tags(tags_raw):
+    """ parses an IRCv3 message-tags block (without the leading @) """
+    tags = {}
+    for tag in tags_raw.split(';'):
+        if not tag:
+            continue
+        key, _, value = tag.partition('=')
+        if '\\' in value:
+            value = unescape_tag_value(value)
+        tags[key] = value
+    return tags
+
+def unescape_tag_value(value):
+    chars = []
+    i = 0
+    while i < len(value):
+        c = value[i]
+        if c == '\\':
+            i += 1
+            if i < len(value):
+                c = value[i]
+                chars.append(TAG_ESCAPES.get(c, c))
+        else:
+            chars.append(c)
+        i += 1
+    return ''.join(chars)
+
+SERVER_TIME_PATTERN = re.compile(
+        r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?Z$')
+
+def parse_server_time(value):
+    """ seconds since the epoch for a server-time tag, or None """
+    m = SERVER_TIME_PATTERN.match(value or '')
+    if m is None:
+        return None
+    seconds = timegm([int(part) for part in m.groups()[:6]])
+    return seconds + float(m.group(7) or 0)
+
+def decode(data, fallback=FALLBACK_ENCODING):
+    """ unicode for bytes from the wire, UTF-8 if they are, else fallback """
+    if data is None or isinstance(data, unicode):
+        return data
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode(fallback, 'replace')
+
+def split_line(line):
+    """
+    splits a raw line into its tags, prefix, command and the unparsed
+    parameter string per RFC 1459/2812 with IRCv3 message tags
+    """
+    tags_raw = None
+    prefix = None
+    if line[:1] == '@':
+        tags_raw, _, line = line[1:].partition(' ')
+        line = line.lstrip(' ')
+    if line[:1] == ':':
+        prefix, _, line = line[1:].partition(' ')
+        line = line.lstrip(' ')
+    command, _, rest = line.partition(' ')
+    return tags_raw, prefix, command, rest.lstrip(' ')
+
+def split_params(rest):
+    """
+    splits a parameter string into (destination, parameters_raw, parameters,
+    text).  destination is the first middle parameter, parameters the middle
+    parameters after it and text the trailing parameter.  parameters_raw
+    keeps everything after the destination when there are further middle
+    parameters.  the colon before the last parameter is optional, so
+    without one text is the last middle parameter, which also stays where
+    it is, as in NICK newnick or PING irc.server.
+    """
+    if not rest:
+        return None, None, [], None
+    if rest[0] == ':':
+        return None, None, [], rest[1:]
+    destination, _, rest = rest.partition(' ')
+    rest = rest.lstrip(' ')
+    if not rest:
+        return destination, None, [], destination
+    if rest[0] == ':':
+        return destination, None, [], rest[1:]
+    i = rest.find(' :')
+    if i == -1:
+        parameters = rest.split()
+        return destination, rest, parameters, parameters[-1]
+    return destination, rest, rest[:i].split(), rest[i + 2:]
+
+def split_all_params(rest):
+    """ every parameter in order with the trailing one last, colon or not """
+    params = []
+    while rest:
+        if rest[0] == ':':
+            params.append(rest[1:])
+            break
+        param, _, rest = rest.partition(' ')
+        params.append(param)
+        rest = rest.lstrip(' ')
+    return params
+
+def split_origin(origin):
+    """ returns (nick, user, host) for a nick!user@host prefix """
+    if origin:
+        nick, sep, userhost = origin.partition('!')
+        if sep and nick:
+            user, sep, host = userhost.partition('@')
+            if sep and user and host:
+                return nick, user, host
+    return None, None, None
+
+_UNSET = object()
+
+def lazy_field(name, loader, invalidates=()):
+    """
+    a property backed by the slot _<name>, filled in by loader(event) the
+    first time it is read.  setting it runs the loader first, so it can't
+    later overwrite the value when a sibling field is read, and resets the
+    fields named in invalidates, which are derived from this one.
+    """
+    slot = '_' + name
+    get_slot = attrgetter(slot)
+    derived = ['_' + field for field in invalidates]
+    def fget(self):
+        value = get_slot(self)
+        if value is _UNSET:
+            loader(self)
+            value = get_slot(self)
+        return value
+    def fset(self, value):
+        if get_slot(self) is _UNSET:
+            loader(self)
+        setattr(self, slot, value)
+        for field in derived:
+            setattr(self, field, _UNSET)
+    return property(fget, fset)
 
 class IrcEvent(object):
-    EVENT_PATTERN = re.compile((r'^(:(?P<prefix>((?P<nick>[^!]+)!'
-            r'(?P<user>[^@]+)@(?P<host>[^ ]+)|[^ ]+)) )?'
-            r'((?P<numeric>[0-9]{3})|(?P<command>[^ ]+))'
-            r'( (?P<destination>[^:][^ ]*))?( :(?P<text>.*)|'
-            r' (?P<parameters>.*))?$'))
+    """
+    a parsed line.  only the prefix and command are split out up front,
+    everything else is parsed on first access and cached.  fields are the
+    bytes off the wire, decode() or unicode_text give them as unicode with
+    encoding as the fallback for anything not UTF-8.
+    """
+    __slots__ = ('raw', 'my_nick', 'encoding', 'type', 'origin', '_tags_raw',
+            '_rest', '_unicode_text',
+            '_tags', '_nick', '_user', '_host', '_destination', '_text',
+            '_parameters', '_parameters_raw', '_command', '_command_params',
+            '_command_params_raw', '_params')
 
     COMMAND_REGEX = re.compile(r'^(?P<target>[^ ]+): ?(?P<command>[^ ]*)'
             r'( (?P<params>.*))?$')
 
-    def __init__(self, my_nick, raw=None):
+    def __init__(self, my_nick, raw=None, encoding=FALLBACK_ENCODING):
         self.raw = raw
-
         self.my_nick = my_nick
-        self.type = None
-        self.origin = None
-        self.destination = None
-        self.text = None
-        self.parameters = []
-        self.parameters_raw = None
-        self.command = None
-        self.command_params = None
-        self.command_params_raw = None
+        self.encoding = encoding
+        self._unicode_text = _UNSET
+        self._tags = self._nick = self._user = self._host = _UNSET
+        self._destination = self._text = self._parameters = _UNSET
+        self._parameters_raw = self._command = self._command_params = _UNSET
+        self._command_params_raw = self._params = _UNSET
         if raw:
-            self._parse()
+            if raw[-2:] == '\r\n':
+                raw = raw[:-2]
+            self._tags_raw, self.origin, command, self._rest = split_line(raw)
+            self.type = command.upper()
+        else:
+            self._tags_raw = self.origin = self.type = None
+            self._rest = ''
 
     def __repr__(self):
         return ('<IrcEvent object: %s %s>' % (self.type, self.destination))
 
-    def _parse(self):
-        if self.raw[-2:] == '\r\n':
-            line = self.raw[:-2]
-        else:
-            line = self.raw
-        m = self.EVENT_PATTERN.match(line)
-        self.origin = m.group('prefix')
-        command = m.group('command')
-        self.type = command.upper() if command else m.group('numeric')
-        self.destination = m.group('destination')
-        self.nick = m.group('nick')
-        self.user = m.group('user')
-        self.host = m.group('host')
-        self.text = m.group('text')
-        self.parameters_raw = m.group('parameters')
-        self.parameters = (self.parameters_raw.split() if
-                self.parameters_raw else [])
-
-        if self.type == 'PRIVMSG':
-            self._parse_command()
-        if self.type in ['JOIN', 'PART'] and not self.destination:
+    def _load_tags(self):
+        self._tags = parse_tags(self._tags_raw) if self._tags_raw else {}
+
+    def _load_origin(self):
+        self._nick, self._user, self._host = split_origin(self.origin)
+
+    def _load_params(self):
+        (self._destination, self._parameters_raw, self._parameters,
+                self._text) = split_params(self._rest)
+        if self.type in ('JOIN', 'PART') and not self._destination:
             # rescue bad JOINS/PARTS a la gamesurge
             # :iobot!iobot@host.name.com JOIN :#iobot-test
-            self.destination = self.text
+            self._destination = self._text
+
+    def _load_all_params(self):
+        self._params = split_all_params(self._rest)
+
+    def _load_unicode_text(self):
+        self._unicode_text = self.decode(self.text)
+
+    def decode(self, value):
+        """ value, one of this event's fields, as unicode """
+        return decode(value, self.encoding)
+
+    def _load_command(self):
+        self._command = None
+        self._command_params = None
+        self._command_params_raw = None
+        if self.type == 'PRIVMSG' and self.text is not None:
+            self._parse_command()
 
     def _parse_command(self):
         m = self.COMMAND_REGEX.match(self.text)
         if m and m.group('target') in (self.my_nick, 'all'):
-            self.command = m.group('command')
+            self._command = m.group('command')
             params_raw = m.group('params')
-            self.command_params_raw = params_raw or ''
-            self.command_params = params_raw.split() if params_raw else []
+            self._command_params_raw = params_raw or ''
+            self._command_params = params_raw.split() if params_raw else []
+
+    tags = lazy_field('tags', _load_tags)
+    nick = lazy_field('nick', _load_origin)
+    user = lazy_field('user', _load_origin)
+    host = lazy_field('host', _load_origin)
+    destination = lazy_field('destination', _load_params)
+    text = lazy_field('text', _load_params, invalidates=('unicode_text',))
+    parameters = lazy_field('parameters', _load_params)
+    parameters_raw = lazy_field('parameters_raw', _load_params)
+    command = lazy_field('command', _load_command)
+    command_params = lazy_field('command_params', _load_command)
+    command_params_raw = lazy_field('command_params_raw', _load_command)
+    unicode_text = lazy_field('unicode_text', _load_unicode_text)
+    # every parameter, destination first and text last, for commands whose
+    # arguments don't fit the destination/parameters/text mould
+    params = lazy_field('params', _load_all_params)
+
+    @property
+    def server_time(self):
+        """ when the server says this happened, with server-time enabled """
+        if not self._tags_raw:
+            return None
+        return parse_server_time(self.tags.get('time'))
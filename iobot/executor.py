@@ -0,0 +1,114 @@
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+
+from tornado.concurrent import Future
+from tornado.ioloop import PeriodicCallback
+
+# seconds between checks on work the pool failed without telling us
+POLL_INTERVAL = 0.5
+
+class ExecutorError(Exception):
+    pass
+
+def _call(fn, args, kwargs):
+    """ runs in the pool, exceptions are handed back rather than raised """
+    try:
+        return True, fn(*args, **kwargs)
+    except Exception as e:
+        return False, e
+
+class BotExecutor(object):
+    """
+    runs blocking or CPU heavy work for plugins on a thread or process pool
+    and resolves a tornado Future with the result back on the IOLoop.  with a
+    process pool the function and its arguments must be picklable.
+
+    python 2's pool only calls back on success, so while work is out the
+    pool is polled for tasks it failed itself, like an unpicklable function
+    or result.  a process pool whose worker died loses that worker's task
+    without a trace, so then, like python 3's BrokenProcessPool, every
+    outstanding Future fails and the pool is started afresh.
+    """
+    KINDS = ('thread', 'process')
+
+    def __init__(self, ioloop, kind='thread', workers=None):
+        if kind not in self.KINDS:
+            raise ExecutorError('Unknown executor %r' % kind)
+        self.ioloop = ioloop
+        self.kind = kind
+        self.workers = workers or cpu_count()
+        self.poll_interval = POLL_INTERVAL
+        self._pool = None
+        # pids of the process pool's workers when it started
+        self._pids = None
+        # Future -> AsyncResult for work still out
+        self._pending = dict()
+        self._poller = None
+
+    @property
+    def pool(self):
+        # started on first use so bots that never offload work never fork
+        if self._pool is None:
+            if self.kind == 'process':
+                self._pool = Pool(self.workers)
+                self._pids = self.worker_pids()
+            else:
+                self._pool = ThreadPool(self.workers)
+        return self._pool
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+
+        def resolve(result):
+            # called on the pool's result thread
+            self.ioloop.add_callback(self._resolve, future, result)
+
+        self._pending[future] = self.pool.apply_async(_call,
+                (fn, args, kwargs), callback=resolve)
+        if self._poller is None:
+            self._poller = PeriodicCallback(self.check,
+                    self.poll_interval * 1000, io_loop=self.ioloop)
+            self._poller.start()
+        return future
+
+    def worker_pids(self):
+        # the pool replaces workers that die, so changed pids give it away
+        return set(process.pid for process in self._pool._pool)
+
+    def check(self):
+        """ fails the Futures of work the pool has given up on """
+        if self._pids is not None and self.worker_pids() != self._pids:
+            self.fail_pending(ExecutorError('A pool worker process died'))
+            self.shutdown()
+        for future, result in self._pending.items():
+            if result.ready() and not result.successful():
+                del self._pending[future]
+                try:
+                    result.get(0)
+                except Exception as e:
+                    future.set_exception(e)
+        if not self._pending and self._poller is not None:
+            self._poller.stop()
+            self._poller = None
+
+    def fail_pending(self, error):
+        pending, self._pending = self._pending, dict()
+        for future in pending:
+            future.set_exception(error)
+
+    def _resolve(self, future, result):
+        if self._pending.pop(future, None) is None:
+            # already failed
+            return
+        ok, value = result
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def shutdown(self):
+        self.fail_pending(ExecutorError('The executor was shut down'))
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+            self._pids = None
@@ -0,0 +1,270 @@
+import json
+import logging
+import re
+from collections import deque
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpserver import HTTPServer
+from tornado.web import Application, RequestHandler, HTTPError
+
+from iobot.event import IrcEvent
+
+GATEWAY_ADDRESS = '127.0.0.1'
+# nick commands run as when the request doesn't name one
+GATEWAY_NICK = 'http'
+GATEWAY_HOST = 'gateway'
+# most commands one batch request may run
+MAX_BATCH = 100
+LOOPBACK_ADDRESSES = frozenset(['localhost', '::1'])
+# what would let a nick or channel rewrite the line its event is parsed from
+INVALID_NAME_PATTERN = re.compile(r'[ :!@,\r\n]')
+EOL_PATTERN = re.compile(r'[\r\n]+')
+
+class GatewayError(Exception):
+    """ status is the http status the error is answered with """
+    def __init__(self, message, status=404):
+        super(GatewayError, self).__init__(message)
+        self.status = status
+
+def is_loopback(address):
+    return address in LOOPBACK_ADDRESSES or address.startswith('127.')
+
+class GatewayConnection(object):
+    """
+    what a plugin sees as its connection for a command run over http.
+    replies and private messages are kept in replies rather than sent, and
+    everything else goes to the IrcConnection of the server the request
+    named, so join or part still act on irc.  the caller picks the nick a
+    command runs as, so the connection's owners only count when trusted,
+    ie the request came with the gateway's token.
+    """
+    def __init__(self, gateway, connection=None, trusted=False):
+        self.gateway = gateway
+        bot = self.bot = gateway.bot
+        self.connection = connection
+        self.replies = []
+        self.owners = connection.owners if trusted and connection else []
+        if connection is None:
+            self.server_name = None
+            self.nick = bot.nick
+            self.logger = logging.getLogger(__name__)
+
+    def __getattr__(self, name):
+        if self.connection is None:
+            raise AttributeError(name)
+        return getattr(self.connection, name)
+
+    # commands over http share the gateway's handler slots rather than
+    # taking those of the irc connection they run against
+    @property
+    def inflight(self):
+        return self.gateway.inflight
+
+    @inflight.setter
+    def inflight(self, value):
+        self.gateway.inflight = value
+
+    @property
+    def pending_handlers(self):
+        return self.gateway.pending_handlers
+
+    @property
+    def dropped_handlers(self):
+        return self.gateway.dropped_handlers
+
+    @dropped_handlers.setter
+    def dropped_handlers(self, value):
+        self.gateway.dropped_handlers = value
+
+    def make_event(self, command, args='', nick=GATEWAY_NICK,
+            destination=None):
+        """ a PRIVMSG addressing command to the bot, as if said on irc """
+        line = ':%s!%s@%s PRIVMSG %s :%s: %s' % (nick, nick, GATEWAY_HOST,
+                destination or self.nick, self.nick, command)
+        if args:
+            line += ' ' + args
+        return IrcEvent(self.nick, line)
+
+    def private_message(self, destination, message):
+        self.replies.append(message)
+
+    def reply(self, event, message):
+        self.replies.append(message)
+
+    def reply_with_nick(self, event, message):
+        self.replies.append(message)
+
+class Gateway(object):
+    """
+    serves the bot's commands over http on the bot's IOLoop:
+
+        GET  /commands              the command names
+        GET  /commands/<command>    runs it, arguments from the query string
+        POST /commands/<command>    arguments from a json object
+        POST /batch                 {"commands": [{"command": ...}, ...]}
+
+    a command's arguments are args (the text after the command), nick,
+    channel and server, the name of the connection it runs against.  the
+    reply is {"command": ..., "replies": [...]}, or {"error": ...}.  a batch
+    runs its commands at once and streams each result back as a line of
+    json, in order, as soon as it and those before it are done.
+
+    with a token, requests must send "Authorization: Bearer <token>", and
+    only then may they run admin commands as one of the owners.  without
+    one the gateway only listens on loopback.
+
+    commands run like those from irc, through the bot's run_handler, with
+    its max_inflight, max_pending and handler_timeout applying to all of
+    the gateway's commands together.
+    """
+    def __init__(self, bot, token=None):
+        self.bot = bot
+        self.token = token
+        self.server = None
+        self.inflight = 0
+        self.pending_handlers = deque()
+        self.dropped_handlers = 0
+
+    def application(self):
+        kwargs = dict(gateway=self)
+        return Application([
+            (r'/commands', CommandListHandler, kwargs),
+            (r'/commands/([^/]+)', CommandHandler, kwargs),
+            (r'/batch', BatchHandler, kwargs),
+            ])
+
+    def listen(self, port, address=GATEWAY_ADDRESS):
+        if not self.token and not is_loopback(address):
+            raise GatewayError('Refusing to listen on %s without a token' %
+                    address)
+        self.server = HTTPServer(self.application())
+        self.server.listen(port, address)
+        return self.server
+
+    def stop(self):
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+
+    def connection_for(self, server_name=None):
+        connections = self.bot.connections
+        if server_name is None:
+            if not connections:
+                return None
+            server_name = sorted(connections)[0]
+        connection = connections.get(server_name)
+        if connection is None:
+            raise GatewayError('No server %s' % server_name)
+        return connection
+
+    @gen.coroutine
+    def run_command(self, command, args='', nick=None, channel=None,
+            server=None, trusted=False):
+        """
+        runs a command, resolving to the list of its replies.  trusted
+        lets admin commands run for the connection's owners.
+        """
+        plugin_method = self.bot._command_handlers.get(command)
+        if plugin_method is None:
+            raise GatewayError('No command %s' % command)
+        for name, value in (('nick', nick), ('channel', channel)):
+            if value is not None and (not isinstance(value, basestring) or
+                    not value or INVALID_NAME_PATTERN.search(value)):
+                raise GatewayError('Invalid %s' % name, 400)
+        if not isinstance(args or '', basestring):
+            raise GatewayError('Invalid args', 400)
+        if (self.inflight >= self.bot.max_inflight and
+                len(self.pending_handlers) >= self.bot.max_pending):
+            raise GatewayError('Too many commands waiting', 503)
+        conn = GatewayConnection(self, self.connection_for(server), trusted)
+        event = conn.make_event(command, EOL_PATTERN.sub(' ', args or ''),
+                nick or GATEWAY_NICK, channel)
+        outcome = Future()
+        self.bot.run_handler(conn, event, plugin_method, outcome)
+        yield outcome
+        raise gen.Return(conn.replies)
+
+class GatewayHandler(RequestHandler):
+    def initialize(self, gateway):
+        self.gateway = gateway
+
+    def prepare(self):
+        token = self.gateway.token
+        if token and self.request.headers.get('Authorization') != (
+                'Bearer %s' % token):
+            raise HTTPError(403)
+
+    def json_body(self):
+        try:
+            body = json.loads(self.request.body or '{}')
+        except ValueError:
+            raise HTTPError(400, 'Invalid json')
+        if not isinstance(body, dict):
+            raise HTTPError(400, 'Expected a json object')
+        return body
+
+    def write_error(self, status_code, **kwargs):
+        error = self._reason
+        e = kwargs.get('exc_info', (None, None))[1]
+        if isinstance(e, HTTPError) and e.log_message:
+            error = e.log_message
+        self.finish({'error': error})
+
+    @gen.coroutine
+    def run(self, command, params):
+        """ runs a command, to a result dict whether it worked or not """
+        try:
+            replies = yield self.gateway.run_command(command,
+                    params.get('args'), params.get('nick'),
+                    params.get('channel'), params.get('server'),
+                    trusted=bool(self.gateway.token))
+        except GatewayError as e:
+            raise gen.Return({'command': command, 'error': str(e),
+                'status': e.status})
+        except gen.TimeoutError:
+            raise gen.Return({'command': command, 'status': 504, 'error':
+                'Timed out after %ss' % self.gateway.bot.handler_timeout})
+        except Exception as e:
+            logging.getLogger(__name__).exception('GATEWAY COMMAND FAILED '
+                    '{command: %s}', command)
+            raise gen.Return({'command': command, 'error': str(e),
+                'status': 500})
+        raise gen.Return({'command': command, 'replies': replies})
+
+class CommandListHandler(GatewayHandler):
+    def get(self):
+        self.write({'commands': sorted(self.gateway.bot._command_handlers)})
+
+class CommandHandler(GatewayHandler):
+    @gen.coroutine
+    def get(self, command):
+        params = dict((name, self.get_query_argument(name))
+                for name in self.request.query_arguments)
+        yield self.respond(command, params)
+
+    @gen.coroutine
+    def post(self, command):
+        yield self.respond(command, self.json_body())
+
+    @gen.coroutine
+    def respond(self, command, params):
+        result = yield self.run(command, params)
+        self.set_status(result.pop('status', 200))
+        self.write(result)
+
+class BatchHandler(GatewayHandler):
+    @gen.coroutine
+    def post(self):
+        commands = self.json_body().get('commands')
+        if not isinstance(commands, list) or not all(
+                isinstance(c, dict) and 'command' in c for c in commands):
+            raise HTTPError(400, 'Expected a list of commands')
+        if len(commands) > MAX_BATCH:
+            raise HTTPError(400, 'At most %d commands' % MAX_BATCH)
+        self.set_header('Content-Type', 'application/x-ndjson')
+        results = [self.run(params['command'], params) for params in commands]
+        for result in results:
+            result = yield result
+            self.write(json.dumps(result) + '\n')
+            yield self.flush()
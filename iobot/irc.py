@@ -1,20 +1,121 @@
+import base64
+import codecs
+import random
 import socket
+import time
+from collections import deque
 
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
 from tornado.iostream import IOStream
 from tornado.iostream import SSLIOStream
+from tornado.iostream import StreamClosedError
 
-from iobot.event import IrcEvent
-from iobot.user import IrcUser
-from logging import getLogger
+from iobot.event import IrcEvent, FALLBACK_ENCODING
+from iobot.isupport import ServerSupport, MAX_LINE_LENGTH
+from iobot.metrics import Histogram, NULL_REGISTRY
+from iobot.sendq import SendQueue, FLOOD_RATE, FLOOD_BURST
+from iobot.state import IrcState, CaseMappedDict, DEFAULT_PREFIXES
+from logging import getLogger, DEBUG
 
 class IrcError(Exception):
     pass
 
 EOL = '\r\n'
+READ_CHUNK_SIZE = 65536
+# seconds, the reconnect delay doubles from RECONNECT_DELAY up to
+# RECONNECT_MAX_DELAY with jitter so a netsplit doesn't reconnect every bot
+# at the same moment
+RECONNECT_DELAY = 2
+RECONNECT_MAX_DELAY = 300
+# seconds between our own PINGs, and of silence before the link is dead
+PING_INTERVAL = 60
+PING_TIMEOUT = 240
+# IRCv3 capabilities asked for whenever the server offers them, sasl is
+# asked for separately when there is a password to use it with
+WANTED_CAPS = frozenset(['multi-prefix', 'userhost-in-names', 'away-notify',
+    'server-time', 'message-tags', 'batch', 'cap-notify'])
+# AUTHENTICATE payloads go out in pieces of at most this many bytes
+SASL_CHUNK = 400
+# the most of a line a PRIVMSG's targets may take, the rest is for text
+MAX_TARGETS_SHARE = 0.5
+# longest hostname, for guessing how long the server's prefix for us is
+# before we have seen it
+MAX_HOST_LENGTH = 63
+# the least text a line carries however little room the server leaves, one
+# whole UTF-8 character
+MIN_TEXT_LENGTH = 4
+
+def group_targets(targets, limit, max_targets=None):
+    """
+    yields lists of targets whose comma joined length fits in limit, of at
+    most max_targets each
+    """
+    batch = []
+    length = -1
+    for target in targets:
+        if batch and (length + 1 + len(target) > limit or
+                len(batch) == max_targets):
+            yield batch
+            batch = []
+            length = -1
+        batch.append(target)
+        length += 1 + len(target)
+    if batch:
+        yield batch
+
+def pack_targets(command, targets, max_length=MAX_LINE_LENGTH,
+        max_targets=None):
+    """
+    yields '<command> a,b,c' lines holding as many targets as fit in
+    max_length, up to max_targets
+    """
+    limit = max_length - len(EOL) - len(command) - 1
+    for batch in group_targets(targets, limit, max_targets):
+        yield '%s %s' % (command, ','.join(batch))
+
+def split_text(text, limit):
+    """
+    yields pieces of the bytes in text of at most limit bytes, split at the
+    last space that fits where there is one, and never inside a UTF-8
+    sequence
+    """
+    if limit < 1:
+        raise ValueError('Cannot split text into pieces of %d bytes' % limit)
+    while len(text) > limit:
+        cut = text.rfind(' ', 0, limit + 1)
+        if cut > 0:
+            yield text[:cut]
+            text = text[cut + 1:]
+            continue
+        cut = limit
+        # back off continuation bytes to the start of the character
+        while cut > 0 and 0x80 <= ord(text[cut]) < 0xc0:
+            cut -= 1
+        if cut == 0:
+            cut = limit
+        yield text[:cut]
+        text = text[cut:]
+    if text:
+        yield text
+
+class Batch(object):
+    """ the events of an IRCv3 batch, held until the batch ends """
+    __slots__ = ('type', 'params', 'parent', 'events')
+
+    def __init__(self, type, params, parent=None):
+        self.type = type
+        self.params = params
+        self.parent = parent
+        self.events = []
 
 class IrcConnection(object):
     def __init__(self, bot, server_name, address, port, nick, user,
-            realname, owners, channels=None, password=None, ssl=None):
+            realname, owners, channels=None, password=None, ssl=None,
+            batch_reads=True, flood_rate=FLOOD_RATE, flood_burst=FLOOD_BURST,
+            registry=None, ping_interval=PING_INTERVAL,
+            ping_timeout=PING_TIMEOUT, metrics=None, capture=None,
+            sasl=False, account=None, encoding=FALLBACK_ENCODING):
         self.bot = bot
         self.server_name = server_name
         self.owners = owners
@@ -22,16 +123,71 @@ class IrcConnection(object):
         self.port = port
         self.nick = nick
         self.user = user
+        # the password is sent as PASS before NICK and USER.  with sasl it
+        # is sent with SASL PLAIN as account, which defaults to the nick,
+        # falling back to PASS if the server lacks or refuses sasl
         self.password = password
+        self.sasl = sasl
+        self.account = account
         self.ssl = ssl
         self.realname = realname
         self.initial_channels = set(channels) if channels else set()
-
-        self.logger = getLogger(__name__)
+        self.batch_reads = batch_reads
+        # bytes read past the last complete line
+        self._read_buffer = bytearray()
+        # what lines that aren't UTF-8 are decoded as
+        self.encoding = codecs.lookup(encoding).name
+        self._stream = None
+        self.ioloop = IOLoop.current()
+        self.reconnect = True
+        self.reconnect_attempts = 0
+        self._reconnect_timeout = None
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.last_read = None
+        # round trip of our PINGs, which includes any time the IOLoop spent
+        # busy before it got to read the PONG
+        self.lag = Histogram()
+        self.metrics = metrics or NULL_REGISTRY
+        self.metrics.register('iobot_ping_lag_seconds', self.lag,
+                'keepalive PING round trip', server=server_name)
+        self._lines_read = self.metrics.counter('iobot_lines_read_total',
+                'lines read from the server', server=server_name)
+        self._lines_written = self.metrics.counter('iobot_lines_written_total',
+                'lines queued to the server', server=server_name)
+        self._parse_time = self.metrics.histogram('iobot_event_parse_seconds',
+                'time to build an IrcEvent and parse its type',
+                server=server_name)
+        # event type -> counter, filled in as types turn up
+        self._event_counts = dict()
+        self._keepalive = None
+        self._pings = dict()
+        self._ping_seq = 0
+        # asynchronous plugin handlers running, and those waiting for a slot
+        self.inflight = 0
+        self.pending_handlers = deque()
+        self.dropped_handlers = 0
+        # capabilities the server offered and those we have enabled
+        self.cap_ls = dict()
+        self.caps = set()
+        self._cap_negotiating = False
+        # whether the server has welcomed us since we last connected
+        self.registered = False
+        # batch reference -> Batch, for batches still open
+        self._batches = dict()
+        # the server's 005 tokens, and our user@host as it relays it
+        self.isupport = ServerSupport()
+        self.userhost = None
+        self._sendq = SendQueue(self.ioloop, self._write, flood_rate,
+                flood_burst)
+
+        # iobot.irc.<server name>, so one server's logging can be turned up
+        self.logger = getLogger('%s.%s' % (__name__, server_name))
+        # a RawCapture every line read and written is copied to
+        self.capture = capture
 
         self._protocol_events = dict()
-        self.channels = dict()
-        self.users = dict()
+        self.state = IrcState(registry=registry)
         self.init_protocol_events()
 
     def init_protocol_events(self):
@@ -41,87 +197,301 @@ class IrcConnection(object):
             'JOIN'    : self.on_join,
             '401'     : self.on_nochan,
             '001'     : self.on_welcome,
+            '433'     : self.on_nick_in_use,
+            '421'     : self.on_unknown_command,
             'KICK'    : self.on_kick,
             'PART'    : self.on_part,
             '353'     : self.on_names,
-            'NICK'    : self.on_nick
+            'NICK'    : self.on_nick,
+            'QUIT'    : self.on_quit,
+            'MODE'    : self.on_mode,
+            '352'     : self.on_who,
+            '366'     : self.on_end_of_names,
+            '403'     : self.on_cannot_join,
+            '405'     : self.on_cannot_join,
+            '471'     : self.on_cannot_join,
+            '473'     : self.on_cannot_join,
+            '474'     : self.on_cannot_join,
+            '475'     : self.on_cannot_join,
+            'PONG'    : self.on_pong,
+            'CAP'     : self.on_cap,
+            'AUTHENTICATE': self.on_authenticate,
+            '903'     : self.on_sasl_success,
+            '902'     : self.on_sasl_failure,
+            '904'     : self.on_sasl_failure,
+            '905'     : self.on_sasl_failure,
+            '906'     : self.on_sasl_failure,
+            '907'     : self.on_sasl_failure,
+            'BATCH'   : self.on_batch,
+            'AWAY'    : self.on_away,
+            '005'     : self.on_isupport,
         }
 
+    @property
+    def channels(self):
+        return self.state.channels
+
+    @property
+    def users(self):
+        return self.state.users
+
+    @gen.coroutine
     def connect(self, reconnecting=False):
-        self.logger.debug('CONNECTING...')
-        _sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
+        self.logger.debug('%s...', 'RECONNECTING' if reconnecting else
+            'CONNECTING')
+        try:
+            # getaddrinfo blocks, resolve on the bot's executor
+            addrinfo = yield self.bot.submit(socket.getaddrinfo,
+                    self.address, self.port, 0, socket.SOCK_STREAM)
+        except Exception as e:
+            # socket.error, or the executor failing the lookup itself
+            self.logger.error('Could not resolve %s: %s', self.address, e)
+            if self.reconnect:
+                self.schedule_reconnect()
+            return
+        if not self.reconnect:
+            # disconnect() was called while we were resolving
+            return
+        family, socktype, proto, _, sockaddr = addrinfo[0]
+        _sock = socket.socket(family, socktype, proto)
 
         if self.ssl is None:
-            self._stream = IOStream(_sock)
+            stream = IOStream(_sock)
         elif self.ssl is True:
-            self._stream = SSLIOStream(_sock)
+            stream = SSLIOStream(_sock)
         else:
-            self._stream = SSLIOStream(_sock, ssl_options=self.ssl)
-
-        self._stream.connect((self.address, self.port), self._register)
+            stream = SSLIOStream(_sock, ssl_options=self.ssl)
+        stream.set_close_callback(lambda: self._on_close(stream))
+        self._stream = stream
+
+        try:
+            yield stream.connect(sockaddr, server_hostname=self.address)
+        except StreamClosedError:
+            # the close callback schedules the retry
+            return
+        self._register()
+
+    def _on_close(self, stream):
+        if stream is not self._stream:
+            return
+        self.logger.warning('DISCONNECTED {error: %s}', stream.error)
+        self._stream = None
+        del self._read_buffer[:]
+        self._sendq.clear()
+        self._batches.clear()
+        self.stop_keepalive()
+        if self.reconnect:
+            self.schedule_reconnect()
+
+    def schedule_reconnect(self):
+        delay = min(RECONNECT_MAX_DELAY,
+                RECONNECT_DELAY * 2 ** self.reconnect_attempts)
+        delay = random.uniform(delay / 2.0, delay)
+        self.reconnect_attempts += 1
+        self.logger.info('RECONNECTING IN %.1fs', delay)
+        self._reconnect_timeout = self.ioloop.add_timeout(
+                self.ioloop.time() + delay, self._reconnect)
+
+    def _reconnect(self):
+        self._reconnect_timeout = None
+        if self.reconnect:
+            self.connect(reconnecting=True)
+
+    def disconnect(self, message='Leaving'):
+        """ sends QUIT and closes the link for good """
+        self.reconnect = False
+        if self._reconnect_timeout is not None:
+            self.ioloop.remove_timeout(self._reconnect_timeout)
+            self._reconnect_timeout = None
+        self.stop_keepalive()
+        stream = self._stream
+        if stream is None:
+            return
+        self._sendq.clear()
+        try:
+            # straight to the stream, past anything queued behind flood
+            # control, and closed once it is written
+            stream.write('QUIT :%s%s' % (message, EOL), callback=stream.close)
+        except StreamClosedError:
+            pass
 
     def _register(self):
         self.logger.debug('CONNECTED')
-
-        if self.password:
-            # TODO need to check for error responses
-            self.authenticate()
-
+        del self._read_buffer[:]
+        self.cap_ls = dict()
+        self.caps = set()
+        self._batches.clear()
+        self.isupport = ServerSupport()
+        self.userhost = None
+        self.registered = False
+
+        if self.password and not self.sasl:
+            self.send_pass()
+
+        # registration waits for CAP END, servers without CAP ignore it
+        self._cap_negotiating = True
+        self.write_raw('CAP LS 302')
         self.set_nick(self.nick)
         self.write_raw('USER %s 0 * :%s' % (self.user, self.realname))
 
+        self.start_keepalive()
         self._next()
 
+    def start_keepalive(self):
+        self.stop_keepalive()
+        self.last_read = self.ioloop.time()
+        if self.ping_interval:
+            self._keepalive = PeriodicCallback(self.keepalive,
+                    self.ping_interval * 1000, io_loop=self.ioloop)
+            self._keepalive.start()
+
+    def stop_keepalive(self):
+        if self._keepalive is not None:
+            self._keepalive.stop()
+            self._keepalive = None
+        self._pings.clear()
+
+    def keepalive(self):
+        """
+        sends a timed PING, or gives up on a link that has been silent past
+        ping_timeout so the reconnect logic takes over
+        """
+        now = self.ioloop.time()
+        if self.ping_timeout and now - self.last_read > self.ping_timeout:
+            self.logger.warning('PING TIMEOUT {silent: %.0fs}',
+                    now - self.last_read)
+            if self._stream is not None:
+                self._stream.close()
+            return
+        # PINGs never answered would otherwise pile up for good
+        max_age = self.ping_timeout or PING_TIMEOUT
+        for token, sent in self._pings.items():
+            if now - sent > max_age:
+                del self._pings[token]
+        self._ping_seq += 1
+        token = 'iobot-%d' % self._ping_seq
+        self._pings[token] = now
+        self.write_raw('PING :%s' % token)
+
+    def is_me(self, nick):
+        fold = self.users.fold
+        return nick is not None and fold(nick) == fold(self.nick)
+
     def add_channel(self, channel):
-        self.channels[channel] = []
+        self.state.add_channel(channel)
 
     def remove_channel(self, channel):
-        del self.channels[channel]
+        self.state.remove_channel(channel)
 
-    def add_user(self, channel, user):
-        self.channels[channel].append(user)
-        self.users[user.nick] = user
+    def add_user(self, channel, user, modes=()):
+        self.state.join(channel, user.nick, user.user, user.host, modes)
 
     def remove_user(self, channel, user):
-        self.channels[channels].remove(user)
-        del self.users[user.nick]
+        self.state.part(channel, user.nick)
 
     def user_change_nick(self, old_nick, new_nick):
-        user = self.users.pop(old_nick)
-        user.nick = new_nick
-        self.users[new_nick] = user
+        self.state.change_nick(old_nick, new_nick)
+
+    def send_pass(self):
+        self.logger.debug('SENDING PASS')
+        # straight onto the queue, kept out of the logs and capture
+        self._sendq.push('PASS %s' % self.password)
 
     def authenticate(self):
-        self.logger.debug("Authenticating (%s)", self.password)
-        self.write_raw('PASS %s' % self.password)
+        """ starts SASL PLAIN, once the server has ACKed sasl """
+        self.logger.debug('AUTHENTICATING {account: %s}',
+                self.account or self.nick)
+        self.write_raw('AUTHENTICATE PLAIN')
+
+    def request_caps(self, offered, registering=True):
+        wanted = sorted(name for name in offered
+                if name in WANTED_CAPS and name not in self.caps)
+        if self.password and self.sasl and registering:
+            mechanisms = offered.get('sasl')
+            if mechanisms is not None and (not mechanisms or
+                    'PLAIN' in mechanisms.split(',')):
+                wanted.append('sasl')
+            else:
+                self.logger.warning('SASL PLAIN UNAVAILABLE, SENDING PASS')
+                self.send_pass()
+        if wanted:
+            self.write_raw('CAP REQ :%s' % ' '.join(wanted))
+        else:
+            self.end_cap()
+
+    def end_cap(self):
+        if self._cap_negotiating:
+            self._cap_negotiating = False
+            self.write_raw('CAP END')
 
     def set_nick(self, nick):
         if not nick:
             raise IrcError('Cannot set empty nick')
-        self.logger.debug('SETTING NICK {nick: %s}' % nick)
+        self.logger.debug('SETTING NICK {nick: %s}', nick)
         self.write_raw('NICK %s' % nick)
 
     def join_channel(self, *channels):
         if not all([c for c in channels]):
             raise IrcError('Empty channel')
-        self.logger.debug('JOINING CHANNEL(S): {channels: %s}' % repr(channels))
-        chan_def = ','.join(channels)
-        self.write_raw('JOIN %s' % chan_def)
+        self.logger.debug('JOINING CHANNEL(S): {channels: %r}', channels)
+        for line in pack_targets('JOIN', channels, self.isupport.linelen,
+                self.isupport.targmax('JOIN')):
+            self.write_raw(line)
 
     def part_channel(self, *channels):
         if not all([c for c in channels]):
             raise IrcError('Empty channel')
-        self.logger.debug('PARTING CHANNEL: {channels: %s}' % repr(channels))
-        chan_def = ','.join(channels)
-        self.write_raw('PART :%s' % chan_def)
+        self.logger.debug('PARTING CHANNEL: {channels: %r}', channels)
+        for line in pack_targets('PART', channels, self.isupport.linelen,
+                self.isupport.targmax('PART')):
+            self.write_raw(line)
 
     def private_message(self, destination, message):
+        """
+        sends message to destination, a target or a list of them.  targets
+        are packed up to the server's TARGMAX, and each line of the message
+        is split to fit the server's line length once it has added our
+        prefix.
+        """
         if not message:
             raise IrcError('Cannot send empty message')
         if not destination:
             raise IrcError('Cannot send to empty destination')
-        self.logger.debug('SENDING PRIVMSG: {destination: %s, message: %s}' % (destination, message))
-        self.write_raw('PRIVMSG %s :%s' % (destination, message))
+        if isinstance(destination, basestring):
+            targets = [destination]
+        else:
+            targets = list(destination)
+            if not all(targets):
+                raise IrcError('Cannot send to empty destination')
+        if isinstance(message, unicode):
+            message = message.encode('utf-8')
+        if self.logger.isEnabledFor(DEBUG):
+            self.logger.debug('SENDING PRIVMSG: {destination: %s, '
+                    'message: %s}', ','.join(targets), message)
+        linelen = self.isupport.linelen
+        lines = [line for line in message.splitlines() if line]
+        for group in group_targets(targets, int(linelen * MAX_TARGETS_SHARE),
+                self.isupport.targmax('PRIVMSG')):
+            destination = ','.join(group)
+            limit = self.message_limit('PRIVMSG', group)
+            for line in lines:
+                for text in split_text(line, limit):
+                    self.write_raw('PRIVMSG %s :%s' % (destination, text))
+
+    def message_limit(self, command, targets):
+        """
+        the longest text a message to targets can carry, as sent by us and
+        as relayed with our nick!user@host in front.  a tiny LINELEN or long
+        targets can leave no room, the line then runs over and the server
+        truncates it.
+        """
+        userhost = self.userhost or '~%s@%s' % (self.user,
+                'x' * MAX_HOST_LENGTH)
+        sent = len('%s %s :%s' % (command, ','.join(targets), EOL))
+        relayed = len(':%s!%s %s %s :%s' % (self.nick, userhost, command,
+            max(targets, key=len), EOL))
+        return max(self.isupport.linelen - max(sent, relayed),
+                MIN_TEXT_LENGTH)
 
     def reply(self, event, message):
         if event.destination and event.destination != self.nick:
@@ -140,23 +510,94 @@ class IrcConnection(object):
             raise IrcError('Cannot kick from empty channel')
         if not user:
             raise IrcError('Cannot kick empty player')
-        self.logger.debug('KICKING {channel: %s, user: %s}' % (channel, user))
+        self.logger.debug('KICKING {channel: %s, user: %s}', channel, user)
         kick_str = 'KICK %s %s' % (channel, user)
         if comment:
             kick_str += ' :%s' % comment
         self.write_raw(kick_str)
 
     def write_raw(self, line):
-        line.replace(EOL, '')
-        self.logger.debug('WRITE RAW: {line: %s}' % line)
-        self._stream.write(line + EOL)
-
-    def read_raw(self, line):
-        self.logger.debug('READ RAW: {line: %s}' % line.replace(EOL, ''))
-        event = IrcEvent(self.nick, line)
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        if EOL in line:
+            line = line.replace(EOL, '')
+        if self.logger.isEnabledFor(DEBUG):
+            self.logger.debug('WRITE RAW: {line: %s}', line)
+        if self.capture is not None:
+            self.capture.write(self.server_name, '>', line)
+        self._lines_written.inc()
+        self._sendq.push(line)
+
+    def _write(self, data):
+        if self._stream is None:
+            return
+        try:
+            self._stream.write(data)
+        except StreamClosedError:
+            pass
+
+    def dispatch(self, event):
         self.handle(event)
         self.bot.process_hooks(self, event)
         self.bot.process_plugins(self, event)
+
+    def read_raw(self, line):
+        if self.logger.isEnabledFor(DEBUG):
+            self.logger.debug('READ RAW: {line: %s}', line.rstrip(EOL))
+        if self.capture is not None:
+            self.capture.write(self.server_name, '<', line.rstrip(EOL))
+        if self.metrics.enabled:
+            event = self._measured_event(line)
+        else:
+            event = IrcEvent(self.nick, line, self.encoding)
+        if self._batches and event.type != 'BATCH':
+            batch = self._batches.get(event.tags.get('batch'))
+            if batch is not None:
+                batch.events.append(event)
+                return
+        self.dispatch(event)
+
+    def _measured_event(self, line):
+        self._lines_read.inc()
+        start = time.time()
+        event = IrcEvent(self.nick, line, self.encoding)
+        event_type = event.type
+        self._parse_time.observe(time.time() - start)
+        counter = self._event_counts.get(event_type)
+        if counter is None:
+            counter = self._event_counts[event_type] = self.metrics.counter(
+                    'iobot_events_total', 'events dispatched by type',
+                    server=self.server_name, type=event_type)
+        counter.inc()
+        return event
+
+    def read_lines(self, lines):
+        for line in lines:
+            if line:
+                self.read_raw(line)
+
+    def read_chunk(self, data):
+        """
+        handles whatever bytes the stream had buffered, dispatching every
+        complete line and carrying a trailing partial line to the next read
+        """
+        self.last_read = self.ioloop.time()
+        buf = self._read_buffer
+        if not buf and data[-2:] == EOL:
+            # the usual case, nothing carried over and nothing left
+            self.read_lines(data[:-2].split(EOL))
+        else:
+            buf.extend(data)
+            end = buf.rfind(EOL)
+            if end != -1:
+                lines = memoryview(buf)[:end].tobytes().split(EOL)
+                del buf[:end + len(EOL)]
+                self.read_lines(lines)
+        self._next()
+
+    def read_line(self, line):
+        self.last_read = self.ioloop.time()
+        self.read_raw(line)
         self._next()
 
     def handle(self, event):
@@ -164,84 +605,327 @@ class IrcConnection(object):
             self._protocol_events[event.type](event)
 
     def _next(self):
-        self._stream.read_until(EOL, self.read_raw)
+        if self._stream is None:
+            return
+        try:
+            if self.batch_reads:
+                self._stream.read_bytes(READ_CHUNK_SIZE, self.read_chunk,
+                        partial=True)
+            else:
+                self._stream.read_until(EOL, self.read_line)
+        except StreamClosedError:
+            pass
 
     def on_welcome(self, event):
         self.logger.debug('RECIEVED RPL_WELCOME')
-        if self.initial_channels:
-            self.join_channel(*self.initial_channels)
+        self.reconnect_attempts = 0
+        self._cap_negotiating = False
+        self.registered = True
+        if event.destination:
+            # the nick we registered with, which 433 may have changed
+            self.nick = event.destination
+        # after a reconnect also rejoin whatever we were in, the channel
+        # state is kept and resynced from the NAMES replies
+        channels = CaseMappedDict(self.state.casemapping)
+        for channel in self.initial_channels:
+            channels[channel] = channel
+        for channel in self.state.channels.values():
+            channels[channel.name] = channel.name
+        if channels:
+            self.join_channel(*sorted(channels.values()))
+
+    def on_nick_in_use(self, event):
+        # :irc.server 433 * iobot :Nickname is already in use.
+        if self.registered:
+            self.logger.warning('NICK IN USE {nick: %s}',
+                    event.parameters[0] if event.parameters else None)
+            return
+        # most likely our own ghost from before a ping timeout, registration
+        # stalls until we pick another
+        rejected = event.parameters[0] if event.parameters else self.nick
+        nick = rejected + '_'
+        nicklen = self.isupport.get('NICKLEN')
+        if nicklen and nicklen.isdigit() and len(nick) > int(nicklen):
+            nick = rejected[:int(nicklen) - 1] + str(random.randint(0, 9))
+        self.logger.warning('NICK IN USE {nick: %s, trying: %s}', rejected,
+                nick)
+        self.nick = nick
+        self.set_nick(nick)
 
     def on_ping(self, event):
         # One ping only, please
         self.logger.debug('RECIEVED PING')
-        self.write_raw("PONG %s\r\n" % event.text)
+        self.write_raw('PONG :%s' % event.text)
+
+    def on_pong(self, event):
+        # :irc.server PONG irc.server :iobot-12, the colon is optional
+        sent = self._pings.pop(event.text, None)
+        if sent is not None:
+            self.lag.observe(self.ioloop.time() - sent)
+            # anything older was lost, don't let it pile up
+            self._pings.clear()
+
+    def on_cap(self, event):
+        # :irc.server CAP * LS * :multi-prefix sasl=PLAIN,EXTERNAL
+        # :irc.server CAP iobot ACK :multi-prefix sasl
+        params = event.params
+        if len(params) < 2:
+            return
+        subcommand = params[1].upper()
+        args = params[2:]
+        more = len(args) > 1 and args[0] == '*'
+        caps = args[-1].split() if args else []
+        self.logger.debug('RECIEVED CAP {subcommand: %s, caps: %s}',
+                subcommand, caps)
+        if subcommand in ('LS', 'NEW'):
+            offered = dict(cap.partition('=')[::2] for cap in caps)
+            self.cap_ls.update(offered)
+            if subcommand == 'NEW':
+                self.request_caps(offered, registering=False)
+            elif not more:
+                self.request_caps(self.cap_ls)
+        elif subcommand == 'ACK':
+            for cap in caps:
+                if cap.startswith('-'):
+                    self.caps.discard(cap[1:])
+                else:
+                    self.caps.add(cap)
+            if ('sasl' in caps and self.password and self.sasl and
+                    self._cap_negotiating):
+                self.authenticate()
+            else:
+                self.end_cap()
+        elif subcommand == 'NAK':
+            self.logger.warning('CAP REFUSED {caps: %s}', caps)
+            if ('sasl' in caps and self.password and self.sasl and
+                    self._cap_negotiating):
+                self.logger.warning('SASL REFUSED, SENDING PASS')
+                self.send_pass()
+            self.end_cap()
+        elif subcommand == 'DEL':
+            for cap in caps:
+                self.caps.discard(cap)
+                self.cap_ls.pop(cap, None)
+
+    def on_authenticate(self, event):
+        # AUTHENTICATE +
+        if (event.destination or event.text) != '+':
+            return
+        account = self.account or self.nick
+        payload = base64.b64encode('%s\0%s\0%s' % (account, account,
+            self.password))
+        chunks = [payload[i:i + SASL_CHUNK]
+                for i in range(0, len(payload), SASL_CHUNK)]
+        if not chunks or len(chunks[-1]) == SASL_CHUNK:
+            chunks.append('+')
+        for chunk in chunks:
+            # not through write_raw, the payload holds the password
+            self._sendq.push('AUTHENTICATE %s' % chunk)
+
+    def on_sasl_success(self, event):
+        self.logger.info('SASL AUTHENTICATED {account: %s}',
+                self.account or self.nick)
+        self.end_cap()
+
+    def on_sasl_failure(self, event):
+        self.logger.error('SASL FAILED {numeric: %s, reason: %s}',
+                event.type, event.text)
+        self.end_cap()
+
+    def on_batch(self, event):
+        # :irc.server BATCH +ref netsplit irc.hub other.host
+        # :irc.server BATCH -ref
+        ref = event.destination
+        if not ref:
+            return
+        if ref[0] == '+':
+            parent = event.tags.get('batch')
+            self._batches[ref[1:]] = Batch(
+                    event.parameters[0] if event.parameters else None,
+                    event.parameters[1:], parent)
+            return
+        batch = self._batches.pop(ref[1:], None)
+        if batch is None:
+            return
+        parent = self._batches.get(batch.parent)
+        if parent is not None:
+            # nested batches are applied with the outermost one
+            parent.events.extend(batch.events)
+        else:
+            self.apply_batch(batch)
+
+    def apply_batch(self, batch):
+        """
+        applies a whole batch, a netjoin or netsplit say, to the state before
+        plugins see any of its events
+        """
+        self.logger.debug('APPLYING BATCH {type: %s, events: %d}',
+                batch.type, len(batch.events))
+        for event in batch.events:
+            self.handle(event)
+        for event in batch.events:
+            self.bot.process_hooks(self, event)
+            self.bot.process_plugins(self, event)
+
+    def on_away(self, event):
+        # :nick!user@host AWAY :Gone to lunch, or without text when back
+        user = self.users.get(event.nick)
+        if user is not None:
+            user.away = event.text or None
+
+    def on_isupport(self, event):
+        # :irc.server 005 iobot CASEMAPPING=ascii PREFIX=(ov)@+ :are supported
+        changed = self.isupport.update(event.parameters)
+        self.logger.debug('RECIEVED ISUPPORT {changed: %s}',
+                ','.join(sorted(changed)))
+        if 'CASEMAPPING' in changed and self.isupport.casemapping:
+            self.state.set_casemapping(self.isupport.casemapping)
+        if 'PREFIX' in changed:
+            prefixes = self.isupport.prefixes
+            self.state.set_prefixes(DEFAULT_PREFIXES if prefixes is None
+                    else prefixes)
 
     def on_privmsg(self, event):
         # :nod!~nod@crunchy.bueno.land PRIVMSG #xx :hi
-        self.logger.debug('RECIEVED PRIVMSG {destination: %s,'
-                ' message: %s}' % (event.destination, event.text))
-        pass
+        if self.logger.isEnabledFor(DEBUG):
+            self.logger.debug('RECIEVED PRIVMSG {destination: %s,'
+                    ' message: %s}', event.destination, event.text)
 
     def on_nick(self, event):
+        # :old!user@host NICK :new, or NICK new
         old_nick = event.nick
-        new_nick = event.text
-        self.logger.debug('RECIEVED NICK {old_nick: %s, new_nick: %s}' %
-                (old_nick, new_nick))
-        if event.nick == self.nick:
+        new_nick = event.text or event.destination
+        self.logger.debug('RECIEVED NICK {old_nick: %s, new_nick: %s}',
+                old_nick, new_nick)
+        if not new_nick:
+            self.logger.warning('NICK WITHOUT A NICK {line: %s}', event.raw)
+            return
+        if self.is_me(old_nick):
             self.nick = new_nick
-        else:
-            self.user_change_nick(old_nick, new_nick)
+        self.user_change_nick(old_nick, new_nick)
 
     def on_join(self, event):
         channel = event.destination
         nick = event.nick
-        self.logger.debug('RECIEVED JOIN {channel: %s, nick: %s}' % (channel, nick))
-        if self.nick == nick:
+        self.logger.debug('RECIEVED JOIN {channel: %s, nick: %s}', channel, nick)
+        if self.is_me(nick):
+            if event.user and event.host:
+                self.userhost = '%s@%s' % (event.user, event.host)
             self.add_channel(channel)
-        else:
-            self.add_user(channel, IrcUser(nick))
+            self.state.begin_resync(channel)
+            # fill in everyone's user@host, unless NAMES already gives them
+            if 'userhost-in-names' not in self.caps:
+                self.write_raw('WHO %s' % channel)
+        self.state.join(channel, nick, event.user, event.host)
 
     def on_names(self, event):
-        nick_chan, nicks_raw = event.parameters_raw.split(':')
-        nicks = nicks_raw.split()
-        if '@' in nick_chan:
-            channel = nick_chan.split('@')[-1].strip()
-        elif '=' in nick_chan:
-            channel = nick_chan.split('=')[-1].strip()
-        else:
-            raise Exception
-        self.logger.debug('RECIEVED NAMES {channel: %s, nick_count: %d}' % (
-            channel, len(nicks)))
-        for nr in nicks:
-            if nr[0] == '@':
-                nick = nr[1:]
-            elif nr[0] == '+':
-                nick = nr[1:]
-            else:
-                nick = nr
-            user = IrcUser(nick)
-            self.add_user(channel, user)
+        # :irc.server 353 iobot = #channel :nick1 @nick2 +nick3
+        params = event.params
+        if len(params) < 3:
+            return
+        channel = params[-2]
+        nicks = params[-1].split()
+        self.logger.debug('RECIEVED NAMES {channel: %s, nick_count: %d}',
+                channel, len(nicks))
+        state = self.state
+        for entry in nicks:
+            modes, nick, user, host = state.split_names_entry(entry)
+            state.join(channel, nick, user, host, modes)
+
+    def on_end_of_names(self, event):
+        # :irc.server 366 iobot #channel :End of /NAMES list.
+        if event.parameters:
+            self.state.end_resync(event.parameters[0])
+
+    def on_cannot_join(self, event):
+        # :irc.server 474 iobot #channel :Cannot join channel (+b)
+        if event.parameters:
+            channel = event.parameters[0]
+            self.logger.warning('COULD NOT JOIN {channel: %s, reason: %s}',
+                    channel, event.text)
+            self.remove_channel(channel)
+
+    def on_who(self, event):
+        # :irc.server 352 iobot #channel user host server nick H :0 realname
+        params = event.parameters
+        if len(params) < 5:
+            return
+        user = self.users.get(params[4])
+        if user is not None:
+            user.update(params[1], params[2])
+            if len(params) > 5:
+                # H(ere) or G(one), the away message takes a WHOIS
+                if params[5][:1] == 'H':
+                    user.away = None
+                elif user.away is None:
+                    user.away = ''
+
+    def on_unknown_command(self, event):
+        # :irc.server 421 iobot CAP :Unknown command
+        params = event.params
+        if len(params) < 2 or params[1].upper() != 'CAP':
+            return
+        if self._cap_negotiating:
+            self._cap_negotiating = False
+            if self.password and self.sasl:
+                # likely too late for this registration, reconnects send
+                # PASS up front
+                self.logger.warning('SERVER LACKS CAP, SENDING PASS')
+                self.send_pass()
+                self.sasl = False
 
     def on_nochan(self, event):
         channel = event.parameters[0]
-        self.logger.debug('RECIEVED ERR_NOSUCHCHANNEL {channel: %s}' % channel)
+        self.logger.debug('RECIEVED ERR_NOSUCHCHANNEL {channel: %s}', channel)
         # :senor.crunchybueno.com 401 nodnc  #xx :No such nick/channel
         self.remove_channel(channel)
 
     def on_part(self, event):
         nick = event.nick
         channel = event.destination
-        self.logger.debug('RECIEVED PART {channel: %s, nick: %s}' % (channel,
-            nick))
-        if event.nick == self.nick:
-            self.logger.debug('IOBot parted from %s' % channel)
+        self.logger.debug('RECIEVED PART {channel: %s, nick: %s}', channel,
+                nick)
+        if self.is_me(nick):
+            self.logger.debug('IOBot parted from %s', channel)
             self.remove_channel(channel)
+        else:
+            self.state.part(channel, nick)
 
     def on_kick(self, event):
         nick = event.parameters[0]
         channel = event.destination
-        self.logger.debug('RECIEVED KICK {channel: %s, nick: %s}' % (channel,
-            nick))
-        if event.parameters[0] == self.nick:
-            self.logger.warning('IOBot was KICKed from %s' % channel)
+        self.logger.debug('RECIEVED KICK {channel: %s, nick: %s}', channel,
+                nick)
+        if self.is_me(nick):
+            self.logger.warning('IOBot was KICKed from %s', channel)
             self.remove_channel(channel)
+        else:
+            self.state.part(channel, nick)
+
+    def on_quit(self, event):
+        self.logger.debug('RECIEVED QUIT {nick: %s}', event.nick)
+        self.state.quit(event.nick)
+
+    def on_mode(self, event):
+        # :op!op@host MODE #channel +ov-v nick1 nick2 nick3
+        channel = event.destination
+        if channel not in self.channels:
+            return
+        args = event.params[1:]
+        if not args:
+            return
+        prefix_modes = set(mode for _, mode in self.state.prefixes)
+        lists, always, when_set = self.isupport.chanmodes[:3]
+        modes, args = args[0], args[1:]
+        add = True
+        for mode in modes:
+            if mode in '+-':
+                add = mode == '+'
+            elif mode in prefix_modes:
+                if args:
+                    self.state.set_mode(channel, args.pop(0), mode, add)
+            elif mode in lists or mode in always or (mode in when_set and
+                    add):
+                # list, key and limit modes carry an argument we don't track
+                if args:
+                    args.pop(0)
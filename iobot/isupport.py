@@ -0,0 +1,98 @@
+import re
+
+# longest line a server accepts, CRLF included, unless it says otherwise
+MAX_LINE_LENGTH = 512
+# targets per line for commands TARGMAX doesn't mention, None for no limit.
+# a server that says nothing gets one PRIVMSG target per line.
+DEFAULT_TARGMAX = {'PRIVMSG': 1, 'NOTICE': 1}
+# channel modes by argument: lists, always, only when set, never
+DEFAULT_CHANMODES = ('beI', 'k', 'l', 'imnpst')
+
+ESCAPE_PATTERN = re.compile(r'\\x([0-9A-Fa-f]{2})')
+PREFIX_PATTERN = re.compile(r'^\(([^)]*)\)(.*)$')
+
+def unescape_value(value):
+    """ ISUPPORT values escape spaces and the like as \\xHH """
+    if '\\x' not in value:
+        return value
+    return ESCAPE_PATTERN.sub(lambda m: chr(int(m.group(1), 16)), value)
+
+class ServerSupport(object):
+    """
+    what a server told us about itself in RPL_ISUPPORT (005), with the
+    defaults to use until it does.  tokens keeps every token as name ->
+    value, '' for tokens without one.
+    """
+    def __init__(self):
+        self.tokens = dict()
+
+    def __contains__(self, name):
+        return name in self.tokens
+
+    def get(self, name, default=None):
+        return self.tokens.get(name, default)
+
+    def update(self, params):
+        """
+        adds the tokens of one 005 reply, params being its parameters
+        after our nick, and returns the names that changed
+        """
+        changed = set()
+        for token in params:
+            if token[:1] == '-':
+                if self.tokens.pop(token[1:], None) is not None:
+                    changed.add(token[1:])
+                continue
+            name, _, value = token.partition('=')
+            value = unescape_value(value)
+            if self.tokens.get(name) != value:
+                self.tokens[name] = value
+                changed.add(name)
+        return changed
+
+    @property
+    def linelen(self):
+        try:
+            return int(self.tokens['LINELEN'])
+        except (KeyError, ValueError):
+            return MAX_LINE_LENGTH
+
+    @property
+    def casemapping(self):
+        return self.tokens.get('CASEMAPPING') or None
+
+    @property
+    def prefixes(self):
+        """ (symbol, mode) pairs highest rank first, None if not given """
+        value = self.tokens.get('PREFIX')
+        if value is None:
+            return None
+        m = PREFIX_PATTERN.match(value)
+        if m is None or len(m.group(1)) != len(m.group(2)):
+            return []
+        return zip(m.group(2), m.group(1))
+
+    @property
+    def chanmodes(self):
+        """ CHANMODES as its four groups, see DEFAULT_CHANMODES """
+        value = self.tokens.get('CHANMODES')
+        if value is None:
+            return DEFAULT_CHANMODES
+        groups = value.split(',')
+        return tuple((groups + [''] * 4)[:4])
+
+    def targmax(self, command):
+        """ most targets command takes in one line, None for no limit """
+        command = command.upper()
+        value = self.tokens.get('TARGMAX')
+        if value is not None:
+            for entry in value.split(','):
+                name, _, limit = entry.partition(':')
+                if name.upper() == command:
+                    return int(limit) if limit.isdigit() else None
+        if command in ('PRIVMSG', 'NOTICE'):
+            # the older MAXTARGETS only covers messages
+            limit = self.tokens.get('MAXTARGETS')
+            if limit and limit.isdigit():
+                return int(limit)
+        return DEFAULT_TARGMAX.get(command)
@@ -0,0 +1,198 @@
+import logging
+from bisect import bisect_left
+
+# seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+        1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram(object):
+    """
+    counts observations into fixed upper-bounded buckets, plus a running sum
+    and the most recent value
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the extra bucket catches everything above the last bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.last = None
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.last = value
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q):
+        """ upper bound of the bucket holding the q-th quantile """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def cumulative(self):
+        """ (upper bound, observations <= bound) pairs, ending with +inf """
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def summary(self):
+        if not self.count:
+            return 'no samples'
+        return 'last %.3fs mean %.3fs p50 <=%ss p99 <=%ss (%d samples)' % (
+                self.last, self.mean(), self.quantile(0.5),
+                self.quantile(0.99), self.count)
+
+class Counter(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class NullMetric(object):
+    """ stands in for every metric of a disabled registry """
+    __slots__ = ()
+    value = 0
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+NULL_METRIC = NullMetric()
+
+class MetricsRegistry(object):
+    """
+    named counters and histograms, each told apart by a set of labels.
+    metrics are looked up once and kept by whatever updates them, so
+    counting is an attribute increment.  a disabled registry hands out
+    NULL_METRIC and stores nothing.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        # name -> (kind, help)
+        self.families = dict()
+        # (name, sorted label items) -> metric
+        self.metrics = dict()
+
+    def _get(self, kind, name, help, labels, factory):
+        if not self.enabled:
+            return NULL_METRIC
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            self.families.setdefault(name, (kind, help))
+            metric = self.metrics[key] = factory()
+        return metric
+
+    def counter(self, name, help='', **labels):
+        return self._get('counter', name, help, labels, Counter)
+
+    def histogram(self, name, help='', buckets=LATENCY_BUCKETS, **labels):
+        return self._get('histogram', name, help, labels,
+                lambda: Histogram(buckets))
+
+    def register(self, name, metric, help='', **labels):
+        """
+        adds a metric made elsewhere, like a connection's lag, in place of
+        any already registered under the same name and labels
+        """
+        if self.enabled:
+            kind = 'histogram' if isinstance(metric, Histogram) else 'counter'
+            self.families.setdefault(name, (kind, help))
+            self.metrics[(name, tuple(sorted(labels.items())))] = metric
+        return metric
+
+    def collect(self):
+        """ (name, kind, help, [(labels, metric)]) sorted by name """
+        by_name = dict()
+        for (name, labels), metric in self.metrics.items():
+            by_name.setdefault(name, []).append((labels, metric))
+        return [(name,) + self.families[name] + (sorted(by_name[name]),)
+                for name in sorted(by_name)]
+
+NULL_REGISTRY = MetricsRegistry(enabled=False)
+
+def format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\',
+        '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels)
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+def prometheus_text(registry):
+    """ the registry in the prometheus text exposition format """
+    lines = []
+    for name, kind, help, series in registry.collect():
+        if help:
+            lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, metric in series:
+            if kind == 'counter':
+                lines.append('%s%s %s' % (name, format_labels(labels),
+                    metric.value))
+                continue
+            for bound, count in metric.cumulative():
+                lines.append('%s_bucket%s %d' % (name, format_labels(labels,
+                    [('le', format_bound(bound))]), count))
+            lines.append('%s_sum%s %r' % (name, format_labels(labels),
+                metric.sum))
+            lines.append('%s_count%s %d' % (name, format_labels(labels),
+                metric.count))
+    return '\n'.join(lines) + '\n'
+
+def summary_line(registry):
+    """ every counter and histogram on one line, for the log sink """
+    parts = []
+    for name, kind, help, series in registry.collect():
+        for labels, metric in series:
+            key = name + format_labels(labels)
+            if kind == 'counter':
+                parts.append('%s=%s' % (key, metric.value))
+            elif metric.count:
+                parts.append('%s=%d/%.4fs/p99<=%ss' % (key, metric.count,
+                    metric.mean(), metric.quantile(0.99)))
+    return ' '.join(parts)
+
+def serve_metrics(registry, port, address='127.0.0.1'):
+    """ serves /metrics in prometheus text format on the current IOLoop """
+    from tornado.web import Application, RequestHandler
+
+    class MetricsHandler(RequestHandler):
+        def get(self):
+            self.set_header('Content-Type',
+                    'text/plain; version=0.0.4; charset=utf-8')
+            self.write(prometheus_text(registry))
+
+    app = Application([(r'/metrics', MetricsHandler)])
+    return app.listen(port, address)
+
+def log_metrics(registry, interval, logger=None):
+    """ logs summary_line every interval seconds on the current IOLoop """
+    from tornado.ioloop import PeriodicCallback
+    logger = logger or logging.getLogger(__name__)
+    callback = PeriodicCallback(
+            lambda: logger.info('METRICS %s' % summary_line(registry)),
+            interval * 1000)
+    callback.start()
+    return callback
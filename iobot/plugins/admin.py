@@ -13,6 +13,7 @@ class AdminPlugin(object):
             conn.logger.error('Error loading %s: %s' % (admin_name, tb))
         else:
             conn.reply(event, 'Loaded %s' % admin_name)
+            conn.bot.broadcast('load_plugin', admin_name)
             conn.logger.info('%s loaded %s' % (event.nick, admin_name))
 
     @admin_command
@@ -25,6 +26,7 @@ class AdminPlugin(object):
             conn.logger.info('Error unloading %s: Plugin not loaded')
         else:
             conn.reply(event, 'Unloaded %s' % admin_name)
+            conn.bot.broadcast('unload_plugin', admin_name)
             conn.logger.info('%s unloaded %s' % (event.nick, admin_name))
 
     @admin_command
@@ -40,6 +42,7 @@ class AdminPlugin(object):
             conn.logger.error('Error reloading %s: %s' % (admin_name, tb))
         else:
             conn.reply(event, 'Reloaded %s' % admin_name)
+            conn.bot.broadcast('reload_plugin', admin_name)
             conn.logger.info('%s reloaded %s' % (event.nick, admin_name))
 
     @admin_command
@@ -57,4 +60,18 @@ class AdminPlugin(object):
         nick = event.command_params[0]
         conn.set_nick(nick)
 
+    @admin_command
+    def raw(self, conn, event):
+        # raw <server> <line>, the server may be run by another shard
+        server_name, _, line = event.command_params_raw.partition(' ')
+        try:
+            conn.bot.write_to(server_name, line)
+        except KeyError:
+            conn.reply_with_nick(event, 'No server %s' % server_name)
+
+    @admin_command
+    def lag(self, conn, event):
+        for server_name, lag in sorted(conn.bot.lag_histograms().items()):
+            conn.reply(event, '%s: %s' % (server_name, lag.summary()))
+
 Plugin = AdminPlugin
@@ -1,5 +1,7 @@
 from functools import update_wrapper
 
+from iobot.ratelimit import RateLimiter
+
 def plugin_command(f):
     """ marks an attribute for identifying a plugin method as a command """
     f.cmd = True
@@ -25,3 +27,44 @@ def admin_command(f):
         return f(self, conn, event)
     nf = update_wrapper(wrapper_func, f)
     return plugin_command(nf)
+
+def user_key(conn, event):
+    # user@host outlives nick changes, the nick is all a bare event has
+    if event.user and event.host:
+        return (conn.server_name, event.user, event.host)
+    return (conn.server_name, event.nick)
+
+def channel_key(conn, event):
+    # a private message is addressed to us, each sender gets their own
+    if not event.destination or conn.is_me(event.destination):
+        return user_key(conn, event)
+    return (conn.server_name, event.destination)
+
+def global_key(conn, event):
+    return None
+
+RATE_LIMIT_KEYS = {
+    'user': user_key,
+    'channel': channel_key,
+    'global': global_key,
+    }
+
+def rate_limited(rate, burst=1, per='user', penalty=0):
+    """
+    lets a plugin method run at most rate times a second, after an initial
+    burst, per user, channel or globally.  calls over the limit are dropped
+    and logged.  penalty seconds are added on each dropped call.
+    """
+    key = RATE_LIMIT_KEYS[per]
+    limiter = RateLimiter(rate, burst, penalty)
+    def decorator(f):
+        def wrapper_func(self, conn, event, *args, **kwargs):
+            if not limiter.allow(key(conn, event)):
+                conn.logger.warning('RATE LIMITED {nick: %s, method: %s}',
+                        event.nick, f.__name__)
+                return
+            return f(self, conn, event, *args, **kwargs)
+        nf = update_wrapper(wrapper_func, f)
+        nf.rate_limiter = limiter
+        return nf
+    return decorator
@@ -0,0 +1,22 @@
+"""
+what each bundled plugin registers, so the bot can route to a plugin before
+importing it.  commands are method names, hooks are event types.  a plugin
+missing from here is imported as soon as it is loaded.
+"""
+
+MANIFESTS = {
+    'admin': {
+        'commands': ['load', 'unload', 'reload', 'part', 'join', 'nick',
+            'raw', 'lag'],
+        'hooks': [],
+        },
+    'echo': {
+        'commands': ['echo'],
+        'hooks': [],
+        },
+    'markov_bot': {
+        'commands': ['silence', 'unsilence', 'dumb_markov', 'learn_markov',
+            'tokenizer', 'flush_brain', 'set_brain'],
+        'hooks': ['PRIVMSG'],
+        },
+    }
@@ -1,26 +1,34 @@
+import logging
 import re
-import nltk
 from datetime import timedelta
-from operator import itemgetter
-from random import sample, randint
-from markov import Markov
 from functools import partial
-from iobot.plugins.decorators import plugin_command, plugin_hook, admin_command
-QUERY_REGEX = r'^(?P<nick>{})[,:] (?P<message>.*)$'
-TIMEOUT = timedelta(seconds=5)
+from tornado import gen
+from iobot.plugins.decorators import (plugin_command, plugin_hook,
+        admin_command, rate_limited)
+from iobot.plugins.markov_brain import MarkovBrain
 
-class MarkovThrottle(object):
-    def __init__(self, user):
-        self.user = user
-        self.io_timeout = None
-        self.count = 1
+# imported on first use, it takes seconds
+nltk = None
+QUERY_REGEX = r'^(?P<nick>{})[,:] (?P<message>.*)$'
+# replies per user: a burst of three, then one every five seconds.  going
+# over that ignores them for a minute.
+REPLY_RATE = 0.2
+REPLY_BURST = 3
+REPLY_PENALTY = 60
+BRAIN_PATH = 'markov_brain.db'
+# learned lines are written at most this long after arriving, or as soon
+# as this many are waiting
+WRITE_INTERVAL = timedelta(seconds=10)
+WRITE_BATCH = 500
 
 class MarkovPlugin(object):
     def __init__(self):
-        self.markov = Markov(prefix='irc')
+        self.markov = MarkovBrain(BRAIN_PATH, prefix='irc')
+        self._write_timeout = None
         self.silent = False
         self.dumb = False
-        self.throttles = []
+        # tokenize with nltk when it is installed
+        self.high_fidelity = False
 
     @admin_command
     def silence(self, connection, event):
@@ -38,10 +46,37 @@ class MarkovPlugin(object):
     def learn_markov(self, connection, event):
         self.dumb = False
 
+    @admin_command
+    def tokenizer(self, connection, event):
+        # tokenizer fast|nltk
+        mode = event.command_params[0] if event.command_params else 'fast'
+        if mode == 'nltk' and not load_nltk():
+            connection.reply_with_nick(event, 'nltk is not installed')
+            return
+        self.high_fidelity = mode == 'nltk'
+
     @admin_command
     def flush_brain(self, connection, event):
         connection.logger.info('FLUSHING MARKOV BRAIN!!!')
-        self.markov.flush()
+        self.markov.drop_pending()
+        # the new namespace and dropping the old rows both write to sqlite,
+        # keep them off the IOLoop
+        bot = connection.bot
+        bot.ioloop.add_future(bot.submit(flush_brain, self.markov,
+            self.markov.prefix), partial(self.flushed, self.markov.prefix))
+
+    def flushed(self, prefix, future):
+        # a process pool flushed a copy of the brain, ours has to move on to
+        # the new namespace too
+        try:
+            ns, removed = future.result()
+        except Exception:
+            logging.getLogger(__name__).exception('Error flushing markov brain')
+            return
+        self.markov.use_namespace(prefix, ns)
+        logging.getLogger(__name__).info(
+                'MARKOV BRAIN FLUSHED {prefix: %s, removed: %d}', prefix,
+                removed)
 
     @admin_command
     def set_brain(self, connection, event):
@@ -49,109 +84,143 @@ class MarkovPlugin(object):
         connection.logger.info('SETTING MARKOV BRAIN {prefix: %s}' % prefix)
         self.markov.prefix = prefix
 
-    def is_ignored(self, user):
-        t = self.get_throttle(user)
-        return t and t.count > 3
-
     @plugin_hook
     def on_privmsg(self, connection, event):
-        user = connection.users[event.nick]
-        if self.is_ignored(user):
-            connection.logger.warning('IGNORED {nick: %s}' % event.nick)
-            self.do_throttle(connection.bot.ioloop, user, timedelta(minutes=1))
-            return
-
         m = re.match(QUERY_REGEX.format(connection.nick), event.text)
         if not self.silent and m:
-            tokens = tokenize_line(m.group('message'))
-            self.do_reply(connection, event, tokens)
-            ioloop = connection.bot.ioloop
-            self.do_throttle(ioloop, user)
+            return self.do_reply(connection, event, m.group('message'))
         elif not m and not self.dumb and not event.command:
             connection.logger.info('Learning {message: %s}' % event.text)
-            message = event.text
-            tokens = tokenize_line(message)
-            self.learn_message(tokens)
-
-    def do_reply(self, connection, event, tokens):
+            return self.learn_message(connection.bot, event.text)
+
+    @rate_limited(REPLY_RATE, REPLY_BURST, penalty=REPLY_PENALTY)
+    @gen.coroutine
+    def do_reply(self, connection, event, message):
+        # tokenizing and generating run on the bot's executor
+        bot = connection.bot
+        tokens = yield bot.submit(tokenize_line, message,
+                self.high_fidelity)
         connection.logger.info('Loading reply {tokens: %s}' % repr(tokens))
-        reply = load_reply_from_markov(self.markov, event.nick, tokens)
+        reply = yield bot.submit(load_reply_from_markov, self.markov,
+                event.nick, tokens)
         if reply:
             connection.reply_with_nick(event, reply)
         else:
             connection.reply_with_nick(event, ('I have nothing to'
                 ' say yet. Teach me more!'))
 
-    def do_throttle(self, ioloop, user, timeout=TIMEOUT):
-        throttle = self.get_throttle(user)
-        if throttle:
-            ioloop.remove_timeout(throttle.io_timeout)
-            throttle.count += 1
+    @gen.coroutine
+    def learn_message(self, bot, message):
+        tokens = yield bot.submit(tokenize_line, message,
+                self.high_fidelity)
+        self.markov.add_line_to_index(tokens)
+        if len(self.markov.pending) >= WRITE_BATCH:
+            self.write_brain(bot)
+        elif self._write_timeout is None:
+            self._write_timeout = bot.ioloop.add_timeout(WRITE_INTERVAL,
+                    partial(self.write_brain, bot))
+
+    def stop(self):
+        """
+        called when the bot stops or the plugin is unloaded, the IOLoop may
+        be gone so what is still buffered is written here
+        """
+        if self.markov.pending:
+            self.markov.write()
+
+    def write_brain(self, bot):
+        """ stores the buffered lines on the executor """
+        if self._write_timeout is not None:
+            bot.ioloop.remove_timeout(self._write_timeout)
+            self._write_timeout = None
+        lines = self.markov.take_pending()
+        if lines:
+            bot.ioloop.add_future(bot.submit(write_brain, self.markov, lines),
+                    log_write_error)
+
+word_pattern = re.compile(r'\w')
+# the splits nltk makes inside a run of non-space that leave two words, and
+# so survived gluing punctuation back on.  n't only splits before what the
+# treebank tokenizer would also have split off.
+NOT_PATTERN = re.compile(r"(?i)^(\W*\w+?)(n't[.,;:?!@#$%&)\]}>\"']*)$")
+CONTRACTION_PATTERN = re.compile(
+        r"(?i)^(\W*)(can|gim|gon|got|lem|wan)(not|me|na|ta)(\W*)$")
+CONTRACTIONS = frozenset(['cannot', 'gimme', 'gonna', 'gotta', 'lemme',
+    'wanna'])
+
+def tokenize_line(line, high_fidelity=False):
+    """
+    splits a line into words with punctuation kept on the word it touches.
+    high_fidelity uses nltk's tokenizer, when installed, to find where words
+    split, otherwise the splits it is known to make are done here.
+    """
+    if high_fidelity and load_nltk():
+        return nltk_tokenize_line(line)
+    tokens = []
+    for chunk in line.split():
+        if "'" in chunk:
+            m = NOT_PATTERN.match(chunk)
+            if m:
+                tokens.extend(m.groups())
+                continue
         else:
-            throttle = MarkovThrottle(user)
-            self.throttles.append(throttle)
-        rem_user_thrtl = partial(self.remove_throttle, user)
-        throttle.io_timeout = ioloop.add_timeout(timeout, rem_user_thrtl)
-
-    def remove_throttle(self, user):
-        for t in list(self.throttles):
-            if t.user is user:
-                self.throttles.remove(t)
-
-    def get_throttle(self, user):
-        for t in self.throttles:
-            if t.user is user:
-                return t
+            m = CONTRACTION_PATTERN.match(chunk)
+            if m and (m.group(2) + m.group(3)).lower() in CONTRACTIONS:
+                lead, first, second, trail = m.groups()
+                tokens.append(lead + first)
+                tokens.append(second + trail)
+                continue
+        tokens.append(chunk)
+    return tokens
+
+def load_nltk():
+    """ imports nltk if it is installed, returning whether it is """
+    global nltk
+    if nltk is None:
+        try:
+            import nltk
+        except ImportError:
+            return False
+    return True
+
+def nltk_tokenize_line(line):
+    """
+    nltk's tokens, with any that touch in the line joined back together
+    unless both are words
+    """
+    tokens = []
+    pos = 0
+    prev_word = False
+    for token in nltk.word_tokenize(line, preserve_line=True):
+        start = line.find(token, pos)
+        if start == -1 and token in ('``', "''"):
+            # nltk turns double quotes into these
+            token = '"'
+            start = line.find(token, pos)
+        word = word_pattern.match(token) is not None
+        if start == pos and tokens and not (word and prev_word):
+            tokens[-1] += token
         else:
-            return None
+            tokens.append(token)
+        if start != -1:
+            pos = start + len(token)
+        prev_word = word
+    return tokens
 
-    def learn_message(self, tokens):
-        self.markov.add_line_to_index(tokens)
+def write_brain(brain, lines):
+    return brain.write(lines)
 
-word_pattern = re.compile(r'\w+')
-def tokenize_line(line):
-    tokens = nltk.word_tokenize(line)
-    return untokenize_special_characters(tokens, line)
+def flush_brain(brain, prefix):
+    """ starts prefix over and purges the old rows, returning (ns, removed) """
+    return brain.new_namespace(prefix), brain.purge()
 
-def untokenize_special_characters(tokens, line):
-    repaired_tokens = []
-    pos = 0
-    while pos < len(tokens):
-        token = tokens[pos]
-        if (not word_pattern.match(token) and
-                not re.search(r'\s%s\s' % token, line)):
-            if re.search(r'\s%s' % token, line):
-                token = token + tokens[pos + 1]
-                repaired_tokens.append(token)
-                pos += 2
-            elif re.search(r'%s\s' % token, line):
-                prev_token = repaired_tokens[-1]
-                repaired_tokens[-1] = prev_token + token
-                pos += 1
-            else:
-                prev_token = repaired_tokens[-1]
-                repaired_tokens[-1] = prev_token + token
-                if len(tokens) > pos + 1:
-                    required_tokens[-1] += tokens[pos + 1]
-                pos += 2
-        else:
-            repaired_tokens.append(token)
-            pos += 1
-    return repaired_tokens
+def log_write_error(future):
+    try:
+        future.result()
+    except Exception:
+        logging.getLogger(__name__).exception('Error writing markov brain')
 
 def load_reply_from_markov(markov, nick, tokens):
-    tokens.append(nick)
-    replies = dict()
-    for i in range(100):
-        num_rel_terms = randint(0, len(tokens))
-        if num_rel_terms != 0:
-            rel_terms = sample(tokens, num_rel_terms)
-            possible_reply = markov.generate(relevant_terms=rel_terms)
-        else:
-            possible_reply = markov.generate()
-        score = markov.score_for_line(possible_reply)
-        replies[tuple(possible_reply)] = score
-    reply = max(replies.iteritems(), key=itemgetter(1))[0]
-    return ' '.join(reply)
+    return ' '.join(markov.reply(tokens + [nick]))
 
 Plugin = MarkovPlugin
@@ -0,0 +1,342 @@
+import sqlite3
+import threading
+from collections import Counter
+from math import log
+from random import randint, random, randrange, sample, shuffle
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# marks the start and end of a line in the chain
+STOP = ''
+# longest reply generate will build
+MAX_WORDS = 30
+# reply candidates are generated and scored this many at a time, up to
+# REPLY_CANDIDATES, stopping early once one scores REPLY_THRESHOLD
+REPLY_CANDIDATES = 100
+REPLY_BATCH = 20
+REPLY_THRESHOLD = 2.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS namespaces (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS namespaces_name ON namespaces (name, id);
+CREATE TABLE IF NOT EXISTS chain (
+    ns INTEGER NOT NULL,
+    w1 TEXT NOT NULL,
+    w2 TEXT NOT NULL,
+    w3 TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (ns, w1, w2, w3)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS chain_back ON chain (ns, w2, w3);
+"""
+
+UPSERT = """
+INSERT INTO chain (ns, w1, w2, w3, count) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (ns, w1, w2, w3) DO UPDATE SET count = count + excluded.count
+"""
+
+def trigrams(tokens):
+    words = [STOP, STOP] + list(tokens) + [STOP]
+    return zip(words, words[1:], words[2:])
+
+def weighted_choice(rows):
+    """ rows of (word, count) """
+    total = sum(count for _, count in rows)
+    pick = random() * total
+    for word, count in rows:
+        pick -= count
+        if pick < 0:
+            return word
+    return rows[-1][0]
+
+class MarkovBrain(object):
+    """
+    a second order markov chain kept in SQLite, a drop in for the
+    markov.Markov the plugin used to use.  trigrams are counted per
+    namespace: prefix names the brain in use and flush starts it over under
+    a fresh namespace id, so neither touches existing rows.
+
+    add_line_to_index only buffers, write() stores everything buffered in
+    one transaction.  the database is in WAL mode and every thread opens its
+    own connection, so generating replies on the executor doesn't wait on a
+    write in progress.  pickling keeps just the path and prefix, for process
+    pools.
+    """
+    def __init__(self, path, prefix='irc'):
+        self.path = path
+        self.prefix = prefix
+        self.pending = []
+        self._local = threading.local()
+        self._namespaces = dict()
+        self.db.executescript(SCHEMA)
+
+    def __getstate__(self):
+        return {'path': self.path, 'prefix': self.prefix}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['prefix'])
+
+    @property
+    def db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def namespace(self, prefix=None):
+        """ the current namespace id for a brain, created on first use """
+        prefix = prefix or self.prefix
+        ns = self._namespaces.get(prefix)
+        if ns is None:
+            db = self.db
+            with db:
+                # take the write lock before looking, so two threads or
+                # worker processes can't both create the first namespace
+                db.execute('BEGIN IMMEDIATE')
+                row = db.execute('SELECT max(id) FROM namespaces'
+                        ' WHERE name = ?', (prefix,)).fetchone()
+                ns = row[0]
+                if ns is None:
+                    ns = db.execute('INSERT INTO namespaces (name) VALUES (?)',
+                            (prefix,)).lastrowid
+            self._namespaces[prefix] = ns
+        return ns
+
+    def add_line_to_index(self, tokens):
+        if tokens:
+            self.pending.append((self.prefix, tuple(tokens)))
+
+    def take_pending(self):
+        """ hands over the buffered lines, to be passed to write """
+        pending, self.pending = self.pending, []
+        return pending
+
+    def write(self, lines=None):
+        """
+        stores lines of (prefix, tokens), by default whatever is buffered,
+        and returns how many were written
+        """
+        if lines is None:
+            lines = self.take_pending()
+        if not lines:
+            return 0
+        counts = Counter()
+        for prefix, tokens in lines:
+            ns = self.namespace(prefix)
+            for trigram in trigrams(tokens):
+                counts[(ns,) + trigram] += 1
+        with self.db as db:
+            db.executemany(UPSERT,
+                    (key + (count,) for key, count in counts.iteritems()))
+        return len(lines)
+
+    def flush(self):
+        """ forgets everything the current brain learned """
+        self.drop_pending()
+        self.new_namespace()
+
+    def drop_pending(self, prefix=None):
+        """ forgets the buffered lines of a brain """
+        prefix = prefix or self.prefix
+        self.pending = [(p, t) for p, t in self.pending if p != prefix]
+
+    def new_namespace(self, prefix=None):
+        """
+        starts a brain over under a fresh namespace id, without touching
+        what is buffered
+        """
+        prefix = prefix or self.prefix
+        with self.db as db:
+            ns = db.execute('INSERT INTO namespaces (name) VALUES (?)',
+                    (prefix,)).lastrowid
+        self._namespaces[prefix] = ns
+        return ns
+
+    def use_namespace(self, prefix, ns):
+        """ switches to a namespace new_namespace made in another process """
+        self._namespaces[prefix] = ns
+
+    def purge(self):
+        """ deletes the rows of flushed namespaces, returns rows removed """
+        with self.db as db:
+            stale = """SELECT id FROM namespaces WHERE id NOT IN
+                (SELECT max(id) FROM namespaces GROUP BY name)"""
+            removed = db.execute('DELETE FROM chain WHERE ns IN (%s)' % stale
+                    ).rowcount
+            db.execute('DELETE FROM namespaces WHERE id IN (%s)' % stale)
+        return removed
+
+    # the lookups below take an optional cache dict, shared by every
+    # candidate of one reply so each chain state is only read once
+
+    def _next_words(self, ns, w1, w2, cache=None):
+        key = ('>', w1, w2)
+        rows = cache.get(key) if cache is not None else None
+        if rows is None:
+            rows = self.db.execute('SELECT w3, count FROM chain'
+                    ' WHERE ns = ? AND w1 = ? AND w2 = ?',
+                    (ns, w1, w2)).fetchall()
+            if cache is not None:
+                cache[key] = rows
+        return rows
+
+    def _prev_words(self, ns, w2, w3, cache=None):
+        key = ('<', w2, w3)
+        rows = cache.get(key) if cache is not None else None
+        if rows is None:
+            # without ANALYZE stats sqlite would rather scan the whole
+            # namespace through the primary key
+            rows = self.db.execute('SELECT w1, count FROM chain'
+                    ' INDEXED BY chain_back WHERE ns = ? AND w2 = ? AND w3 = ?',
+                    (ns, w2, w3)).fetchall()
+            if cache is not None:
+                cache[key] = rows
+        return rows
+
+    def _seed(self, ns, term, cache=None):
+        """ a random trigram with term in the middle, or None """
+        db = self.db
+        key = ('=', term)
+        n = cache.get(key) if cache is not None else None
+        if n is None:
+            n = db.execute('SELECT count(*) FROM chain WHERE ns = ? AND w2 = ?',
+                    (ns, term)).fetchone()[0]
+            if cache is not None:
+                cache[key] = n
+        if not n:
+            return None
+        return db.execute('SELECT w1, w2, w3 FROM chain WHERE ns = ? AND w2 = ?'
+                ' LIMIT 1 OFFSET ?', (ns, term, randrange(n))).fetchone()
+
+    def generate(self, relevant_terms=None, cache=None):
+        """
+        a list of words, built outwards from one of relevant_terms when any
+        of them is known, otherwise from the start of a line
+        """
+        ns = self.namespace()
+        seed = None
+        if relevant_terms:
+            terms = list(relevant_terms)
+            shuffle(terms)
+            for term in terms:
+                seed = self._seed(ns, term, cache)
+                if seed is not None:
+                    break
+        if seed is None:
+            rows = self._next_words(ns, STOP, STOP, cache)
+            if not rows:
+                return []
+            seed = (STOP, STOP, weighted_choice(rows))
+        words = [w for w in seed if w != STOP]
+        # backwards to the start of a line
+        w1, w2 = seed[0], seed[1]
+        while w1 != STOP and len(words) < MAX_WORDS:
+            rows = self._prev_words(ns, w1, w2, cache)
+            if not rows:
+                break
+            w1, w2 = weighted_choice(rows), w1
+            if w1 != STOP:
+                words.insert(0, w1)
+        # then forwards to the end of one
+        w2, w3 = seed[1], seed[2]
+        while w3 != STOP and len(words) < MAX_WORDS:
+            rows = self._next_words(ns, w2, w3, cache)
+            if not rows:
+                break
+            w2, w3 = w3, weighted_choice(rows)
+            if w3 != STOP:
+                words.append(w3)
+        return words
+
+    def score_for_line(self, line):
+        """
+        mean surprisal of the line's trigrams, higher for lines that take
+        less likely turns
+        """
+        return self.score_lines([line])[0]
+
+    def score_lines(self, lines, cache=None):
+        """ score_for_line for many lines at once """
+        ns = self.namespace()
+        # every trigram of every line as (count, total) for its state
+        states = dict()
+        counts = []
+        totals = []
+        lengths = []
+        for line in lines:
+            grams = trigrams(line) if line else ()
+            lengths.append(len(grams))
+            for w1, w2, w3 in grams:
+                state = states.get((w1, w2))
+                if state is None:
+                    state = dict(self._next_words(ns, w1, w2, cache))
+                    state = states[(w1, w2)] = (state, sum(state.itervalues()))
+                following, total = state
+                # unseen turns score nothing, as if certain
+                counts.append(following.get(w3) or total or 1)
+                totals.append(total or 1)
+        if numpy is not None:
+            return self._mean_surprisal_numpy(counts, totals, lengths)
+        scores = []
+        i = 0
+        for length in lengths:
+            end = i + length
+            total = -sum(log(float(c) / t)
+                    for c, t in zip(counts[i:end], totals[i:end]))
+            scores.append(total / length if length else 0.0)
+            i = end
+        return scores
+
+    def _mean_surprisal_numpy(self, counts, totals, lengths):
+        lengths = numpy.array(lengths, dtype=float)
+        if not counts:
+            return [0.0] * len(lengths)
+        surprisal = -numpy.log(numpy.array(counts, dtype=float) /
+                numpy.array(totals, dtype=float))
+        # sum each line's run of trigrams, empty lines are skipped over
+        starts = numpy.concatenate(([0], numpy.cumsum(lengths)[:-1]))
+        nonempty = lengths > 0
+        sums = numpy.zeros(len(lengths))
+        sums[nonempty] = numpy.add.reduceat(surprisal,
+                starts[nonempty].astype(int))
+        return list(numpy.where(nonempty, sums / numpy.maximum(lengths, 1),
+            0.0))
+
+    def reply(self, terms, candidates=REPLY_CANDIDATES, batch=REPLY_BATCH,
+            threshold=REPLY_THRESHOLD):
+        """
+        the best scoring of up to candidates generated lines, each built
+        from a random subset of terms.  candidates share one lookup cache
+        and are scored a batch at a time, returning as soon as one reaches
+        threshold.
+        """
+        terms = list(terms)
+        cache = dict()
+        seen = set()
+        best, best_score = [], None
+        made = 0
+        while made < candidates:
+            lines = []
+            for _ in range(min(batch, candidates - made)):
+                made += 1
+                n = randint(0, len(terms))
+                line = tuple(self.generate(sample(terms, n) if n else None,
+                    cache))
+                if line not in seen:
+                    seen.add(line)
+                    lines.append(line)
+            for line, score in zip(lines, self.score_lines(lines, cache)):
+                if best_score is None or score > best_score:
+                    best, best_score = line, score
+            if best_score is not None and best_score >= threshold:
+                break
+        return list(best)
@@ -0,0 +1,54 @@
+import time
+
+# seconds between sweeps of keys whose buckets have filled back up
+SWEEP_INTERVAL = 60
+
+class RateLimiter(object):
+    """
+    a token bucket per key, kept as [tokens, updated] in one dict so a check
+    is a dict lookup and some arithmetic.  keys that have refilled are
+    dropped by a sweep that runs from allow at most every sweep_interval
+    seconds, rather than a timeout per key.
+
+    with a penalty set, a refused key is next allowed penalty seconds later,
+    and every refusal restarts that.
+    """
+    def __init__(self, rate, burst=1, penalty=0, clock=time.time,
+            sweep_interval=SWEEP_INTERVAL):
+        self.rate = float(rate)
+        self.burst = burst
+        self.penalty = penalty
+        self.clock = clock
+        self.sweep_interval = sweep_interval
+        self.buckets = dict()
+        self._last_sweep = clock()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def allow(self, key):
+        now = self.clock()
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep(now)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            self.buckets[key] = [self.burst - 1, now]
+            return True
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return True
+        bucket[0] = 1 - self.penalty * self.rate if self.penalty else tokens
+        return False
+
+    def sweep(self, now=None):
+        """ forgets keys whose bucket would be full again by now """
+        if now is None:
+            now = self.clock()
+        self._last_sweep = now
+        burst, rate = self.burst, self.rate
+        full = [key for key, (tokens, updated) in self.buckets.iteritems()
+                if tokens + (now - updated) * rate >= burst]
+        for key in full:
+            del self.buckets[key]
@@ -0,0 +1,104 @@
+import time
+from collections import deque
+
+EOL = '\r\n'
+
+# lanes, drained in this order
+PRIORITY, PROTOCOL, MESSAGE = range(3)
+
+# lines that keep the link alive or registered jump every queue
+PRIORITY_COMMANDS = frozenset(['PONG', 'PING', 'PASS', 'NICK', 'USER',
+    'CAP', 'AUTHENTICATE', 'QUIT'])
+MESSAGE_COMMANDS = frozenset(['PRIVMSG', 'NOTICE'])
+
+# roughly what ircds tolerate before excess flood: a short burst, then a
+# line every couple of seconds
+FLOOD_BURST = 5
+FLOOD_RATE = 0.5
+
+def lane_for(line):
+    command = line.split(' ', 1)[0].upper()
+    if command in PRIORITY_COMMANDS:
+        return PRIORITY
+    if command in MESSAGE_COMMANDS:
+        return MESSAGE
+    return PROTOCOL
+
+class TokenBucket(object):
+    """ allows burst lines at once, refilling at rate lines per second """
+    def __init__(self, rate, burst, clock=time.time):
+        self.rate = float(rate)
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst,
+                self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self):
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self):
+        """ seconds until the next token is available """
+        self.refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+class SendQueue(object):
+    """
+    outbound lines for one connection, as bytes without their line ending.
+    everything queued during an IOLoop
+    iteration goes out in a single write, as far as the token bucket allows,
+    with PONG and registration lines ahead of other protocol lines and
+    PRIVMSG/NOTICE last.  a rate of 0 turns flood control off.
+    """
+    def __init__(self, ioloop, write, rate=FLOOD_RATE, burst=FLOOD_BURST):
+        self.ioloop = ioloop
+        self.write = write
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.lanes = (deque(), deque(), deque())
+        self._flush_pending = False
+        self._timeout = None
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes)
+
+    def push(self, line, lane=None):
+        if lane is None:
+            lane = lane_for(line)
+        self.lanes[lane].append(line)
+        if not self._flush_pending and self._timeout is None:
+            self._flush_pending = True
+            self.ioloop.add_callback(self.flush)
+
+    def flush(self):
+        self._flush_pending = False
+        self._timeout = None
+        bucket = self.bucket
+        out = []
+        for lane in self.lanes:
+            while lane and (bucket is None or bucket.consume()):
+                out.append(lane.popleft())
+            if lane:
+                break
+        if out:
+            # the empty line ends the last one, the join is the only copy
+            out.append('')
+            self.write(EOL.join(out))
+        if len(self):
+            self._timeout = self.ioloop.add_timeout(
+                    self.ioloop.time() + bucket.delay(), self.flush)
+
+    def clear(self):
+        for lane in self.lanes:
+            lane.clear()
+        if self._timeout is not None:
+            self.ioloop.remove_timeout(self._timeout)
+            self._timeout = None
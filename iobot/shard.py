@@ -0,0 +1,206 @@
+import logging
+import signal
+from multiprocessing import Pipe, Process
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+# bot methods a shard will run on behalf of another
+SHARD_METHODS = frozenset(['load_plugin', 'unload_plugin', 'reload_plugin',
+    'write_to', 'apply_config'])
+
+# seconds between checks that every worker is still running
+WATCH_INTERVAL = 5
+
+logger = logging.getLogger(__name__)
+
+class ShardError(Exception):
+    pass
+
+def shard_servers(servers, shards):
+    """
+    splits the servers config into at most shards dicts.  servers sharing a
+    network stay together so they still share one UserRegistry, the biggest
+    groups are placed first onto whichever shard has the fewest servers.
+    """
+    groups = dict()
+    for server_name, config in servers.items():
+        network = config.get('network', server_name)
+        groups.setdefault(network, []).append(server_name)
+    buckets = [dict() for _ in range(min(shards, len(groups)))]
+    for network, names in sorted(groups.items(),
+            key=lambda item: (-len(item[1]), item[0])):
+        bucket = min(buckets, key=len)
+        for server_name in names:
+            bucket[server_name] = servers[server_name]
+    return buckets
+
+class ShardLink(object):
+    """
+    a worker's end of the pipe to the Supervisor.  messages from the
+    supervisor are (method, args) calls on the bot, limited to SHARD_METHODS.
+    """
+    def __init__(self, bot, pipe, ioloop=None):
+        self.bot = bot
+        self.pipe = pipe
+        self.ioloop = ioloop or IOLoop.current()
+        bot.shard = self
+        self.ioloop.add_handler(pipe.fileno(), self._on_readable,
+                IOLoop.READ | IOLoop.ERROR)
+
+    def _on_readable(self, fd, events):
+        try:
+            while self.pipe.poll():
+                self.handle_message(self.pipe.recv())
+        except EOFError:
+            # the supervisor went away, so do we
+            self.ioloop.remove_handler(fd)
+            self.ioloop.stop()
+
+    def handle_message(self, message):
+        method, args = message
+        if method not in SHARD_METHODS:
+            logger.error('SHARD REFUSED {method: %s}' % method)
+            return
+        try:
+            getattr(self.bot, method)(*args)
+        except Exception:
+            logger.exception('SHARD CALL FAILED {method: %s}' % method)
+
+    def broadcast(self, method, args):
+        """ run a bot method on every other shard """
+        self.pipe.send(('broadcast', None, method, args))
+
+    def route(self, server_name, method, args):
+        """ run a bot method on the shard holding server_name """
+        self.pipe.send(('route', server_name, method, args))
+
+def run_shard(pipe, build_bot, servers, index=0):
+    # a fresh loop, nothing registered on the parent's may leak in here
+    ioloop = IOLoop()
+    ioloop.make_current()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # config reloads come from the supervisor
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    bot = build_bot(servers, shard_index=index)
+    ShardLink(bot, pipe, ioloop)
+    bot.start()
+
+class Supervisor(object):
+    """
+    runs each group of servers from shard_servers in its own worker process
+    with its own IOLoop and IOBot, relays broadcast and routed calls between
+    them, and restarts any worker that dies.
+
+    build_bot(servers, shard_index=index) is called in the worker to make its
+    IOBot.
+    """
+    def __init__(self, servers, shards, build_bot):
+        self.build_bot = build_bot
+        self.groups = shard_servers(servers, shards)
+        self._index_owners()
+        self.workers = [None] * len(self.groups)
+        self.pipes = [None] * len(self.groups)
+        self.ioloop = None
+
+    def _index_owners(self):
+        self.owners = dict((server_name, i)
+                for i, group in enumerate(self.groups)
+                for server_name in group)
+
+    def reload(self, servers):
+        """
+        hands every worker its part of a new servers config.  servers keep
+        their shard, new ones join a shard already on their network or
+        else the one with the fewest servers.
+        """
+        groups = [dict((name, servers[name]) for name in group
+            if name in servers) for group in self.groups]
+        networks = dict((servers[name].get('network', name), index)
+                for index, group in enumerate(groups) for name in group)
+        for server_name in sorted(set(servers) - set(self.owners)):
+            network = servers[server_name].get('network', server_name)
+            index = networks.get(network)
+            if index is None:
+                index = min(range(len(groups)), key=lambda i: len(groups[i]))
+                networks[network] = index
+            groups[index][server_name] = servers[server_name]
+        self.groups = groups
+        self._index_owners()
+        for index, pipe in enumerate(self.pipes):
+            if pipe is not None:
+                pipe.send(('apply_config', (groups[index],)))
+
+    def spawn(self, index):
+        pipe, child_pipe = Pipe()
+        worker = Process(target=run_shard,
+                args=(child_pipe, self.build_bot, self.groups[index], index),
+                name='iobot-shard-%d' % index)
+        worker.daemon = True
+        worker.start()
+        child_pipe.close()
+        self.workers[index] = worker
+        self.pipes[index] = pipe
+        if self.ioloop is not None:
+            self._listen(index)
+        logger.info('SHARD STARTED {index: %d, pid: %d, servers: %s}' % (
+            index, worker.pid, ','.join(sorted(self.groups[index]))))
+
+    def _listen(self, index):
+        self.ioloop.add_handler(self.pipes[index].fileno(),
+                lambda fd, events: self._on_readable(index, fd),
+                IOLoop.READ | IOLoop.ERROR)
+
+    def _on_readable(self, index, fd):
+        pipe = self.pipes[index]
+        try:
+            while pipe.poll():
+                self.handle_message(index, pipe.recv())
+        except EOFError:
+            self.ioloop.remove_handler(fd)
+            pipe.close()
+            self.pipes[index] = None
+
+    def handle_message(self, index, message):
+        kind, server_name, method, args = message
+        if kind == 'broadcast':
+            targets = [i for i in range(len(self.pipes)) if i != index]
+        elif kind == 'route':
+            owner = self.owners.get(server_name)
+            if owner is None:
+                logger.error('SHARD NO SERVER {server: %s}' % server_name)
+                return
+            targets = [owner]
+        else:
+            raise ShardError('Unknown message %r' % kind)
+        for i in targets:
+            if self.pipes[i] is not None:
+                self.pipes[i].send((method, args))
+
+    def watch(self):
+        for index, worker in enumerate(self.workers):
+            if not worker.is_alive():
+                logger.warning('SHARD DIED {index: %d, exitcode: %s}' % (
+                    index, worker.exitcode))
+                if self.pipes[index] is not None:
+                    self.ioloop.remove_handler(self.pipes[index].fileno())
+                    self.pipes[index].close()
+                self.spawn(index)
+
+    def start(self):
+        # fork before the supervisor has an IOLoop of its own
+        for index in range(len(self.groups)):
+            self.spawn(index)
+        self.ioloop = IOLoop.current()
+        for index in range(len(self.pipes)):
+            self._listen(index)
+        PeriodicCallback(self.watch, WATCH_INTERVAL * 1000,
+                io_loop=self.ioloop).start()
+        try:
+            self.ioloop.start()
+        finally:
+            self.stop()
+
+    def stop(self):
+        for worker in self.workers:
+            if worker is not None and worker.is_alive():
+                worker.terminate()
@@ -0,0 +1,279 @@
+import string
+from weakref import WeakValueDictionary
+
+from iobot.user import IrcUser, intern_str
+
+CASEMAPPINGS = {
+    'ascii': string.maketrans(string.ascii_uppercase,
+        string.ascii_lowercase),
+    'rfc1459': string.maketrans(string.ascii_uppercase + '[]\\~',
+        string.ascii_lowercase + '{}|^'),
+    'strict-rfc1459': string.maketrans(string.ascii_uppercase + '[]\\',
+        string.ascii_lowercase + '{}|'),
+    }
+
+# NAMES prefix -> channel mode, until the server tells us otherwise
+DEFAULT_PREFIXES = (('~', 'q'), ('&', 'a'), ('@', 'o'), ('%', 'h'),
+        ('+', 'v'))
+
+class CaseMappedDict(dict):
+    """ a dict whose string keys compare under an irc casemapping """
+    def __init__(self, casemapping='rfc1459', items=()):
+        dict.__init__(self)
+        self.table = CASEMAPPINGS[casemapping]
+        for key, value in items:
+            self[key] = value
+
+    def fold(self, key):
+        return key.translate(self.table)
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self, key.translate(self.table))
+
+    def __setitem__(self, key, value):
+        # the same nick is a key in many channels, share one folded copy
+        dict.__setitem__(self, intern_str(key.translate(self.table)), value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key.translate(self.table))
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key.translate(self.table))
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        return dict.get(self, key.translate(self.table), default)
+
+    def pop(self, key, *default):
+        return dict.pop(self, key.translate(self.table), *default)
+
+    def setdefault(self, key, default=None):
+        return dict.setdefault(self, key.translate(self.table), default)
+
+class UserRegistry(object):
+    """
+    hands out one IrcUser per nick for a whole network, so a person in many
+    channels, or seen by several connections to the same network, is a
+    single object.  entries go away once no channel holds the user.
+    """
+    def __init__(self, casemapping='rfc1459'):
+        self.table = CASEMAPPINGS[casemapping]
+        self._users = WeakValueDictionary()
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, nick):
+        return nick.translate(self.table) in self._users
+
+    def get(self, nick, user=None, host=None):
+        key = nick.translate(self.table)
+        ircuser = self._users.get(key)
+        if ircuser is None:
+            ircuser = IrcUser(nick, user, host)
+            self._users[intern_str(key)] = ircuser
+        else:
+            ircuser.update(user, host)
+        return ircuser
+
+    def rename(self, ircuser, new_nick):
+        if not new_nick:
+            raise ValueError('Cannot rename %s to an empty nick' % ircuser.nick)
+        old_key = ircuser.nick.translate(self.table)
+        if self._users.get(old_key) is ircuser:
+            del self._users[old_key]
+        ircuser.nick = intern_str(new_nick)
+        self._users[intern_str(new_nick.translate(self.table))] = ircuser
+
+    def set_casemapping(self, casemapping):
+        users = self._users.values()
+        self.table = CASEMAPPINGS[casemapping]
+        self._users = WeakValueDictionary(
+                (u.nick.translate(self.table), u) for u in users)
+
+class Channel(object):
+    __slots__ = ('name', 'members', 'stale')
+
+    def __init__(self, name, casemapping='rfc1459'):
+        self.name = name
+        # members not yet confirmed by NAMES since we (re)joined
+        self.stale = None
+        # nick -> prefix modes held in this channel as a string ('', 'o',
+        # 'ov'), strings rather than sets since most members have none
+        self.members = CaseMappedDict(casemapping)
+
+    def __repr__(self):
+        return '<Channel %s (%d)>' % (self.name, len(self.members))
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, nick):
+        return nick in self.members
+
+    def modes(self, nick):
+        return self.members[nick]
+
+class IrcState(object):
+    """
+    channel membership for one connection, indexed both ways: channel ->
+    members with their prefix modes and nick -> channels, with every key
+    compared under the server's CASEMAPPING.  joins, parts, quits and nick
+    changes are all O(1) per membership touched.
+    """
+    def __init__(self, casemapping='rfc1459', registry=None):
+        self.casemapping = casemapping
+        if registry is None:
+            registry = UserRegistry(casemapping)
+        self.registry = registry
+        self.set_prefixes(DEFAULT_PREFIXES)
+        self.channels = CaseMappedDict(casemapping)
+        self.users = CaseMappedDict(casemapping)
+        self.user_channels = CaseMappedDict(casemapping)
+
+    def set_casemapping(self, casemapping):
+        if casemapping == self.casemapping or casemapping not in CASEMAPPINGS:
+            return
+        # keys only hold the folded form, so rebuild from the real names
+        users = self.users
+        user_channels = dict((users[key].nick, [self.channels[c].name
+            for c in keys]) for key, keys in self.user_channels.items())
+        for channel in self.channels.values():
+            channel.members = CaseMappedDict(casemapping,
+                    [(users[key].nick, modes)
+                        for key, modes in channel.members.items()])
+        self.casemapping = casemapping
+        if self.registry.table is not CASEMAPPINGS[casemapping]:
+            self.registry.set_casemapping(casemapping)
+        self.channels = CaseMappedDict(casemapping,
+                [(c.name, c) for c in self.channels.values()])
+        self.users = CaseMappedDict(casemapping,
+                [(u.nick, u) for u in users.values()])
+        fold = self.channels.fold
+        self.user_channels = CaseMappedDict(casemapping,
+                [(nick, set(fold(name) for name in names))
+                    for nick, names in user_channels.items()])
+
+    def set_prefixes(self, prefixes):
+        """ prefixes: (symbol, mode) pairs, highest rank first """
+        self.prefixes = tuple(prefixes)
+        self._prefix_modes = dict(self.prefixes)
+
+    def add_channel(self, name):
+        channel = self.channels.get(name)
+        if channel is None:
+            channel = Channel(name, self.casemapping)
+            self.channels[name] = channel
+        return channel
+
+    def remove_channel(self, name):
+        channel = self.channels.pop(name, None)
+        if channel is None:
+            return
+        key = self.channels.fold(name)
+        for nick in channel.members:
+            self._forget_membership(nick, key)
+
+    def get_user(self, nick, user=None, host=None):
+        ircuser = self.users.get(nick)
+        if ircuser is None:
+            ircuser = self.registry.get(nick, user, host)
+            self.users[nick] = ircuser
+            self.user_channels[nick] = set()
+        else:
+            ircuser.update(user, host)
+        return ircuser
+
+    def join(self, channel_name, nick, user=None, host=None, modes=()):
+        channel = self.channels.get(channel_name)
+        if channel is None:
+            return None
+        ircuser = self.get_user(nick, user, host)
+        channel.members[nick] = intern_str(''.join(modes))
+        if channel.stale:
+            channel.stale.discard(channel.members.fold(nick))
+        self.user_channels[nick].add(self.channels.fold(channel_name))
+        return ircuser
+
+    def begin_resync(self, channel_name):
+        """
+        called when we (re)join a channel we may already hold state for.
+        everyone the following NAMES replies list is kept, anyone else is
+        dropped by end_resync.
+        """
+        channel = self.channels.get(channel_name)
+        if channel is not None:
+            channel.stale = set(channel.members)
+
+    def end_resync(self, channel_name):
+        channel = self.channels.get(channel_name)
+        if channel is None or channel.stale is None:
+            return
+        stale, channel.stale = channel.stale, None
+        for nick in stale:
+            self.part(channel_name, nick)
+
+    def part(self, channel_name, nick):
+        channel = self.channels.get(channel_name)
+        if channel is None or channel.members.pop(nick, None) is None:
+            return
+        self._forget_membership(nick, self.channels.fold(channel_name))
+
+    def quit(self, nick):
+        for key in self.user_channels.pop(nick, ()):
+            self.channels[key].members.pop(nick, None)
+        self.users.pop(nick, None)
+
+    def change_nick(self, old_nick, new_nick):
+        if not new_nick:
+            return
+        ircuser = self.users.pop(old_nick, None)
+        if ircuser is None:
+            return
+        # another connection to the network may have renamed it already
+        if ircuser.nick != new_nick:
+            self.registry.rename(ircuser, new_nick)
+        self.users[new_nick] = ircuser
+        keys = self.user_channels.pop(old_nick)
+        self.user_channels[new_nick] = keys
+        for key in keys:
+            members = self.channels[key].members
+            members[new_nick] = members.pop(old_nick)
+
+    def set_mode(self, channel_name, nick, mode, add=True):
+        channel = self.channels.get(channel_name)
+        if channel is None or nick not in channel.members:
+            return
+        modes = channel.members[nick]
+        if add and mode not in modes:
+            channel.members[nick] = intern_str(modes + mode)
+        elif not add:
+            channel.members[nick] = intern_str(modes.replace(mode, ''))
+
+    def channels_for(self, nick):
+        return [self.channels[key] for key in self.user_channels.get(nick, ())]
+
+    def split_names_entry(self, entry):
+        """
+        splits a RPL_NAMREPLY entry like @+nick or nick!user@host into
+        (modes, nick, user, host)
+        """
+        modes = []
+        symbols = self._prefix_modes
+        i = 0
+        while i < len(entry) and entry[i] in symbols:
+            modes.append(symbols[entry[i]])
+            i += 1
+        nick, _, userhost = entry[i:].partition('!')
+        user, _, host = userhost.partition('@')
+        return modes, nick, user or None, host or None
+
+    def _forget_membership(self, nick, channel_key):
+        keys = self.user_channels.get(nick)
+        if keys is None:
+            return
+        keys.discard(channel_key)
+        if not keys:
+            del self.user_channels[nick]
+            self.users.pop(nick, None)
@@ -1,8 +1,32 @@
+try:
+    from sys import intern
+except ImportError:
+    pass
+
+def intern_str(value):
+    # only plain str can be interned on python 2
+    return intern(value) if type(value) is str else value
+
 class IrcUser(object):
+    """
+    one person on a network.  a single instance is shared by every channel
+    and connection that sees the nick, so it is slotted and its strings are
+    interned.
+    """
+    __slots__ = ('nick', 'user', 'host', 'away', '__weakref__')
+
     def __init__(self, nick, user=None, host=None):
-        self.nick = nick
-        self.user = user
-        self.host = host
+        self.nick = intern_str(nick)
+        self.user = intern_str(user) if user else None
+        self.host = intern_str(host) if host else None
+        # None while here, the away message (maybe '') while away
+        self.away = None
 
     def __repr__(self):
         return '<IrcUser %s>' % self.nick
+
+    def update(self, user=None, host=None):
+        if user and user != self.user:
+            self.user = intern_str(user)
+        if host and host != self.host:
+            self.host = intern_str(host)
@@ -0,0 +1,198 @@
+"""
+raw lines used to check the hand written IrcEvent parser against the regex
+parser it replaced.  AGREED lines parse identically under both; FIXED lines
+are ones the regex got wrong, listed with the fields the new parser gives,
+including every line whose last parameter has no colon, which the regex
+left out of text.
+"""
+import re
+
+LEGACY_EVENT_PATTERN = re.compile((r'^(:(?P<prefix>((?P<nick>[^!]+)!'
+        r'(?P<user>[^@]+)@(?P<host>[^ ]+)|[^ ]+)) )?'
+        r'((?P<numeric>[0-9]{3})|(?P<command>[^ ]+))'
+        r'( (?P<destination>[^:][^ ]*))?( :(?P<text>.*)|'
+        r' (?P<parameters>.*))?$'))
+
+FIELDS = ('origin', 'type', 'nick', 'user', 'host', 'destination', 'text',
+        'parameters_raw', 'parameters')
+
+def legacy_parse(line):
+    """ the fields the old EVENT_PATTERN based IrcEvent._parse produced """
+    m = LEGACY_EVENT_PATTERN.match(line)
+    command = m.group('command')
+    parameters_raw = m.group('parameters')
+    destination = m.group('destination')
+    type = command.upper() if command else m.group('numeric')
+    text = m.group('text')
+    if type in ['JOIN', 'PART'] and not destination:
+        destination = text
+    return {
+        'origin': m.group('prefix'),
+        'type': type,
+        'nick': m.group('nick'),
+        'user': m.group('user'),
+        'host': m.group('host'),
+        'destination': destination,
+        'text': text,
+        'parameters_raw': parameters_raw,
+        'parameters': parameters_raw.split() if parameters_raw else [],
+        }
+
+AGREED = [
+    'PING :12345',
+    'PING :irc.example.net',
+    'ERROR :Closing Link: 127.0.0.1 (Ping timeout)',
+    ':bot!bot@host.name.com PRIVMSG #bot :beep',
+    ':bot!bot@host.name.com PRIVMSG #bot :david: beep bep boop',
+    ':bot!bot@host.name.com PRIVMSG #bot ::) smile',
+    ':bot!bot@host.name.com PRIVMSG #bot :',
+    ':bot!~bot@2001:db8::1 PRIVMSG iobot :hello there',
+    ':bot!bot@host.name.com NOTICE #bot :a notice',
+    ':bot!bot@host.name.com privmsg #bot :lower case command',
+    ':bot!bot@host.name.com JOIN :#brahtobot',
+    ':bot!bot@host.name.com PART #brahtobot :goodbye',
+    ':bot!bot@host.name.com NICK :newbot',
+    ':bot!bot@host.name.com QUIT :Quit: leaving',
+    ':bot!bot@host.name.com QUIT',
+    ':irc.example.net 001 iobot :Welcome to the network iobot',
+    ':irc.example.net NOTICE * :*** Looking up your hostname...',
+    ':irc.example.net PONG irc.example.net :iobot',
+    ]
+
+FIXED = {
+    ':bot!bot@host.name.com JOIN #brahtobot': {
+        'text': '#brahtobot',
+        },
+    ':bot!bot@host.name.com PART #brahtobot': {
+        'text': '#brahtobot',
+        },
+    ':bot!bot@host.name.com MODE #bot +o iobot': {
+        'text': 'iobot',
+        'parameters': ['+o', 'iobot'],
+        },
+    ':bot!bot@host.name.com MODE #bot +ov iobot other': {
+        'text': 'other',
+        'parameters': ['+ov', 'iobot', 'other'],
+        },
+    ':bot!bot@host.name.com KICK #bot iobot': {
+        'text': 'iobot',
+        'parameters': ['iobot'],
+        },
+    ':irc.example.net 005 iobot CHANTYPES=# PREFIX=(ov)@+ NICKLEN=30': {
+        'text': 'NICKLEN=30',
+        'parameters': ['CHANTYPES=#', 'PREFIX=(ov)@+', 'NICKLEN=30'],
+        },
+    ':bot!bot@host.name.com NICK newbot': {
+        'destination': 'newbot',
+        'text': 'newbot',
+        'parameters': [],
+        },
+    'PING irc.example.net': {
+        'destination': 'irc.example.net',
+        'text': 'irc.example.net',
+        },
+    ':bot!bot@host.name.com PRIVMSG #bot hello': {
+        'destination': '#bot',
+        'text': 'hello',
+        'parameters': ['hello'],
+        },
+    ':bot!bot@host.name.com PRIVMSG iobot iobot:': {
+        'destination': 'iobot',
+        'text': 'iobot:',
+        },
+    ':irc.example.net PONG irc.example.net iobot-3': {
+        'text': 'iobot-3',
+        'parameters': ['iobot-3'],
+        },
+    ':irc.example.net 353 iobot = #bot :iobot @op +voice': {
+        'destination': 'iobot',
+        'text': 'iobot @op +voice',
+        'parameters_raw': '= #bot :iobot @op +voice',
+        'parameters': ['=', '#bot'],
+        },
+    ':irc.example.net 353 iobot @ #secret :iobot @op': {
+        'text': 'iobot @op',
+        'parameters': ['@', '#secret'],
+        },
+    ':irc.example.net 366 iobot #bot :End of /NAMES list.': {
+        'text': 'End of /NAMES list.',
+        'parameters': ['#bot'],
+        },
+    ':server.only 421 iobot FOO :Unknown command': {
+        'text': 'Unknown command',
+        'parameters': ['FOO'],
+        },
+    ':bot!bot@host.name.com KICK #bot iobot :you are out': {
+        'destination': '#bot',
+        'text': 'you are out',
+        'parameters_raw': 'iobot :you are out',
+        'parameters': ['iobot'],
+        },
+    ':senor.crunchybueno.com 401 nodnc #xx :No such nick/channel': {
+        'destination': 'nodnc',
+        'text': 'No such nick/channel',
+        'parameters_raw': '#xx :No such nick/channel',
+        'parameters': ['#xx'],
+        },
+    ':senor.crunchybueno.com 401 nodnc  #xx :No such nick/channel': {
+        'destination': 'nodnc',
+        'text': 'No such nick/channel',
+        'parameters_raw': '#xx :No such nick/channel',
+        'parameters': ['#xx'],
+        },
+    ':irc.example.net 353 iobot = #bot :iobot @op +voice :colon': {
+        'text': 'iobot @op +voice :colon',
+        'parameters': ['=', '#bot'],
+        },
+    ':irc.example.net 352 iobot #bot ~u host.net irc.example.net nick H :0 Real Name': {
+        'text': '0 Real Name',
+        'parameters': ['#bot', '~u', 'host.net', 'irc.example.net', 'nick',
+            'H'],
+        },
+    ':irc.example.net 433 * iobot :Nickname is already in use.': {
+        'destination': '*',
+        'text': 'Nickname is already in use.',
+        'parameters': ['iobot'],
+        },
+    '@time=2012-06-30T23:59:60.419Z :bot!bot@host.name.com PRIVMSG #bot :hi': {
+        'origin': 'bot!bot@host.name.com',
+        'type': 'PRIVMSG',
+        'nick': 'bot',
+        'user': 'bot',
+        'host': 'host.name.com',
+        'destination': '#bot',
+        'text': 'hi',
+        'parameters_raw': None,
+        'parameters': [],
+        },
+    '@batch=yXNAbvnRHTRBv :bot!bot@host.name.com QUIT :irc.a irc.b': {
+        'origin': 'bot!bot@host.name.com',
+        'type': 'QUIT',
+        'nick': 'bot',
+        'user': 'bot',
+        'host': 'host.name.com',
+        'destination': None,
+        'text': 'irc.a irc.b',
+        'parameters_raw': None,
+        'parameters': [],
+        },
+    }
+
+TAGGED = {
+    '@time=2012-06-30T23:59:60.419Z :bot!bot@host.name.com PRIVMSG #bot :hi': {
+        'time': '2012-06-30T23:59:60.419Z',
+        },
+    '@aaa=bbb;ccc;example.com/ddd=eee :nick!ident@host.com PRIVMSG me :Hi': {
+        'aaa': 'bbb',
+        'ccc': '',
+        'example.com/ddd': 'eee',
+        },
+    r'@a=semi\:colon\sspace\\slash\r\n;b=trail\ :srv NOTICE * :x': {
+        'a': 'semi;colon space\\slash\r\n',
+        'b': 'trail',
+        },
+    }
+
+def corpus():
+    """ every corpus line, for benchmarks """
+    return AGREED + list(FIXED) + list(TAGGED)
@@ -1,5 +1,11 @@
+from collections import deque
+from datetime import timedelta
 from unittest import TestCase
 
+import mock
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
 class TestIOBot(TestCase):
     def setUp(self):
         from iobot.bot import IOBot
@@ -40,3 +46,310 @@ class TestIOBot(TestCase):
         self.assertTrue('JOIN' in bot._hooks)
         self.assertEqual(len(bot._hooks['JOIN']), 1)
         self.assertTrue(isinstance(bot._hooks['JOIN'][0], SimplePlugin))
+
+    def test_write_to(self):
+        conn = mock.Mock()
+        self.bot.connections['local'] = conn
+        self.bot.write_to('local', 'PRIVMSG #c :hi')
+        conn.write_raw.assert_called_once_with('PRIVMSG #c :hi')
+        self.assertRaises(KeyError, self.bot.write_to, 'remote', 'QUIT')
+        self.bot.shard = mock.Mock()
+        self.bot.write_to('remote', 'QUIT')
+        self.bot.shard.route.assert_called_once_with('remote', 'write_to',
+                ('remote', 'QUIT'))
+
+    def test_apply_config(self):
+        bot = self.bot
+        bot.create_connection = mock.Mock()
+        servers = {'a': {'port': 1}, 'b': {'port': 2}}
+        self.assertEqual(bot.apply_config(servers), (['a', 'b'], [], []))
+        conn_a = bot.connections['a']
+        conn_b = bot.connections['b']
+        servers = {'b': {'port': 3}, 'c': {'port': 4}}
+        self.assertEqual(bot.apply_config(servers), (['c'], ['a'], ['b']))
+        conn_a.disconnect.assert_called_once_with('Removed from config')
+        self.assertEqual(sorted(bot.connections), ['b', 'c'])
+        self.assertTrue(bot.connections['b'] is conn_b)
+        self.assertEqual(bot.create_connection.call_count, 3)
+
+    def test_manifests_match(self):
+        import importlib
+        from iobot.plugins.manifest import MANIFESTS
+        for plugin_name, manifest in MANIFESTS.items():
+            plugin_cls = importlib.import_module(
+                    'iobot.plugins.%s' % plugin_name).Plugin
+            attrs = [getattr(plugin_cls, name) for name in dir(plugin_cls)]
+            commands = [a.__name__ for a in attrs if getattr(a, 'cmd', False)]
+            hooks = [a.__name__[3:].upper() for a in attrs
+                    if getattr(a, 'hook', False)]
+            self.assertEqual(sorted(manifest['commands']), sorted(commands),
+                    plugin_name)
+            self.assertEqual(sorted(manifest['hooks']), sorted(hooks),
+                    plugin_name)
+
+    def test_lazy_plugin(self):
+        from iobot.event import IrcEvent
+        bot = self.bot
+        bot.load_plugin('echo', lazy=True)
+        self.assertEqual(bot._lazy_plugins, set(['echo']))
+        self.assertTrue('echo' in bot._command_handlers)
+        self.assertFalse('echo' in bot.import_times)
+        conn = mock.Mock(inflight=0)
+        conn.bot = bot
+        event = IrcEvent('bot', ':a!b@c PRIVMSG #chan :bot: echo hi there')
+        bot.process_plugins(conn, event)
+        conn.reply.assert_called_once_with(event, 'hi there')
+        self.assertEqual(bot._lazy_plugins, set())
+        self.assertEqual(type(bot._instances['echo']).__name__, 'Echo')
+        self.assertTrue('echo' in bot.import_times)
+        bot.process_plugins(conn, event)
+        self.assertEqual(conn.reply.call_count, 2)
+
+    def test_import_lazy_plugins(self):
+        bot = self.bot
+        bot.ioloop = mock.Mock()
+        bot.load_plugin('echo', lazy=True)
+        bot.load_plugin('admin', lazy=True)
+        bot.import_lazy_plugins()
+        self.assertEqual(bot._lazy_plugins, set(['echo']))
+        bot.import_lazy_plugins()
+        self.assertEqual(bot._lazy_plugins, set())
+        self.assertEqual(sorted(bot.import_times), ['admin', 'echo'])
+
+    def test_dispatch_tables(self):
+        from iobot.plugins.decorators import plugin_command, plugin_hook
+        calls = []
+        class SimplePlugin(object):
+            @plugin_command
+            def my_command(self, conn, event):
+                calls.append(('my_command', event))
+
+            @plugin_hook
+            def on_join(self, conn, event):
+                calls.append(('on_join', event))
+        bot = self.bot
+        bot.add_plugin('simple_plugin', SimplePlugin)
+        self.assertEqual(len(bot._hook_handlers['JOIN']), 1)
+        self.assertTrue('my_command' in bot._command_handlers)
+
+        from iobot.event import IrcEvent
+        join = IrcEvent('bot', ':a!b@c JOIN #chan')
+        cmd = IrcEvent('bot', ':a!b@c PRIVMSG #chan :bot: my_command')
+        conn = mock.Mock(inflight=0)
+        bot.process_hooks(conn, join)
+        bot.process_plugins(conn, cmd)
+        self.assertEqual(calls, [('on_join', join), ('my_command', cmd)])
+
+        self.assertEqual(bot._handler_metrics, {})
+
+        bot.unload_plugin('simple_plugin')
+        self.assertEqual(bot._hook_handlers, {})
+        self.assertEqual(bot._command_handlers, {})
+        self.assertEqual(bot._hooks, {})
+
+    def test_stop_plugins(self):
+        stopped = []
+        class StoppingPlugin(object):
+            def stop(self):
+                stopped.append(self)
+        class FailingPlugin(object):
+            def stop(self):
+                raise IOError('disk full')
+        bot = self.bot
+        bot.add_plugin('failing', FailingPlugin)
+        bot.add_plugin('stopping', StoppingPlugin)
+        plugin = bot._instances['stopping']
+        bot.unload_plugin('stopping')
+        self.assertEqual(stopped, [plugin])
+
+        bot.add_plugin('stopping', StoppingPlugin)
+        bot.ioloop = mock.Mock()
+        with mock.patch.object(bot.logger, 'exception') as exception:
+            bot.start()
+        exception.assert_called_once_with('Error stopping %s', 'failing')
+        self.assertEqual(stopped, [plugin, bot._instances['stopping']])
+
+    def test_handler_metrics(self):
+        from iobot.bot import IOBot
+        from iobot.event import IrcEvent
+        from iobot.plugins.decorators import plugin_command
+        class FailingPlugin(object):
+            @plugin_command
+            def fail(self, conn, event):
+                raise ValueError('nope')
+        bot = IOBot({}, ';', 'bot', 'bot', 'bot', metrics=True)
+        bot.add_plugin('failing', FailingPlugin)
+        bot.process_plugins(mock.Mock(inflight=0),
+                IrcEvent('bot', ':a!b@c PRIVMSG #chan :bot: fail'))
+        latency, errors = bot._handler_metrics[bot._command_handlers['fail']]
+        self.assertEqual(errors.value, 1)
+        self.assertEqual(latency.count, 0)
+
+
+class TestAsyncHandlers(AsyncTestCase):
+    def setUp(self):
+        super(TestAsyncHandlers, self).setUp()
+        from iobot.bot import IOBot
+        self.bot = IOBot({}, ';', 'bot', 'bot', 'bot', handler_timeout=1,
+                max_inflight=2)
+        self.conn = mock.Mock()
+        self.conn.inflight = 0
+        self.conn.pending_handlers = deque()
+        self.conn.dropped_handlers = 0
+
+    def command(self, plugin_cls, text):
+        from iobot.event import IrcEvent
+        self.bot.add_plugin('plugin', plugin_cls)
+        event = IrcEvent('bot', ':a!b@c PRIVMSG #chan :bot: %s' % text)
+        self.bot.process_plugins(self.conn, event)
+        return event
+
+    @gen_test
+    def test_coroutine_handler(self):
+        from iobot.plugins.decorators import plugin_command
+        done = []
+        class SlowPlugin(object):
+            @plugin_command
+            @gen.coroutine
+            def slow(self, conn, event):
+                yield gen.sleep(0.01)
+                done.append(event)
+        event = self.command(SlowPlugin, 'slow')
+        self.assertEqual(done, [])
+        self.assertEqual(self.conn.inflight, 1)
+        yield gen.sleep(0.05)
+        self.assertEqual(done, [event])
+        self.assertEqual(self.conn.inflight, 0)
+
+    @gen_test
+    def test_handler_timeout(self):
+        from iobot.plugins.decorators import plugin_command
+        class StuckPlugin(object):
+            @plugin_command
+            @gen.coroutine
+            def stuck(self, conn, event):
+                yield gen.sleep(5)
+        self.bot.handler_timeout = 0.01
+        event = self.command(StuckPlugin, 'stuck')
+        yield gen.sleep(0.05)
+        self.conn.reply.assert_called_with(event, 'Timed out after 0.01s')
+        self.assertEqual(self.conn.inflight, 0)
+
+    @gen_test
+    def test_coroutine_handler_metrics(self):
+        from iobot.plugins.decorators import plugin_command
+        class SlowPlugin(object):
+            @plugin_command
+            @gen.coroutine
+            def slow(self, conn, event):
+                yield gen.sleep(0.01)
+        self.bot.metrics.enabled = True
+        self.command(SlowPlugin, 'slow')
+        yield gen.sleep(0.05)
+        latency, errors = self.bot.handler_metrics(
+                self.bot._command_handlers['slow'])
+        self.assertEqual(latency.count, 1)
+        self.assertTrue(latency.sum >= 0.01)
+        self.assertEqual(errors.value, 0)
+
+    @gen_test
+    def test_max_inflight(self):
+        from iobot.plugins.decorators import plugin_command
+        started = []
+        class BusyPlugin(object):
+            @plugin_command
+            @gen.coroutine
+            def busy(self, conn, event):
+                started.append(event)
+                yield gen.sleep(0.01)
+        from iobot.event import IrcEvent
+        self.command(BusyPlugin, 'busy')
+        for i in range(3):
+            event = IrcEvent('bot', ':a!b@c PRIVMSG #chan :bot: busy')
+            self.bot.process_plugins(self.conn, event)
+        self.assertEqual(len(started), 2)
+        self.assertEqual(len(self.conn.pending_handlers), 2)
+        yield gen.sleep(0.05)
+        self.assertEqual(len(started), 4)
+        self.assertEqual(self.conn.inflight, 0)
+
+    @gen_test
+    def test_max_inflight_future(self):
+        from iobot.plugins.decorators import plugin_command
+        started = []
+        class FuturePlugin(object):
+            # not a coroutine function, but hands back a Future all the same
+            @plugin_command
+            def busy(self, conn, event):
+                started.append(event)
+                return gen.sleep(0.01)
+        from iobot.event import IrcEvent
+        self.bot.max_pending = 1
+        self.command(FuturePlugin, 'busy')
+        for i in range(3):
+            event = IrcEvent('bot', ':a!b@c PRIVMSG #chan :bot: busy')
+            self.bot.process_plugins(self.conn, event)
+        self.assertEqual(len(started), 2)
+        self.assertEqual(len(self.conn.pending_handlers), 1)
+        self.assertEqual(self.conn.dropped_handlers, 1)
+        yield gen.sleep(0.05)
+        self.assertEqual(len(started), 3)
+        self.assertEqual(self.conn.inflight, 0)
+
+    @gen_test
+    def test_max_inflight_hooks(self):
+        from iobot.event import IrcEvent
+        from iobot.plugins.decorators import plugin_hook
+        started = []
+        class HookPlugin(object):
+            @plugin_hook
+            def on_privmsg(self, conn, event):
+                started.append(event)
+                return gen.sleep(0.01)
+        self.bot.add_plugin('plugin', HookPlugin)
+        for i in range(3):
+            self.bot.process_hooks(self.conn,
+                    IrcEvent('bot', ':a!b@c PRIVMSG #chan :hi'))
+        self.assertEqual(len(started), 2)
+        self.assertEqual(len(self.conn.pending_handlers), 1)
+        yield gen.sleep(0.05)
+        self.assertEqual(len(started), 3)
+        self.assertEqual(self.conn.inflight, 0)
+
+    @gen_test
+    def test_submit(self):
+        result = yield self.bot.submit(pow, 2, 10)
+        self.assertEqual(result, 1024)
+        self.bot.executor.shutdown()
+
+    @gen_test
+    def test_submit_error(self):
+        with self.assertRaises(ZeroDivisionError):
+            yield self.bot.submit(divmod, 1, 0)
+        self.bot.executor.shutdown()
+
+    @gen_test
+    def test_submit_process_pool(self):
+        from iobot.executor import BotExecutor
+        executor = BotExecutor(self.io_loop, 'process', 1)
+        result = yield executor.submit(pow, 3, 3)
+        self.assertEqual(result, 27)
+        executor.shutdown()
+
+    @gen_test
+    def test_submit_pool_failures(self):
+        import os
+        from iobot.executor import BotExecutor, ExecutorError
+        executor = BotExecutor(self.io_loop, 'process', 1)
+        executor.poll_interval = 0.01
+        # the pool can't pickle a lambda, and calls back only on success
+        with self.assertRaisesRegexp(Exception, "Can't pickle"):
+            yield gen.with_timeout(timedelta(seconds=5),
+                    executor.submit(lambda: 1))
+        with self.assertRaises(ExecutorError):
+            yield gen.with_timeout(timedelta(seconds=5),
+                    executor.submit(os._exit, 1))
+        # and a fresh pool takes over
+        result = yield executor.submit(pow, 2, 3)
+        self.assertEqual(result, 8)
+        executor.shutdown()
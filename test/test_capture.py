@@ -0,0 +1,46 @@
+import sys, os.path
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+
+import shutil
+import tempfile
+from unittest import TestCase
+
+from iobot.capture import RawCapture
+
+class TestRawCapture(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'raw.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_write(self):
+        capture = RawCapture(self.path)
+        capture.write('test', '<', 'PING :100%')
+        capture.write('test', '>', 'PONG :100%')
+        capture.close()
+        with open(self.path) as fp:
+            lines = [line.split(' ', 1)[1] for line in fp.read().splitlines()]
+        self.assertEqual(lines, ['test < PING :100%', 'test > PONG :100%'])
+
+    def test_rotate(self):
+        capture = RawCapture(self.path, max_bytes=200, backups=2)
+        for i in range(20):
+            capture.write('test', '<', 'PRIVMSG #chan :line %d' % i)
+        capture.close()
+        self.assertTrue(os.path.exists(self.path + '.1'))
+        self.assertTrue(os.path.exists(self.path + '.2'))
+        self.assertFalse(os.path.exists(self.path + '.3'))
+        with open(self.path) as fp:
+            self.assertTrue(fp.read().rstrip().endswith('line 19'))
+
+    def test_full_queue_drops(self):
+        capture = RawCapture(self.path, queue_size=1)
+        # hold the writer up by filling the queue faster than it drains
+        for i in range(1000):
+            capture.write('test', '<', 'PING :%d' % i)
+        capture.close()
+        with open(self.path) as fp:
+            written = len(fp.read().splitlines())
+        self.assertEqual(written + capture.dropped, 1000)
@@ -0,0 +1,103 @@
+import sys, os.path
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+
+import shutil
+import tempfile
+from unittest import TestCase
+
+import mock
+
+from iobot import config
+from iobot.config import (read_config, parse_config, interp_value,
+        ConfigSchemaError)
+
+CONFIG = """
+core = {
+    prefix = ;
+    nick = iobot
+    user = iobot
+    realname = iobot 1.0
+    handler_timeout = 2.5
+}
+servers = {
+    freenode = {
+        address = irc.freenode.net
+        port = 6667
+        ssl = false
+        owners = {
+            nod
+            ketralnis
+        }
+        channels = {
+            #iobot
+        }
+    }
+}
+plugins = {
+    markov_bot = {
+        brain = irc
+    }
+}
+"""
+
+class TestConfig(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'iobot.conf')
+        self.write(CONFIG)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, text, mtime=None):
+        with open(self.path, 'w') as fp:
+            fp.write(text)
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_interp_value(self):
+        self.assertEqual(interp_value('12'), 12)
+        self.assertEqual(interp_value('-1.5e3'), -1500.0)
+        self.assertEqual(interp_value('True'), True)
+        self.assertEqual(interp_value('FALSE'), False)
+        self.assertEqual(interp_value('1.2.3'), '1.2.3')
+        self.assertEqual(interp_value('#chan'), '#chan')
+
+    def test_read(self):
+        conf = read_config(self.path, cache=False)
+        self.assertEqual(conf['core']['prefix'], ';')
+        self.assertEqual(conf['core']['handler_timeout'], 2.5)
+        server = conf['servers']['freenode']
+        self.assertEqual(server['port'], 6667)
+        self.assertEqual(server['ssl'], False)
+        self.assertEqual(sorted(server['owners']), ['ketralnis', 'nod'])
+        self.assertEqual(server['channels'], ['#iobot'])
+        self.assertEqual(conf['plugins'], {'markov_bot': {'brain': 'irc'}})
+
+    def test_schema(self):
+        for bad, message in (
+                ('port = 6667', 'port = sixsixsixseven'),
+                ('nick = iobot', ''),
+                ('ssl = false', 'ssl = false\n        colour = blue'),
+                ):
+            self.write(CONFIG.replace(bad, message))
+            self.assertRaises(ConfigSchemaError, read_config, self.path,
+                    cache=False)
+        self.write('core = {\n}\n')
+        self.assertRaises(ConfigSchemaError, read_config, self.path,
+                cache=False)
+
+    def test_cache(self):
+        with mock.patch.object(config, 'parse_config',
+                wraps=parse_config) as parse:
+            first = read_config(self.path)
+            self.assertEqual(read_config(self.path), first)
+            self.assertEqual(parse.call_count, 1)
+            # touched but the same, the hash still matches
+            self.write(CONFIG, mtime=1000000)
+            self.assertEqual(read_config(self.path), first)
+            self.assertEqual(parse.call_count, 1)
+            self.write(CONFIG.replace('6667', '6697'))
+            self.assertEqual(
+                    read_config(self.path)['servers']['freenode']['port'], 6697)
+            self.assertEqual(parse.call_count, 2)
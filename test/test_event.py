@@ -5,6 +5,27 @@ class TestIrcEvent(TestCase):
         from iobot.event import IrcEvent
         return IrcEvent(my_nick, line)
 
+    def test_decode(self):
+        e = self.makeOne(':a!b@c PRIVMSG #x :caf\xc3\xa9')
+        self.assertEqual(e.text, 'caf\xc3\xa9')
+        self.assertEqual(e.unicode_text, u'caf\u00e9')
+        # not UTF-8, so the fallback charset
+        e = self.makeOne(':a!b@c PRIVMSG #x :caf\xe9')
+        self.assertEqual(e.unicode_text, u'caf\u00e9')
+        from iobot.event import IrcEvent
+        e = IrcEvent('david', ':a!b@c PRIVMSG #x :\xef\xf0\xe8\xe2\xe5\xf2',
+                'cp1251')
+        self.assertEqual(e.unicode_text, u'\u043f\u0440\u0438\u0432\u0435\u0442')
+        self.assertEqual(e.decode(e.nick), u'a')
+
+    def test_server_time(self):
+        e = self.makeOne('@time=2011-10-19T16:40:51.620Z :a!b@c PRIVMSG #x :hi')
+        self.assertAlmostEqual(e.server_time, 1319042451.62)
+        self.assertEqual(self.makeOne(':a!b@c PRIVMSG #x :hi').server_time,
+                None)
+        self.assertEqual(self.makeOne('@time=yesterday :a!b@c PING').server_time,
+                None)
+
     def test_parse_privmsg(self):
         e = self.makeOne((':bot!bot@host.name.com'
                 ' PRIVMSG #bot :beep'))
@@ -82,9 +103,55 @@ class TestIrcEvent(TestCase):
         self.assertEqual(e.nick, 'bot')
         self.assertEqual(e.user, 'bot')
         self.assertEqual(e.host, 'host.name.com')
-        self.assertTrue(e.text is None)
+        # the channel is the last parameter as well as the first
+        self.assertEqual(e.text, '#brahtobot')
         self.assertEqual(e.destination, '#brahtobot')
         self.assertEqual(e.type, 'JOIN')
         self.assertTrue(e.command is None)
         self.assertTrue(e.command_params is None)
         self.assertTrue(e.command_params_raw is None)
+
+    def test_fields_are_lazy(self):
+        e = self.makeOne((':bot!bot@host.name.com'
+                ' PRIVMSG #bot :david: beep'))
+        self.assertFalse(hasattr(e, '__dict__'))
+        self.assertEqual(e.type, 'PRIVMSG')
+        from iobot.event import _UNSET
+        self.assertTrue(e._text is _UNSET)
+        self.assertTrue(e._command is _UNSET)
+        self.assertEqual(e.command, 'beep')
+        self.assertEqual(e._text, 'david: beep')
+
+    def test_set_field(self):
+        e = self.makeOne(':bot!bot@host.name.com JOIN #brahtobot')
+        e.destination = '#other'
+        self.assertEqual(e.destination, '#other')
+        self.assertEqual(e.nick, 'bot')
+        # reading a sibling field doesn't reparse over the assigned value
+        self.assertEqual(e.text, '#brahtobot')
+        self.assertEqual(e.destination, '#other')
+        e.nick = 'x'
+        self.assertEqual(e.user, 'bot')
+        self.assertEqual(e.nick, 'x')
+
+    def test_params(self):
+        e = self.makeOne(':irc CAP * LS * :multi-prefix sasl')
+        self.assertEqual(e.params, ['*', 'LS', '*', 'multi-prefix sasl'])
+        e = self.makeOne(':op!o@h MODE #c +ov a b')
+        self.assertEqual(e.params, ['#c', '+ov', 'a', 'b'])
+        self.assertEqual(self.makeOne(':a!b@c QUIT').params, [])
+
+    def test_set_text(self):
+        e = self.makeOne(':a!b@c PRIVMSG #x :one')
+        self.assertEqual(e.unicode_text, u'one')
+        e.text = 'two'
+        self.assertEqual(e.unicode_text, u'two')
+        self.assertEqual(e.destination, '#x')
+
+    def test_empty_event(self):
+        from iobot.event import IrcEvent
+        e = IrcEvent('david')
+        self.assertTrue(e.type is None)
+        self.assertTrue(e.destination is None)
+        self.assertEqual(e.parameters, [])
+        self.assertTrue(e.command is None)
@@ -0,0 +1,33 @@
+from unittest import TestCase
+
+from irc_corpus import AGREED, FIXED, TAGGED, FIELDS, legacy_parse
+
+class TestParserConformance(TestCase):
+    def fields(self, line):
+        from iobot.event import IrcEvent
+        e = IrcEvent('iobot', line)
+        return dict((f, getattr(e, f)) for f in FIELDS)
+
+    def test_agrees_with_regex_parser(self):
+        for line in AGREED:
+            self.assertEqual(self.fields(line), legacy_parse(line), line)
+
+    def test_agrees_with_regex_parser_crlf(self):
+        for line in AGREED:
+            self.assertEqual(self.fields(line + '\r\n'), legacy_parse(line),
+                    line)
+
+    def test_fixed_lines(self):
+        for line, expected in FIXED.items():
+            fields = self.fields(line)
+            for name, value in expected.items():
+                self.assertEqual(fields[name], value, '%s %s' % (line, name))
+
+    def test_message_tags(self):
+        from iobot.event import IrcEvent
+        for line, expected in TAGGED.items():
+            self.assertEqual(IrcEvent('iobot', line).tags, expected, line)
+
+    def test_untagged_line_has_no_tags(self):
+        from iobot.event import IrcEvent
+        self.assertEqual(IrcEvent('iobot', 'PING :1').tags, {})
@@ -0,0 +1,153 @@
+import sys, os.path
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+
+import json
+
+import mock
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase
+
+from iobot.plugins.decorators import plugin_command, admin_command
+
+class GatewayPlugin(object):
+    @plugin_command
+    def echo(self, conn, event):
+        conn.reply(event, event.command_params_raw)
+
+    @plugin_command
+    @gen.coroutine
+    def slow(self, conn, event):
+        yield gen.sleep(float(event.command_params_raw))
+        conn.reply_with_nick(event, 'done %s' % event.command_params_raw)
+
+    @plugin_command
+    def whoami(self, conn, event):
+        conn.reply(event, '%s in %s' % (event.nick, event.destination))
+
+    @admin_command
+    def secret(self, conn, event):
+        conn.reply(event, 'secret')
+
+    @plugin_command
+    def broken(self, conn, event):
+        raise ValueError('broken')
+
+class TestGateway(AsyncHTTPTestCase):
+    token = None
+
+    def get_app(self):
+        from iobot.bot import IOBot
+        from iobot.gateway import Gateway
+        self.bot = IOBot({}, ';', 'bot', 'bot', 'bot', handler_timeout=1)
+        self.bot.add_plugin('gateway', GatewayPlugin)
+        self.gateway = Gateway(self.bot, self.token)
+        return self.gateway.application()
+
+    def fetch_json(self, path, body=None, **kwargs):
+        if body is not None:
+            kwargs.update(method='POST', body=json.dumps(body))
+        response = self.fetch(path, **kwargs)
+        return response.code, json.loads(response.body)
+
+    def test_list(self):
+        code, body = self.fetch_json('/commands')
+        self.assertEqual(body['commands'],
+                ['broken', 'echo', 'secret', 'slow', 'whoami'])
+
+    def test_get(self):
+        code, body = self.fetch_json('/commands/echo?args=hi+there')
+        self.assertEqual((code, body),
+                (200, {'command': 'echo', 'replies': ['hi there']}))
+
+    def test_post(self):
+        code, body = self.fetch_json('/commands/whoami',
+                {'nick': 'nod', 'channel': '#chan'})
+        self.assertEqual(body['replies'], ['nod in #chan'])
+
+    def test_coroutine(self):
+        code, body = self.fetch_json('/commands/slow', {'args': '0.01'})
+        self.assertEqual(body['replies'], ['done 0.01'])
+
+    def test_errors(self):
+        code, body = self.fetch_json('/commands/missing')
+        self.assertEqual((code, body['error']), (404, 'No command missing'))
+        code, body = self.fetch_json('/commands/broken')
+        self.assertEqual((code, body['error']), (500, 'broken'))
+        code, body = self.fetch_json('/commands/slow', {'args': '5'})
+        self.assertEqual((code, body['error']), (504, 'Timed out after 1s'))
+        code, body = self.fetch_json('/commands/echo', [])
+        self.assertEqual((code, body['error']), (400,
+            'Expected a json object'))
+
+    def test_owners(self):
+        denied = ['Error: Insufficient privileges for nod']
+        code, body = self.fetch_json('/commands/secret', {'nick': 'nod'})
+        self.assertEqual(body['replies'], denied)
+        conn = mock.Mock(owners=['nod'], nick='bot', server_name='test')
+        self.bot.connections['test'] = conn
+        code, body = self.fetch_json('/commands/secret', {'nick': 'nod'})
+        # naming an owner is only enough for a caller with the token
+        self.assertEqual(body['replies'], ['secret'] if self.token else denied)
+        self.assertFalse(conn.reply.called)
+        code, body = self.fetch_json('/commands/secret',
+                {'nick': 'nod', 'server': 'other'})
+        self.assertEqual((code, body['error']), (404, 'No server other'))
+
+    def test_invalid_names(self):
+        code, body = self.fetch_json('/commands/whoami',
+                {'nick': 'evil PRIVMSG #x :bot: secret'})
+        self.assertEqual((code, body['error']), (400, 'Invalid nick'))
+        code, body = self.fetch_json('/commands/whoami', {'channel': '#a,#b'})
+        self.assertEqual((code, body['error']), (400, 'Invalid channel'))
+        code, body = self.fetch_json('/commands/echo',
+                {'args': 'one\r\nQUIT :bye'})
+        self.assertEqual(body['replies'], ['one QUIT :bye'])
+
+    def test_run_handler(self):
+        self.bot.max_inflight = 1
+        self.bot.max_pending = 0
+        self.bot.metrics.enabled = True
+        self.bot.build_dispatch()
+        self.gateway.inflight = 1
+        code, body = self.fetch_json('/commands/echo?args=hi')
+        self.assertEqual((code, body['error']), (503,
+            'Too many commands waiting'))
+        self.gateway.inflight = 0
+        code, body = self.fetch_json('/commands/slow', {'args': '0.01'})
+        self.assertEqual(body['replies'], ['done 0.01'])
+        self.assertEqual(self.gateway.inflight, 0)
+        latency, errors = self.bot.handler_metrics(
+                self.bot._command_handlers['slow'])
+        self.assertEqual(latency.count, 1)
+
+    def test_listen_without_token(self):
+        from iobot.gateway import Gateway, GatewayError
+        gateway = Gateway(self.bot)
+        self.assertRaises(GatewayError, gateway.listen, 0, '0.0.0.0')
+        Gateway(self.bot, 'sekrit').listen(0, '0.0.0.0').stop()
+        gateway.listen(0, '127.0.0.1').stop()
+
+    def test_batch(self):
+        response = self.fetch('/batch', method='POST', body=json.dumps({
+            'commands': [{'command': 'slow', 'args': '0.02'},
+                {'command': 'echo', 'args': 'a'},
+                {'command': 'missing'}]}))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers.get('Transfer-Encoding'), 'chunked')
+        results = [json.loads(line) for line in response.body.splitlines()]
+        self.assertEqual([r['command'] for r in results],
+                ['slow', 'echo', 'missing'])
+        self.assertEqual(results[0]['replies'], ['done 0.02'])
+        self.assertEqual(results[2]['status'], 404)
+
+class TestGatewayToken(TestGateway):
+    token = 'sekrit'
+
+    def fetch(self, path, **kwargs):
+        headers = kwargs.pop('headers', {'Authorization': 'Bearer sekrit'})
+        return super(TestGatewayToken, self).fetch(path, headers=headers,
+                **kwargs)
+
+    def test_refused(self):
+        response = self.fetch('/commands', headers={})
+        self.assertEqual(response.code, 403)
@@ -1,4 +1,5 @@
 import logging
+import socket
 import sys, os.path
 sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
 
@@ -24,6 +25,11 @@ class TestIrcConnection(AsyncTestCase):
     def raw_irc_in(self, txt):
         self.irc.read_raw(txt)
 
+    def flush(self):
+        # queued lines go out on the next IOLoop iteration
+        self.io_loop.add_callback(self.stop)
+        self.wait()
+
     @mock.patch('iobot.irc.IrcConnection.connect', _patched_connect)
     def setUp(self):
         from iobot.irc import IrcConnection
@@ -32,6 +38,7 @@ class TestIrcConnection(AsyncTestCase):
         self.irc = IrcConnection(bot, 'test', 'localhost', 6667,
                 'testie', 'iobot', 'iobot', 'owner')
         self.irc.connect()
+        self.flush()
         assert self.irc._stream.write.called
 
     def test_set_nick(self):
@@ -39,6 +46,15 @@ class TestIrcConnection(AsyncTestCase):
         self.irc.set_nick(nick)
         assert self.irc._stream.write.called_with("NICK {}".format(nick))
 
+    def test_nick_without_colon(self):
+        self.irc.add_channel('#chan')
+        self.raw_irc_in(':alice!a@h JOIN #chan\r\n')
+        self.raw_irc_in(':alice!a@h NICK bob\r\n')
+        self.assertTrue('bob' in self.irc.users)
+        self.assertFalse('alice' in self.irc.users)
+        self.raw_irc_in(':{}!i@h NICK iobot2\r\n'.format(self.irc.nick))
+        self.assertEqual(self.irc.nick, 'iobot2')
+
     def test_set_empty_nick(self):
         from iobot.irc import IrcError
         self.assertRaises(IrcError, self.irc.set_nick, '')
@@ -73,6 +89,7 @@ class TestIrcConnection(AsyncTestCase):
     def test_priv_msg(self):
         chan, msg = "#hi", "i am the walrus"
         self.irc.private_message(chan, msg)
+        self.flush()
         self.irc._stream.write.assert_called_with(
                 "PRIVMSG {} :{}\r\n".format(chan, msg)
                 )
@@ -90,7 +107,40 @@ class TestIrcConnection(AsyncTestCase):
         #self.irc.hook('PING', lambda irc: self.stop(True))
         self.raw_irc_in('PING :12345\r\n')
         #assert self.wait()
-        assert self.irc._stream.write.called
+        self.flush()
+        self.irc._stream.write.assert_called_with('PONG :12345\r\n')
+
+    def test_nick_in_use(self):
+        self.irc._stream.write.reset_mock()
+        self.irc_in('433 * testie', 'Nickname is already in use.')
+        self.flush()
+        self.irc._stream.write.assert_called_with('NICK testie_\r\n')
+        self.assertEqual(self.irc.nick, 'testie_')
+        self.irc.isupport.update(['NICKLEN=7'])
+        self.irc_in('433 * testie_', 'Nickname is already in use.')
+        self.assertEqual(len(self.irc.nick), 7)
+        self.assertTrue(self.irc.nick.startswith('testie'))
+        self.irc_in('001 testie_', 'Welcome')
+        self.assertEqual(self.irc.nick, 'testie_')
+        # once registered a refused NICK changes nothing
+        self.irc_in('433 testie_ other', 'Nickname is already in use.')
+        self.assertEqual(self.irc.nick, 'testie_')
+
+    def test_ping_without_colon(self):
+        self.raw_irc_in('PING irc.example.net\r\n')
+        self.flush()
+        self.irc._stream.write.assert_called_with('PONG :irc.example.net\r\n')
+
+    def test_writes_coalesced(self):
+        self.irc._stream.write.reset_mock()
+        # registration spent some of the flood burst
+        self.irc._sendq.bucket.tokens = self.irc._sendq.bucket.burst
+        self.irc.private_message('#hi', 'one')
+        self.irc.private_message('#hi', 'two')
+        self.raw_irc_in('PING :12345\r\n')
+        self.flush()
+        self.irc._stream.write.assert_called_once_with(
+                'PONG :12345\r\nPRIVMSG #hi :one\r\nPRIVMSG #hi :two\r\n')
 
     def test_parse_join(self):
         chan = '#testchan'
@@ -106,10 +156,455 @@ class TestIrcConnection(AsyncTestCase):
 
     def test_parse_msg_to_unjoined(self):
         chan = "#hi"
-        self.irc.channels[chan] = [] # fake join msg
+        self.irc.add_channel(chan) # fake join msg
         # :senor.crunchybueno.com 401 nodnc  #xx :No such nick/channel
         self.irc_in(
             "401 {} {}".format(self.irc.nick, chan),
             "No such nick/channel"
             )
         assert chan not in self.irc.channels
+
+    def test_read_chunk(self):
+        chan = '#testchan'
+        join = ':{0}!~{0}@localhost JOIN :{1}\r\n'.format(self.irc.nick, chan)
+        self.irc.read_chunk('PING :12345\r\n' + join[:10])
+        assert chan not in self.irc.channels
+        self.irc.read_chunk(join[10:])
+        assert chan in self.irc.channels
+        self.assertEqual(self.irc._read_buffer, bytearray())
+
+    def test_read_chunk_batches_lines(self):
+        lines = ['PING :{}'.format(i) for i in range(5)]
+        self.irc.read_chunk('\r\n'.join(lines) + '\r\nPING :5')
+        self.assertEqual(self.irc.bot.process_hooks.call_count, 5)
+        self.assertEqual(self.irc._read_buffer, bytearray('PING :5'))
+
+    def test_read_chunk_splits_character(self):
+        events = []
+        self.irc.bot.process_hooks.side_effect = lambda irc, e: events.append(e)
+        line = u':a!b@c PRIVMSG #x :\u00e9t\u00e9\r\n'.encode('utf-8')
+        cut = line.index('\xc3') + 1
+        self.irc.read_chunk(line[:cut])
+        self.irc.read_chunk(line[cut:] + ':a!b@c PRIVMSG #x :\xe9t\xe9\r\n')
+        self.assertEqual([e.unicode_text for e in events],
+                [u'\u00e9t\u00e9', u'\u00e9t\u00e9'])
+
+    def test_write_unicode(self):
+        with mock.patch.object(self.irc._sendq, 'push') as push:
+            self.irc.write_raw(u'TOPIC #x :\u00e9t\u00e9')
+        push.assert_called_once_with('TOPIC #x :\xc3\xa9t\xc3\xa9')
+
+    def test_line_metrics(self):
+        from iobot.irc import IrcConnection
+        from iobot.metrics import MetricsRegistry
+        registry = MetricsRegistry()
+        irc = IrcConnection(mock.Mock(), 'test', 'localhost', 6667, 'testie',
+                'iobot', 'iobot', 'owner', metrics=registry)
+        irc.read_lines(['PING :1', 'PING :2', ':a!b@c JOIN #chan'])
+        self.assertEqual(irc._lines_read.value, 3)
+        self.assertEqual(irc._parse_time.count, 3)
+        self.assertEqual(irc._event_counts['PING'].value, 2)
+        self.assertEqual(irc._event_counts['JOIN'].value, 1)
+        # the PONGs
+        self.assertEqual(irc._lines_written.value, 2)
+
+    def test_logger_per_server(self):
+        self.assertEqual(self.irc.logger.name, 'iobot.irc.test')
+
+    def test_capture(self):
+        self.irc.capture = mock.Mock()
+        self.irc.read_raw('PING :1\r\n')
+        self.assertEqual(self.irc.capture.write.call_args_list, [
+            mock.call('test', '<', 'PING :1'),
+            mock.call('test', '>', 'PONG :1')])
+
+    def test_names(self):
+        chan = '#testchan'
+        self.irc.add_channel(chan)
+        self.irc_in('353 {} = {}'.format(self.irc.nick, chan),
+                '{} @op +voice @+both plain'.format(self.irc.nick))
+        channel = self.irc.channels[chan]
+        self.assertEqual(len(channel), 5)
+        self.assertEqual(channel.modes('op'), 'o')
+        self.assertEqual(channel.modes('both'), 'ov')
+        self.assertEqual(channel.modes('plain'), '')
+        self.assertTrue('PLAIN' in self.irc.users)
+
+    def test_membership_tracking(self):
+        chan = '#testchan'
+        self.irc.add_channel(chan)
+        self.raw_irc_in(':joe!j@host JOIN :{}\r\n'.format(chan))
+        self.assertEqual(self.irc.users['joe'].host, 'host')
+        self.raw_irc_in(':op!o@host MODE {} +o-v joe joe\r\n'.format(chan))
+        self.assertEqual(self.irc.channels[chan].modes('joe'), 'o')
+        self.raw_irc_in(':joe!j@host NICK :moe\r\n')
+        self.assertTrue('moe' in self.irc.channels[chan])
+        self.raw_irc_in(':moe!j@host QUIT :bye\r\n')
+        self.assertFalse('moe' in self.irc.channels[chan])
+        self.assertFalse('moe' in self.irc.users)
+
+    def test_who(self):
+        chan = '#testchan'
+        self.irc.add_channel(chan)
+        self.irc_in('353 {} = {}'.format(self.irc.nick, chan), 'joe')
+        self.assertTrue(self.irc.users['joe'].host is None)
+        self.irc_in('352 {} {} ~j joe.host irc.server joe H'.format(
+            self.irc.nick, chan), '0 Joe')
+        self.assertEqual(self.irc.users['joe'].user, '~j')
+        self.assertEqual(self.irc.users['joe'].host, 'joe.host')
+
+    def test_pack_targets(self):
+        from iobot.irc import pack_targets
+        channels = ['#channel%03d' % i for i in range(100)]
+        lines = list(pack_targets('JOIN', channels))
+        self.assertEqual(len(lines), 3)
+        for line in lines:
+            self.assertTrue(len(line) + 2 <= 512)
+        joined = sum((l[len('JOIN '):].split(',') for l in lines), [])
+        self.assertEqual(joined, channels)
+
+    def test_pack_targets_targmax(self):
+        from iobot.irc import pack_targets
+        lines = list(pack_targets('PART', ['#a', '#b', '#c'], max_targets=2))
+        self.assertEqual(lines, ['PART #a,#b', 'PART #c'])
+
+    def test_split_text(self):
+        from iobot.irc import split_text
+        self.assertEqual(list(split_text('one two three', 8)),
+                ['one two', 'three'])
+        self.assertEqual(list(split_text('abcdefgh', 3)), ['abc', 'def', 'gh'])
+        # never cut a UTF-8 sequence in half
+        text = u'\u00e9\u00e9\u00e9'.encode('utf-8')
+        self.assertEqual(list(split_text(text, 3)), [text[:2], text[2:4],
+            text[4:]])
+        self.assertRaises(ValueError, list, split_text('abc', 0))
+
+    def test_isupport(self):
+        self.irc_in('005 {} CASEMAPPING=ascii PREFIX=(qov)~@+'.format(
+            self.irc.nick), 'are supported by this server')
+        self.assertEqual(self.irc.isupport.casemapping, 'ascii')
+        self.assertEqual(list(self.irc.state.prefixes),
+                [('~', 'q'), ('@', 'o'), ('+', 'v')])
+        self.assertEqual(self.irc.isupport.get('CASEMAPPING'), 'ascii')
+
+    def test_privmsg_split(self):
+        self.irc_in('005 {} LINELEN=200'.format(self.irc.nick),
+                'are supported by this server')
+        self.raw_irc_in(':{0}!~{0}@localhost JOIN :#hi\r\n'.format(
+            self.irc.nick))
+        with mock.patch.object(self.irc, 'write_raw') as write_raw:
+            self.irc.private_message('#hi', ' '.join(['word'] * 100) +
+                    '\nsecond line')
+        lines = [c[0][0] for c in write_raw.call_args_list]
+        relayed = ':{0}!~{0}@localhost '.format(self.irc.nick)
+        for line in lines:
+            self.assertTrue(line.startswith('PRIVMSG #hi :'))
+            self.assertTrue(len(relayed + line) + 2 <= 200)
+        self.assertEqual(lines[-1], 'PRIVMSG #hi :second line')
+        text = ' '.join(line[len('PRIVMSG #hi :'):] for line in lines[:-1])
+        self.assertEqual(text, ' '.join(['word'] * 100))
+
+    def test_privmsg_no_room(self):
+        # the prefix alone is longer than the line, the text still goes out
+        self.irc_in('005 {} LINELEN=20'.format(self.irc.nick),
+                'are supported by this server')
+        with mock.patch.object(self.irc, 'write_raw') as write_raw:
+            self.irc.private_message('#hi', 'hello there')
+        self.assertEqual([c[0][0] for c in write_raw.call_args_list],
+                ['PRIVMSG #hi :hell', 'PRIVMSG #hi :o', 'PRIVMSG #hi :ther',
+                    'PRIVMSG #hi :e'])
+
+    def test_privmsg_targmax(self):
+        with mock.patch.object(self.irc, 'write_raw') as write_raw:
+            self.irc.private_message(['#a', '#b', '#c'], 'hi')
+        self.assertEqual([c[0][0] for c in write_raw.call_args_list],
+                ['PRIVMSG #a :hi', 'PRIVMSG #b :hi', 'PRIVMSG #c :hi'])
+        self.irc_in('005 {} TARGMAX=PRIVMSG:2'.format(self.irc.nick),
+                'are supported by this server')
+        with mock.patch.object(self.irc, 'write_raw') as write_raw:
+            self.irc.private_message(['#a', '#b', '#c'], 'hi')
+        self.assertEqual([c[0][0] for c in write_raw.call_args_list],
+                ['PRIVMSG #a,#b :hi', 'PRIVMSG #c :hi'])
+
+    def test_rejoin_on_welcome(self):
+        self.irc.initial_channels = set(['#one'])
+        self.irc.add_channel('#ONE')
+        self.irc.add_channel('#two')
+        self.irc._stream.write.reset_mock()
+        self.irc_in('001 {}'.format(self.irc.nick), 'Welcome')
+        self.flush()
+        self.irc._stream.write.assert_called_once_with('JOIN #ONE,#two\r\n')
+
+    def test_resync_after_rejoin(self):
+        chan = '#testchan'
+        self.irc.add_channel(chan)
+        self.irc_in('353 {} = {}'.format(self.irc.nick, chan),
+                '{} gone @stays'.format(self.irc.nick))
+        self.raw_irc_in(':{0}!~{0}@localhost JOIN :{1}\r\n'.format(
+            self.irc.nick, chan))
+        self.irc_in('353 {} = {}'.format(self.irc.nick, chan),
+                '{} stays new'.format(self.irc.nick))
+        self.assertTrue('gone' in self.irc.channels[chan])
+        self.irc_in('366 {} {}'.format(self.irc.nick, chan), 'End of NAMES')
+        channel = self.irc.channels[chan]
+        self.assertFalse('gone' in channel)
+        self.assertFalse('gone' in self.irc.users)
+        self.assertEqual(sorted(channel.members),
+                sorted([self.irc.nick, 'stays', 'new']))
+
+    def test_cannot_join(self):
+        chan = '#testchan'
+        self.irc.add_channel(chan)
+        self.irc_in('474 {} {}'.format(self.irc.nick, chan),
+                'Cannot join channel (+b)')
+        self.assertFalse(chan in self.irc.channels)
+
+    def test_backoff(self):
+        from iobot.irc import RECONNECT_DELAY, RECONNECT_MAX_DELAY
+        self.irc.ioloop = mock.Mock()
+        self.irc.ioloop.time.return_value = 0
+        delays = []
+        for i in range(12):
+            self.irc.schedule_reconnect()
+            delays.append(self.irc.ioloop.add_timeout.call_args[0][0])
+        self.assertTrue(RECONNECT_DELAY / 2.0 <= delays[0] <= RECONNECT_DELAY)
+        self.assertTrue(delays[3] >= RECONNECT_DELAY * 4)
+        self.assertTrue(all(d <= RECONNECT_MAX_DELAY for d in delays))
+        self.assertTrue(delays[-1] >= RECONNECT_MAX_DELAY / 2.0)
+        self.irc_in('001 {}'.format(self.irc.nick), 'Welcome')
+        self.assertEqual(self.irc.reconnect_attempts, 0)
+
+    def test_keepalive_lag(self):
+        self.irc._stream.reset_mock()
+        self.irc.keepalive()
+        self.flush()
+        self.irc._stream.write.assert_called_with('PING :iobot-1\r\n')
+        self.irc_in('PONG faker.irc', 'iobot-1')
+        self.assertEqual(self.irc.lag.count, 1)
+        self.assertEqual(self.irc._pings, {})
+        # an unknown or repeated token is ignored
+        self.irc_in('PONG faker.irc', 'iobot-1')
+        self.assertEqual(self.irc.lag.count, 1)
+
+    def test_keepalive_pong_without_colon(self):
+        self.irc.keepalive()
+        self.raw_irc_in(':faker.irc PONG faker.irc iobot-1\r\n')
+        self.assertEqual(self.irc.lag.count, 1)
+        self.assertEqual(self.irc._pings, {})
+
+    def test_keepalive_prunes_pings(self):
+        now = self.irc.ioloop.time()
+        self.irc._pings['iobot-old'] = now - self.irc.ping_timeout - 1
+        self.irc._pings['iobot-new'] = now - 1
+        self.irc.keepalive()
+        self.assertEqual(sorted(self.irc._pings), ['iobot-1', 'iobot-new'])
+
+    def test_keepalive_timeout(self):
+        self.irc._stream.reset_mock()
+        self.irc.last_read = self.irc.ioloop.time() - self.irc.ping_timeout - 1
+        self.irc.keepalive()
+        self.irc._stream.close.assert_called_with()
+        self.assertEqual(self.irc._pings, {})
+
+    def test_keepalive_stops_on_close(self):
+        self.assertTrue(self.irc._keepalive is not None)
+        self.irc.reconnect = False
+        self.irc._on_close(self.irc._stream)
+        self.assertTrue(self.irc._keepalive is None)
+
+    def test_disconnect(self):
+        stream = self.irc._stream
+        stream.reset_mock()
+        self.irc.write_raw('PRIVMSG #chan :queued')
+        self.irc.disconnect('bye')
+        self.assertFalse(self.irc.reconnect)
+        stream.write.assert_called_once_with('QUIT :bye\r\n',
+                callback=stream.close)
+        self.assertEqual(len(self.irc._sendq), 0)
+
+
+class TestCapabilities(AsyncTestCase):
+    @mock.patch('iobot.irc.IrcConnection.connect', _patched_connect)
+    def connect(self, **kwargs):
+        from iobot.irc import IrcConnection
+        self.irc = IrcConnection(mock.Mock(), 'test', 'localhost', 6667,
+                'testie', 'iobot', 'iobot', 'owner', flood_rate=0, **kwargs)
+        self.irc.connect()
+        return self.written()
+
+    def written(self):
+        self.io_loop.add_callback(self.stop)
+        self.wait()
+        data = ''.join(c[0][0] for c in self.irc._stream.write.call_args_list)
+        self.irc._stream.write.reset_mock()
+        return data.splitlines()
+
+    def test_negotiate(self):
+        self.assertEqual(self.connect(),
+                ['CAP LS 302', 'NICK testie', 'USER iobot 0 * :iobot'])
+        self.irc.read_raw(':irc CAP * LS * :multi-prefix sasl=PLAIN chghost')
+        self.assertEqual(self.written(), [])
+        self.irc.read_raw(':irc CAP * LS :batch server-time')
+        self.assertEqual(self.written(),
+                ['CAP REQ :batch multi-prefix server-time'])
+        self.irc.read_raw(':irc CAP * ACK :batch multi-prefix server-time')
+        self.assertEqual(self.written(), ['CAP END'])
+        self.assertEqual(self.irc.caps,
+                set(['batch', 'multi-prefix', 'server-time']))
+        self.irc.read_raw(':irc CAP testie DEL :batch')
+        self.irc.read_raw(':irc CAP testie NEW :away-notify')
+        self.assertEqual(self.written(), ['CAP REQ :away-notify'])
+        self.assertFalse('batch' in self.irc.caps)
+
+    def test_sasl(self):
+        self.assertEqual(self.connect(password='hunter2', sasl=True),
+                ['CAP LS 302', 'NICK testie', 'USER iobot 0 * :iobot'])
+        self.irc.read_raw(':irc CAP * LS :sasl=PLAIN,EXTERNAL')
+        self.assertEqual(self.written(), ['CAP REQ :sasl'])
+        self.irc.read_raw(':irc CAP * ACK :sasl')
+        self.assertEqual(self.written(), ['AUTHENTICATE PLAIN'])
+        self.irc.read_raw('AUTHENTICATE +')
+        self.assertEqual(self.written(), ['AUTHENTICATE %s' %
+            'testie\0testie\0hunter2'.encode('base64').strip()])
+        self.irc.read_raw(':irc 903 testie :SASL authentication successful')
+        self.assertEqual(self.written(), ['CAP END'])
+
+    def test_sasl_failure(self):
+        self.connect(password='hunter2', account='nod', sasl=True)
+        self.irc.read_raw(':irc CAP * LS :sasl')
+        self.irc.read_raw(':irc CAP * ACK :sasl')
+        self.irc.read_raw('AUTHENTICATE +')
+        self.assertEqual(self.written()[-1], 'AUTHENTICATE %s' %
+            'nod\0nod\0hunter2'.encode('base64').strip())
+        self.irc.read_raw(':irc 904 testie :SASL authentication failed')
+        self.assertEqual(self.written(), ['CAP END'])
+
+    def test_pass_fallback(self):
+        self.connect(password='hunter2', sasl=True)
+        self.irc.read_raw(':irc CAP * LS :multi-prefix')
+        self.assertEqual(self.written(),
+                ['PASS hunter2', 'CAP REQ :multi-prefix'])
+
+    def test_sasl_nak(self):
+        self.connect(password='hunter2', sasl=True)
+        self.irc.read_raw(':irc CAP * LS :multi-prefix sasl')
+        self.assertEqual(self.written(), ['CAP REQ :multi-prefix sasl'])
+        self.irc.read_raw(':irc CAP * NAK :multi-prefix sasl')
+        self.assertEqual(self.written(), ['PASS hunter2', 'CAP END'])
+
+    def test_pass_without_cap(self):
+        # sasl is opt in, PASS goes first so servers without CAP get it
+        self.assertEqual(self.connect(password='hunter2'),
+                ['PASS hunter2', 'CAP LS 302', 'NICK testie',
+                    'USER iobot 0 * :iobot'])
+        self.irc.read_raw(':irc 421 testie CAP :Unknown command')
+        self.assertEqual(self.written(), [])
+
+        self.connect(password='hunter2', sasl=True)
+        self.irc.read_raw(':irc 421 testie CAP :Unknown command')
+        self.assertEqual(self.written(), ['PASS hunter2'])
+        self.assertFalse(self.irc.sasl)
+        self.irc._register()
+        self.assertEqual(self.written()[:2], ['PASS hunter2', 'CAP LS 302'])
+
+    def test_no_cap(self):
+        self.connect()
+        self.irc.read_raw(':irc 421 testie CAP :Unknown command')
+        self.irc.read_raw(':irc 001 testie :Welcome')
+        self.irc.read_raw(':irc CAP testie NAK :batch')
+        self.assertEqual(self.written(), [])
+
+    def test_batch(self):
+        self.connect()
+        irc = self.irc
+        irc.read_raw(':testie!i@h JOIN #chan')
+        irc.read_raw(':irc 353 testie = #chan :testie a b c')
+        irc.read_raw(':irc 366 testie #chan :End of /NAMES list.')
+        irc.bot.process_hooks.reset_mock()
+        irc.read_raw(':irc BATCH +split netsplit irc.hub other.host')
+        irc.read_raw('@batch=split :a!a@h QUIT :irc.hub other.host')
+        irc.read_raw('@batch=split :irc BATCH +inner netsplit irc.hub '
+                'third.host')
+        irc.read_raw('@batch=inner :b!b@h QUIT :irc.hub third.host')
+        irc.read_raw('@batch=split :irc BATCH -inner')
+        self.assertEqual(len(irc.channels['#chan']), 4)
+        irc.read_raw(':irc BATCH -split')
+        self.assertEqual(sorted(irc.channels['#chan'].members),
+                ['c', 'testie'])
+        hooked = [c[0][1].type for c in irc.bot.process_hooks.call_args_list]
+        self.assertEqual(hooked, ['BATCH', 'BATCH', 'BATCH', 'QUIT', 'QUIT',
+            'BATCH'])
+
+    def test_away(self):
+        self.connect()
+        irc = self.irc
+        irc.read_raw(':testie!i@h JOIN #chan')
+        irc.read_raw(':a!a@h JOIN #chan')
+        irc.read_raw(':a!a@h AWAY :lunch')
+        self.assertEqual(irc.users['a'].away, 'lunch')
+        irc.read_raw(':a!a@h AWAY')
+        self.assertEqual(irc.users['a'].away, None)
+        irc.read_raw(':irc 352 testie #chan a h irc a G :0 A')
+        self.assertEqual(irc.users['a'].away, '')
+
+class TestReconnect(AsyncTestCase):
+    def test_reconnect_after_close(self):
+        from tornado.concurrent import Future
+        from tornado.tcpserver import TCPServer
+        from tornado.testing import bind_unused_port
+        from iobot.irc import IrcConnection
+
+        accepted = []
+        class HangUpServer(TCPServer):
+            def handle_stream(self, stream, address):
+                accepted.append(stream)
+                stream.close()
+        sock, port = bind_unused_port()
+        server = HangUpServer()
+        server.add_socket(sock)
+
+        def submit(fn, *args):
+            f = Future()
+            f.set_result(fn(*args))
+            return f
+        bot = mock.Mock()
+        bot.submit = submit
+        irc = IrcConnection(bot, 'test', '127.0.0.1', port, 'testie', 'iobot',
+                'iobot', 'owner')
+        irc.schedule_reconnect = lambda: self.stop('scheduled')
+        irc.connect()
+        self.assertEqual(self.wait(), 'scheduled')
+        self.assertEqual(len(accepted), 1)
+        self.assertTrue(irc._stream is None)
+        server.stop()
+
+    def test_resolve_failure(self):
+        from tornado.concurrent import Future
+        from iobot.executor import ExecutorError
+        from iobot.irc import IrcConnection
+        failed = Future()
+        failed.set_exception(ExecutorError('A pool worker process died'))
+        bot = mock.Mock()
+        bot.submit.return_value = failed
+        irc = IrcConnection(bot, 'test', 'irc.example.net', 6667, 'testie',
+                'iobot', 'iobot', 'owner')
+        irc.schedule_reconnect = mock.Mock()
+        irc.connect()
+        irc.schedule_reconnect.assert_called_once_with()
+        self.assertTrue(irc._stream is None)
+
+    def test_disconnect_while_resolving(self):
+        from tornado.concurrent import Future
+        from iobot.irc import IrcConnection
+        resolving = Future()
+        bot = mock.Mock()
+        bot.submit.return_value = resolving
+        irc = IrcConnection(bot, 'test', '127.0.0.1', 6667, 'testie',
+                'iobot', 'iobot', 'owner')
+        irc.connect()
+        irc.disconnect()
+        with mock.patch('socket.socket') as sock:
+            resolving.set_result([(socket.AF_INET, socket.SOCK_STREAM, 0, '',
+                ('127.0.0.1', 6667))])
+        self.assertFalse(sock.called)
+        self.assertTrue(irc._stream is None)
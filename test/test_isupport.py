@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+class TestServerSupport(TestCase):
+    def makeOne(self, *params):
+        from iobot.isupport import ServerSupport
+        support = ServerSupport()
+        support.update(params)
+        return support
+
+    def test_defaults(self):
+        support = self.makeOne()
+        self.assertEqual(support.linelen, 512)
+        self.assertEqual(support.casemapping, None)
+        self.assertEqual(support.prefixes, None)
+        self.assertEqual(support.chanmodes, ('beI', 'k', 'l', 'imnpst'))
+        self.assertEqual(support.targmax('PRIVMSG'), 1)
+        self.assertEqual(support.targmax('JOIN'), None)
+
+    def test_update(self):
+        from iobot.isupport import ServerSupport
+        support = ServerSupport()
+        self.assertEqual(support.update(['CASEMAPPING=ascii', 'EXCEPTS']),
+                set(['CASEMAPPING', 'EXCEPTS']))
+        self.assertEqual(support.get('EXCEPTS'), '')
+        self.assertEqual(support.update(['CASEMAPPING=ascii']), set())
+        self.assertEqual(support.update(['-EXCEPTS', '-NOPE']),
+                set(['EXCEPTS']))
+        self.assertFalse('EXCEPTS' in support)
+
+    def test_escaped_value(self):
+        support = self.makeOne(r'NETWORK=Example\x20Net')
+        self.assertEqual(support.get('NETWORK'), 'Example Net')
+
+    def test_prefixes(self):
+        self.assertEqual(self.makeOne('PREFIX=(qov)~@+').prefixes,
+                [('~', 'q'), ('@', 'o'), ('+', 'v')])
+        self.assertEqual(self.makeOne('PREFIX=').prefixes, [])
+        self.assertEqual(self.makeOne('PREFIX=(ov)@').prefixes, [])
+
+    def test_targmax(self):
+        support = self.makeOne('TARGMAX=PRIVMSG:4,NOTICE:3,JOIN:,KICK:1')
+        self.assertEqual(support.targmax('privmsg'), 4)
+        self.assertEqual(support.targmax('JOIN'), None)
+        self.assertEqual(support.targmax('KICK'), 1)
+        self.assertEqual(self.makeOne('MAXTARGETS=5').targmax('NOTICE'), 5)
+
+    def test_linelen(self):
+        self.assertEqual(self.makeOne('LINELEN=2048').linelen, 2048)
+        self.assertEqual(self.makeOne('LINELEN=lots').linelen, 512)
+
+    def test_chanmodes(self):
+        self.assertEqual(self.makeOne('CHANMODES=beIq,k,flj,CDimnpst').chanmodes,
+                ('beIq', 'k', 'flj', 'CDimnpst'))
+        self.assertEqual(self.makeOne('CHANMODES=b,k').chanmodes,
+                ('b', 'k', '', ''))
@@ -0,0 +1,166 @@
+import sys, os.path
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+
+import pickle
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+import mock
+
+from iobot.plugins import markov_bot, markov_brain
+from iobot.plugins.markov_brain import MarkovBrain, trigrams
+
+class TestMarkovBrain(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'brain.db')
+        self.brain = MarkovBrain(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def learn(self, brain, *lines):
+        for line in lines:
+            brain.add_line_to_index(line.split())
+        return brain.write()
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams(['a', 'b']),
+                [('', '', 'a'), ('', 'a', 'b'), ('a', 'b', '')])
+
+    def test_batched(self):
+        self.brain.add_line_to_index('hello there'.split())
+        self.assertEqual(self.brain.generate(), [])
+        self.assertEqual(self.brain.write(), 1)
+        self.assertEqual(self.brain.pending, [])
+        self.assertEqual(self.brain.generate(), ['hello', 'there'])
+
+    def test_relevant_terms(self):
+        self.learn(self.brain, 'the cat sat on the mat',
+                'a dog barked at the mailman')
+        for i in range(10):
+            self.assertEqual(self.brain.generate(relevant_terms=['dog']),
+                    'a dog barked at the mailman'.split())
+        self.assertTrue(len(self.brain.generate(['unknown'])) > 0)
+
+    def test_score(self):
+        self.learn(self.brain, 'a b c', 'a b d', 'a b d')
+        rare = self.brain.score_for_line(['a', 'b', 'c'])
+        common = self.brain.score_for_line(['a', 'b', 'd'])
+        self.assertTrue(rare > common > 0)
+
+    def test_score_lines(self):
+        self.learn(self.brain, 'a b c', 'a b d', 'a b d', 'x y')
+        lines = [('a', 'b', 'c'), (), ('a', 'b', 'd'), ('x', 'y'), ('q',)]
+        scores = self.brain.score_lines(lines)
+        self.assertEqual(scores[1], 0.0)
+        self.assertEqual(scores[4], 0.0)
+        with mock.patch.object(markov_brain, 'numpy', None):
+            plain = self.brain.score_lines(lines)
+        for a, b in zip(scores, plain):
+            self.assertAlmostEqual(a, b)
+
+    def test_reply(self):
+        self.learn(self.brain, 'the cat sat', 'the cat ran')
+        self.assertTrue(' '.join(self.brain.reply(['cat'])) in
+                ('the cat sat', 'the cat ran'))
+        self.assertEqual(MarkovBrain(os.path.join(self.dir, 'empty.db')
+            ).reply(['cat']), [])
+        with mock.patch.object(self.brain, 'generate',
+                wraps=self.brain.generate) as generate:
+            self.brain.reply(['cat'], candidates=100, batch=10, threshold=0)
+        self.assertEqual(generate.call_count, 10)
+
+    def test_flush_and_prefix(self):
+        self.learn(self.brain, 'old news')
+        self.brain.flush()
+        self.assertEqual(self.brain.generate(), [])
+        self.learn(self.brain, 'new news')
+        self.brain.prefix = 'other'
+        self.assertEqual(self.brain.generate(), [])
+        self.brain.prefix = 'irc'
+        self.assertEqual(self.brain.generate(), ['new', 'news'])
+        self.assertEqual(self.brain.purge(), 3)
+        self.assertEqual(self.brain.generate(), ['new', 'news'])
+
+    def test_first_namespace_created_once(self):
+        # every brain is its own connection, as on the executor's threads
+        brains = [MarkovBrain(self.path, prefix='new') for _ in range(8)]
+        namespaces = []
+        threads = [threading.Thread(target=lambda b=b: namespaces.append(
+            b.namespace())) for b in brains]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(set(namespaces)), 1)
+        self.assertEqual(self.brain.db.execute('SELECT count(*) FROM namespaces'
+            ' WHERE name = ?', ('new',)).fetchone()[0], 1)
+
+    def test_survives_restart(self):
+        self.learn(self.brain, 'still here')
+        brain = MarkovBrain(self.path)
+        self.assertEqual(brain.generate(), ['still', 'here'])
+        brain = pickle.loads(pickle.dumps(self.brain))
+        self.assertEqual(brain.generate(), ['still', 'here'])
+
+class TestMarkovPlugin(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir, 'brain.db')
+        with mock.patch.object(markov_bot, 'BRAIN_PATH', path):
+            self.plugin = markov_bot.MarkovPlugin()
+        self.conn = mock.Mock(owners=['owner'])
+        bot = self.conn.bot
+        # the executor and the IOLoop, inline
+        bot.submit.side_effect = self.submit
+        bot.ioloop.add_future.side_effect = lambda future, callback: callback(
+                future)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def submit(self, fn, *args):
+        from tornado.concurrent import Future
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def admin(self, text):
+        from iobot.event import IrcEvent
+        event = IrcEvent('bot', ':owner!o@h PRIVMSG #c :bot: %s' % text)
+        getattr(self.plugin, event.command)(self.conn, event)
+
+    def test_flush_brain(self):
+        brain = self.plugin.markov
+        brain.add_line_to_index(['old', 'news'])
+        brain.write()
+        brain.add_line_to_index(['unwritten'])
+        # a process pool flushes a copy, the plugin's brain must follow
+        flush = markov_bot.flush_brain
+        with mock.patch.object(markov_bot, 'flush_brain', lambda b, prefix:
+                flush(pickle.loads(pickle.dumps(b)), prefix)):
+            self.admin('flush_brain')
+        self.assertEqual(brain.pending, [])
+        self.assertEqual(brain.namespace(), MarkovBrain(brain.path).namespace())
+        self.assertEqual(brain.generate(), [])
+        self.assertEqual(brain.db.execute('SELECT count(*) FROM chain'
+            ).fetchone()[0], 0)
+
+    def test_flush_brain_logs_error(self):
+        self.conn.bot.submit.side_effect = lambda fn, *args: self.submit(
+                mock.Mock(side_effect=IOError('disk full')))
+        with mock.patch('logging.Logger.exception') as exception:
+            self.admin('flush_brain')
+        exception.assert_called_once_with('Error flushing markov brain')
+
+    def test_stop_writes_pending(self):
+        self.plugin.markov.add_line_to_index(['not', 'lost'])
+        self.plugin.stop()
+        brain = MarkovBrain(self.plugin.markov.path)
+        self.assertEqual(brain.generate(), ['not', 'lost'])
@@ -0,0 +1,126 @@
+import sys, os.path
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+
+from unittest import TestCase, skipIf
+
+import mock
+
+from iobot.plugins import markov_bot
+from iobot.plugins.markov_bot import tokenize_line
+
+# what nltk.word_tokenize followed by the old untokenize_special_characters
+# gave for these lines
+GOLDEN = [
+    ('hello world',
+        ['hello', 'world']),
+    ('hello, world',
+        ['hello,', 'world']),
+    ("I don't know what you mean",
+        ['I', 'do', "n't", 'know', 'what', 'you', 'mean']),
+    ("can't stop won't stop",
+        ['ca', "n't", 'stop', 'wo', "n't", 'stop']),
+    ('you cannot be serious',
+        ['you', 'can', 'not', 'be', 'serious']),
+    ("i'm gonna do it",
+        ["i'm", 'gon', 'na', 'do', 'it']),
+    ('we gotta go',
+        ['we', 'got', 'ta', 'go']),
+    ('lemme see that',
+        ['lem', 'me', 'see', 'that']),
+    ('gimme the thing',
+        ['gim', 'me', 'the', 'thing']),
+    ('i wanna know',
+        ['i', 'wan', 'na', 'know']),
+    ("that's the dog's bone",
+        ["that's", 'the', "dog's", 'bone']),
+    ("they're here and we'll see",
+        ["they're", 'here', 'and', "we'll", 'see']),
+    ('hey iobot how are you',
+        ['hey', 'iobot', 'how', 'are', 'you']),
+    ('is this a question',
+        ['is', 'this', 'a', 'question']),
+    ('this costs 5 dollars',
+        ['this', 'costs', '5', 'dollars']),
+    ('it is 3:45 right now',
+        ['it', 'is', '3:45', 'right', 'now']),
+    ('ok , fine',
+        ['ok', ',', 'fine']),
+    ('what - really',
+        ['what', '-', 'really']),
+    ("I'd've gone",
+        ["I'd've", 'gone']),
+    ('lol what',
+        ['lol', 'what']),
+    ('yes.',
+        ['yes.']),
+    ('no way!',
+        ['no', 'way!']),
+    ("it's fine, really it's fine",
+        ["it's", 'fine,', 'really', "it's", 'fine']),
+    ('so i said to him , go away',
+        ['so', 'i', 'said', 'to', 'him', ',', 'go', 'away']),
+    ('hmm',
+        ['hmm']),
+    ('100% sure',
+        ['100%', 'sure']),
+    ('we can not do that',
+        ['we', 'can', 'not', 'do', 'that']),
+    ("I haven't seen it",
+        ['I', 'have', "n't", 'seen', 'it']),
+    ("didn't you hear",
+        ['did', "n't", 'you', 'hear']),
+    ("c'mon man",
+        ["c'mon", 'man']),
+    ("y'all are crazy",
+        ["y'all", 'are', 'crazy']),
+    ]
+
+# lines the old tokenizer crashed on, or glued by matching the token as a
+# regex anywhere in the line
+FIXED = [
+    ('check http://example.com/foo out',
+        ['check', 'http://example.com/foo', 'out']),
+    ('email me at foo@example.com', ['email', 'me', 'at', 'foo@example.com']),
+    ('really?', ['really?']),
+    ('(what) [is] this*', ['(what)', '[is]', 'this*']),
+    ('"quoted" words', ['"quoted"', 'words']),
+    ("(don't)", ['(do', "n't)"]),
+    ('wait... what', ['wait...', 'what']),
+    ('x = y + z', ['x', '=', 'y', '+', 'z']),
+    ("rock 'n' roll", ['rock', "'n'", 'roll']),
+    ('', []),
+    ]
+
+class TestTokenizeLine(TestCase):
+    def test_golden(self):
+        for line, tokens in GOLDEN:
+            self.assertEqual(tokenize_line(line), tokens, line)
+
+    def test_fixed(self):
+        for line, tokens in FIXED:
+            self.assertEqual(tokenize_line(line), tokens, line)
+
+    @skipIf(not markov_bot.load_nltk(), 'nltk is not installed')
+    def test_high_fidelity(self):
+        for line, tokens in GOLDEN + FIXED:
+            self.assertEqual(tokenize_line(line, high_fidelity=True), tokens,
+                    line)
+
+class TestTokenizerCommand(TestCase):
+    @mock.patch('iobot.plugins.markov_bot.MarkovBrain', mock.Mock())
+    def setUp(self):
+        self.plugin = markov_bot.MarkovPlugin()
+        self.conn = mock.Mock(owners=['owner'])
+
+    def admin(self, text):
+        from iobot.event import IrcEvent
+        event = IrcEvent('bot', ':owner!o@h PRIVMSG #c :bot: %s' % text)
+        getattr(self.plugin, event.command)(self.conn, event)
+
+    @mock.patch('iobot.plugins.markov_bot.load_nltk', lambda: True)
+    def test_learn_keeps_tokenizer(self):
+        self.admin('tokenizer nltk')
+        self.assertTrue(self.plugin.high_fidelity)
+        self.admin('learn_markov')
+        self.assertTrue(self.plugin.high_fidelity)
+        self.assertFalse(self.plugin.dumb)
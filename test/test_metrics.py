@@ -0,0 +1,63 @@
+import sys, os.path
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+
+from unittest import TestCase
+
+from iobot.metrics import (Histogram, MetricsRegistry, NULL_METRIC,
+        prometheus_text, summary_line)
+
+class TestHistogram(TestCase):
+    def test_observe(self):
+        h = Histogram(buckets=(0.1, 1.0))
+        self.assertEqual(h.quantile(0.5), None)
+        for value in (0.05, 0.1, 0.5, 3.0):
+            h.observe(value)
+        self.assertEqual(h.counts, [2, 1, 1])
+        self.assertEqual(h.cumulative(),
+                [(0.1, 2), (1.0, 3), (float('inf'), 4)])
+        self.assertEqual(h.quantile(0.5), 0.1)
+        self.assertEqual(h.quantile(0.75), 1.0)
+        self.assertEqual(h.quantile(1.0), float('inf'))
+        self.assertAlmostEqual(h.mean(), 0.9125)
+        self.assertEqual(h.last, 3.0)
+
+class TestMetricsRegistry(TestCase):
+    def test_labels(self):
+        registry = MetricsRegistry()
+        a = registry.counter('lines_total', server='a')
+        self.assertTrue(registry.counter('lines_total', server='a') is a)
+        b = registry.counter('lines_total', server='b')
+        a.inc()
+        b.inc(2)
+        [(name, kind, help, series)] = registry.collect()
+        self.assertEqual((name, kind), ('lines_total', 'counter'))
+        self.assertEqual([(labels, m.value) for labels, m in series],
+                [((('server', 'a'),), 1), ((('server', 'b'),), 2)])
+
+    def test_disabled(self):
+        registry = MetricsRegistry(enabled=False)
+        self.assertTrue(registry.counter('lines_total') is NULL_METRIC)
+        self.assertTrue(registry.histogram('latency') is NULL_METRIC)
+        lag = Histogram()
+        self.assertTrue(registry.register('lag', lag) is lag)
+        NULL_METRIC.inc()
+        NULL_METRIC.observe(1.0)
+        self.assertEqual(registry.collect(), [])
+
+    def test_prometheus_text(self):
+        registry = MetricsRegistry()
+        registry.counter('lines_total', 'lines read', server='a"b').inc(3)
+        registry.histogram('parse_seconds', buckets=(0.1,)).observe(0.05)
+        self.assertEqual(prometheus_text(registry).splitlines(), [
+            '# HELP lines_total lines read',
+            '# TYPE lines_total counter',
+            'lines_total{server="a\\"b"} 3',
+            '# TYPE parse_seconds histogram',
+            'parse_seconds_bucket{le="0.1"} 1',
+            'parse_seconds_bucket{le="+Inf"} 1',
+            'parse_seconds_sum 0.05',
+            'parse_seconds_count 1',
+            ])
+        self.assertEqual(summary_line(registry),
+                'lines_total{server="a\\"b"}=3 '
+                'parse_seconds=1/0.0500s/p99<=0.1s')
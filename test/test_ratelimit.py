@@ -0,0 +1,88 @@
+import sys, os.path
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+
+from unittest import TestCase
+
+import mock
+
+from iobot.event import IrcEvent
+from iobot.ratelimit import RateLimiter
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestRateLimiter(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_burst_then_rate(self):
+        limiter = RateLimiter(0.5, burst=2, clock=self.clock)
+        self.assertTrue(limiter.allow('a'))
+        self.assertTrue(limiter.allow('a'))
+        self.assertFalse(limiter.allow('a'))
+        self.assertTrue(limiter.allow('b'))
+        self.clock.now += 2
+        self.assertTrue(limiter.allow('a'))
+        self.assertFalse(limiter.allow('a'))
+
+    def test_penalty(self):
+        limiter = RateLimiter(1, burst=1, penalty=10, clock=self.clock)
+        self.assertTrue(limiter.allow('a'))
+        self.assertFalse(limiter.allow('a'))
+        self.clock.now += 9
+        # still penalised, and trying again starts the penalty over
+        self.assertFalse(limiter.allow('a'))
+        self.clock.now += 10.5
+        self.assertTrue(limiter.allow('a'))
+
+    def test_sweep(self):
+        limiter = RateLimiter(1, burst=5, clock=self.clock,
+                sweep_interval=60)
+        for i in range(100):
+            limiter.allow(i)
+        self.assertEqual(len(limiter), 100)
+        self.clock.now += 30
+        limiter.allow('busy')
+        self.assertEqual(len(limiter), 101)
+        self.clock.now += 30
+        limiter.allow('busy')
+        self.assertEqual(list(limiter.buckets), ['busy'])
+
+class TestRateLimited(TestCase):
+    def test_decorator(self):
+        from iobot.plugins.decorators import plugin_command, rate_limited
+        calls = []
+        class Plugin(object):
+            @rate_limited(0.001, burst=2)
+            @plugin_command
+            def hello(self, conn, event):
+                calls.append(event.nick)
+
+            @rate_limited(0.001, per='channel')
+            def topic(self, conn, event):
+                calls.append(event.destination)
+        self.assertTrue(Plugin.hello.cmd)
+        conn = mock.Mock()
+        conn.server_name = 'test'
+        conn.is_me.side_effect = lambda nick: nick == 'bot'
+        plugin = Plugin()
+        a = IrcEvent('bot', ':a!u@h PRIVMSG #c :hi')
+        renamed = IrcEvent('bot', ':b!u@h PRIVMSG #c :hi')
+        other = IrcEvent('bot', ':c!x@y PRIVMSG #d :hi')
+        for event in (a, renamed, a, other):
+            plugin.hello(conn, event)
+        self.assertEqual(calls, ['a', 'b', 'c'])
+        self.assertTrue(conn.logger.warning.called)
+        del calls[:]
+        for event in (a, other, renamed):
+            plugin.topic(conn, event)
+        self.assertEqual(calls, ['#c', '#d'])
+        # private messages are limited per sender, not all together
+        del calls[:]
+        for source in ('a!u@h', 'c!x@y', 'b!u@h'):
+            plugin.topic(conn, IrcEvent('bot', ':%s PRIVMSG bot :hi' % source))
+        self.assertEqual(calls, ['bot', 'bot'])
@@ -0,0 +1,85 @@
+from unittest import TestCase
+
+import mock
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestTokenBucket(TestCase):
+    def makeOne(self, rate=0.5, burst=2):
+        from iobot.sendq import TokenBucket
+        self.clock = FakeClock()
+        return TokenBucket(rate, burst, clock=self.clock)
+
+    def test_burst(self):
+        bucket = self.makeOne()
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+        self.assertEqual(bucket.delay(), 2.0)
+
+    def test_refill(self):
+        bucket = self.makeOne()
+        bucket.consume()
+        bucket.consume()
+        self.clock.now += 2
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+        self.clock.now += 100
+        bucket.refill()
+        self.assertEqual(bucket.tokens, 2)
+
+class TestSendQueue(TestCase):
+    def makeOne(self, rate=0.5, burst=2):
+        from iobot.sendq import SendQueue
+        self.ioloop = mock.Mock()
+        self.ioloop.time.return_value = 0
+        self.write = mock.Mock()
+        return SendQueue(self.ioloop, self.write, rate, burst)
+
+    def test_push_schedules_one_flush(self):
+        q = self.makeOne()
+        q.push('PRIVMSG #a :one')
+        q.push('PRIVMSG #a :two')
+        self.ioloop.add_callback.assert_called_once_with(q.flush)
+        q.flush()
+        self.write.assert_called_once_with(
+                'PRIVMSG #a :one\r\nPRIVMSG #a :two\r\n')
+        self.assertEqual(len(q), 0)
+        self.assertFalse(self.ioloop.add_timeout.called)
+
+    def test_priority_lanes(self):
+        q = self.makeOne(burst=3)
+        q.push('PRIVMSG #a :one')
+        q.push('JOIN #b')
+        q.push('PONG :irc.server')
+        q.flush()
+        self.write.assert_called_once_with(
+                'PONG :irc.server\r\nJOIN #b\r\nPRIVMSG #a :one\r\n')
+
+    def test_flood_control(self):
+        q = self.makeOne()
+        for i in range(4):
+            q.push('PRIVMSG #a :%d' % i)
+        q.flush()
+        self.write.assert_called_once_with('PRIVMSG #a :0\r\nPRIVMSG #a :1\r\n')
+        self.assertEqual(len(q), 2)
+        self.assertTrue(self.ioloop.add_timeout.called)
+        # a pong queued while we're throttled still goes first
+        q.push('PONG :irc.server')
+        self.assertEqual(self.ioloop.add_callback.call_count, 1)
+        q.bucket.tokens = 1
+        q.flush()
+        self.write.assert_called_with('PONG :irc.server\r\n')
+
+    def test_unlimited(self):
+        q = self.makeOne(rate=0)
+        for i in range(50):
+            q.push('PRIVMSG #a :%d' % i)
+        q.flush()
+        self.assertEqual(self.write.call_count, 1)
+        self.assertEqual(len(q), 0)
@@ -0,0 +1,81 @@
+import sys, os.path
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+
+from multiprocessing import Pipe
+from unittest import TestCase
+
+import mock
+from tornado.testing import AsyncTestCase
+
+from iobot.shard import ShardLink, Supervisor, shard_servers
+
+SERVERS = {
+    'efnet': {'address': 'irc.efnet.org'},
+    'freenode1': {'address': 'a.freenode.net', 'network': 'freenode'},
+    'freenode2': {'address': 'b.freenode.net', 'network': 'freenode'},
+    'oftc': {'address': 'irc.oftc.net'},
+    }
+
+class TestShardServers(TestCase):
+    def test_networks_stay_together(self):
+        groups = shard_servers(SERVERS, 2)
+        self.assertEqual(len(groups), 2)
+        self.assertEqual(sorted(groups[0]), ['freenode1', 'freenode2'])
+        self.assertEqual(sorted(groups[1]), ['efnet', 'oftc'])
+
+    def test_more_shards_than_networks(self):
+        groups = shard_servers(SERVERS, 8)
+        self.assertEqual(len(groups), 3)
+        self.assertEqual(sum(len(g) for g in groups), 4)
+
+class TestSupervisor(TestCase):
+    def setUp(self):
+        self.supervisor = Supervisor(SERVERS, 3, None)
+        self.supervisor.pipes = [mock.Mock() for _ in range(3)]
+
+    def test_broadcast(self):
+        self.supervisor.handle_message(0,
+                ('broadcast', None, 'load_plugin', ('admin',)))
+        self.assertFalse(self.supervisor.pipes[0].send.called)
+        for pipe in self.supervisor.pipes[1:]:
+            pipe.send.assert_called_once_with(('load_plugin', ('admin',)))
+
+    def test_route(self):
+        owner = self.supervisor.owners['oftc']
+        self.supervisor.handle_message(0,
+                ('route', 'oftc', 'write_to', ('oftc', 'PRIVMSG #c :hi')))
+        for i, pipe in enumerate(self.supervisor.pipes):
+            self.assertEqual(pipe.send.called, i == owner)
+
+    def test_reload(self):
+        servers = dict(SERVERS)
+        del servers['efnet']
+        servers['freenode3'] = {'network': 'freenode'}
+        servers['undernet'] = {}
+        before = dict(self.supervisor.owners)
+        self.supervisor.reload(servers)
+        owners = self.supervisor.owners
+        self.assertFalse('efnet' in owners)
+        self.assertEqual(owners['freenode3'], before['freenode1'])
+        self.assertEqual(owners['oftc'], before['oftc'])
+        self.assertEqual(sum(len(g) for g in self.supervisor.groups), 5)
+        for index, pipe in enumerate(self.supervisor.pipes):
+            pipe.send.assert_called_once_with(('apply_config',
+                (self.supervisor.groups[index],)))
+
+class TestShardLink(AsyncTestCase):
+    def test_calls_bot(self):
+        bot = mock.Mock()
+        bot.unload_plugin.side_effect = lambda name: self.stop(name)
+        supervisor_end, worker_end = Pipe()
+        ShardLink(bot, worker_end, self.io_loop)
+        self.assertTrue(bot.shard is not None)
+        supervisor_end.send(('shutdown', ()))
+        supervisor_end.send(('unload_plugin', ('markov_bot',)))
+        self.assertEqual(self.wait(), 'markov_bot')
+        self.assertFalse(bot.shutdown.called)
+
+        bot.shard.broadcast('load_plugin', ('admin',))
+        self.assertEqual(supervisor_end.recv(),
+                ('broadcast', None, 'load_plugin', ('admin',)))
+        self.io_loop.remove_handler(worker_end.fileno())
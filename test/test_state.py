@@ -0,0 +1,146 @@
+from unittest import TestCase
+
+class TestCaseMappedDict(TestCase):
+    def test_rfc1459(self):
+        from iobot.state import CaseMappedDict
+        d = CaseMappedDict('rfc1459')
+        d['Nick[away]'] = 1
+        self.assertTrue('nick{AWAY}' in d)
+        self.assertEqual(d['NICK{away}'], 1)
+        self.assertEqual(d.pop('nick[Away]'), 1)
+        self.assertEqual(len(d), 0)
+
+    def test_ascii(self):
+        from iobot.state import CaseMappedDict
+        d = CaseMappedDict('ascii')
+        d['Nick[away]'] = 1
+        self.assertTrue('NICK[AWAY]' in d)
+        self.assertFalse('nick{away}' in d)
+
+class TestIrcState(TestCase):
+    def setUp(self):
+        from iobot.state import IrcState
+        self.state = IrcState()
+        self.state.add_channel('#One')
+        self.state.add_channel('#two')
+
+    def test_join_part(self):
+        state = self.state
+        state.join('#one', 'alice', 'a', 'alice.host')
+        state.join('#TWO', 'Alice')
+        self.assertEqual(len(state.users), 1)
+        self.assertEqual(state.users['ALICE'].host, 'alice.host')
+        self.assertEqual(sorted(c.name for c in state.channels_for('alice')),
+                ['#One', '#two'])
+        state.part('#one', 'alice')
+        self.assertFalse('alice' in state.channels['#one'])
+        self.assertTrue('alice' in state.users)
+        state.part('#two', 'alice')
+        self.assertFalse('alice' in state.users)
+        self.assertFalse('alice' in state.user_channels)
+
+    def test_join_is_idempotent(self):
+        self.state.join('#one', 'alice')
+        self.state.join('#one', 'alice')
+        self.assertEqual(len(self.state.channels['#one']), 1)
+
+    def test_join_unknown_channel(self):
+        self.assertTrue(self.state.join('#nope', 'alice') is None)
+        self.assertFalse('alice' in self.state.users)
+
+    def test_quit(self):
+        state = self.state
+        state.join('#one', 'alice')
+        state.join('#two', 'alice')
+        state.join('#two', 'bob')
+        state.quit('ALICE')
+        self.assertFalse('alice' in state.users)
+        self.assertFalse('alice' in state.channels['#one'])
+        self.assertFalse('alice' in state.channels['#two'])
+        self.assertTrue('bob' in state.channels['#two'])
+
+    def test_change_nick(self):
+        state = self.state
+        state.join('#one', 'alice', modes='o')
+        state.join('#two', 'alice')
+        user = state.users['alice']
+        state.change_nick('alice', 'carol')
+        self.assertTrue(state.users['carol'] is user)
+        self.assertEqual(user.nick, 'carol')
+        self.assertEqual(state.channels['#one'].modes('carol'), 'o')
+        self.assertFalse('alice' in state.channels['#two'])
+        self.assertEqual(len(state.channels_for('carol')), 2)
+
+    def test_change_nick_to_nothing(self):
+        state = self.state
+        state.join('#one', 'alice')
+        user = state.users['alice']
+        state.change_nick('alice', None)
+        self.assertTrue(state.users['alice'] is user)
+        self.assertEqual(user.nick, 'alice')
+        self.assertRaises(ValueError, state.registry.rename, user, None)
+
+    def test_remove_channel(self):
+        state = self.state
+        state.join('#one', 'alice')
+        state.join('#one', 'bob')
+        state.join('#two', 'bob')
+        state.remove_channel('#ONE')
+        self.assertFalse('#one' in state.channels)
+        self.assertFalse('alice' in state.users)
+        self.assertEqual([c.name for c in state.channels_for('bob')],
+                ['#two'])
+
+    def test_split_names_entry(self):
+        split = self.state.split_names_entry
+        self.assertEqual(split('nick'), ([], 'nick', None, None))
+        self.assertEqual(split('@+nick'), (['o', 'v'], 'nick', None, None))
+        self.assertEqual(split('+nick!u@h'), (['v'], 'nick', 'u', 'h'))
+
+    def test_set_casemapping(self):
+        state = self.state
+        state.join('#one', 'Nick[a]')
+        state.set_casemapping('ascii')
+        self.assertTrue('nick[a]' in state.users)
+        self.assertFalse('nick{a}' in state.users)
+        self.assertTrue('nick[a]' in state.channels['#ONE'])
+        state.part('#one', 'NICK[A]')
+        self.assertFalse('nick[a]' in state.users)
+
+class TestUserRegistry(TestCase):
+    def test_shared_between_states(self):
+        from iobot.state import IrcState, UserRegistry
+        registry = UserRegistry()
+        one = IrcState(registry=registry)
+        two = IrcState(registry=registry)
+        one.add_channel('#a')
+        two.add_channel('#b')
+        alice = one.join('#a', 'alice')
+        self.assertTrue(two.join('#b', 'ALICE', 'al', 'host') is alice)
+        self.assertEqual(alice.host, 'host')
+
+        one.change_nick('alice', 'carol')
+        two.change_nick('alice', 'carol')
+        self.assertEqual(alice.nick, 'carol')
+        self.assertTrue(two.users['carol'] is alice)
+        self.assertTrue('carol' in registry)
+        self.assertFalse('alice' in registry)
+
+    def test_released_when_unused(self):
+        import gc
+        from iobot.state import IrcState
+        state = IrcState()
+        state.add_channel('#a')
+        state.join('#a', 'alice')
+        self.assertEqual(len(state.registry), 1)
+        state.part('#a', 'alice')
+        gc.collect()
+        self.assertEqual(len(state.registry), 0)
+
+    def test_interned(self):
+        from iobot.state import UserRegistry
+        registry = UserRegistry()
+        host = ''.join(['example', '.com'])
+        user = registry.get('alice', 'al', host)
+        self.assertTrue(user.host is intern('example.com'))
+        self.assertFalse(hasattr(user, '__dict__'))